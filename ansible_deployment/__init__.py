@@ -12,7 +12,7 @@ from ansible_deployment.playbook import Playbook
 from ansible_deployment.inventory import Inventory
 from ansible_deployment.role import Role
 from ansible_deployment.deployment import Deployment, unlock_deployment, lock_deployment
-from ansible_deployment.config import RepoConfig, DeploymentConfig
+from ansible_deployment.config import RepoConfig, DeploymentConfig, VaultConfig
 from ansible_deployment import cli
 from ansible_deployment import cli_helpers
 
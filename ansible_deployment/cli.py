@@ -20,6 +20,12 @@ from ansible_deployment.config import (
     DEFAULT_OUTPUT_JSON_INDENT
 )
 from ansible_deployment.class_skeleton import CustomJSONEncoder
+from ansible_deployment.vault_agent import (
+    DEFAULT_AGENT_TTL,
+    VaultAgentClient,
+    agent_socket_path,
+    start_agent,
+)
 
 
 @click.group()
@@ -99,7 +105,7 @@ def show(ctx, attribute):
 
     Deployment information may be filtered by specifying attribute(s).
     """
-    with unlock_deployment(ctx.obj["DEPLOYMENT"], 'r') as deployment:
+    with unlock_deployment(ctx.obj["DEPLOYMENT"], 'e') as deployment:
         try:
             deployment.inventory.run_reader_plugins()
         except Exception as err:
@@ -137,7 +143,7 @@ def run(ctx, role, limit, extra_var, disable_host_key_checking):
     """
     deployment = ctx.obj["DEPLOYMENT"]
     try:
-        with unlock_deployment(deployment, 'r') as unlocked_deployment:
+        with unlock_deployment(deployment, 'e') as unlocked_deployment:
             cli_helpers.check_environment(unlocked_deployment)
             unlocked_deployment.run(role, limit=limit, extra_vars=extra_var,
                                     disable_host_key_checking=disable_host_key_checking)
@@ -207,7 +213,7 @@ def lock(ctx):
         deployment.deployment_dir.vault.key_file
     )
     if click.confirm(prompt):
-        deployment.deployment_dir.vault.lock()
+        deployment.deployment_dir.lock()
         deployment.inventory.plugin.delete_added_files()
         deployment.deployment_dir.delete(keep=['.git'])
         deployment.deployment_dir.vault.setup_shadow_repo(remote_config=deployment.config.deployment_repo)
@@ -229,11 +235,63 @@ def unlock(ctx, force):
         deployment.deployment_dir.vault.key_file
     )
     if click.confirm(prompt):
-        deployment.deployment_dir.vault.unlock(force)
+        deployment.deployment_dir.unlock(force)
         deployment.deployment_dir.vault.delete()
         deployment = Deployment.load(DEFAULT_DEPLOYMENT_CONFIG_PATH)
 
 
+@cli.command()
+@click.pass_context
+def rotate_key(ctx):
+    """
+    Re-encrypt deployment with a new deployment key.
+
+    The new key is written to all configured inventory writers.
+    """
+    deployment = ctx.obj["DEPLOYMENT"]
+    was_locked = deployment.deployment_dir.vault.locked
+    writers = deployment.inventory.loaded_writers
+    prompt = "Replace {} with a new key?".format(
+        deployment.deployment_dir.vault.key_file
+    )
+    if writers:
+        prompt = "{} The new key is written to inventory writers: {}.".format(
+            prompt, ", ".join(writer.name for writer in writers)
+        )
+    if click.confirm(prompt):
+        try:
+            with lock_deployment(deployment) as locked_deployment:
+                vault = locked_deployment.deployment_dir.vault
+                vault.rotate_key()
+                vault.update_shadow_repo(
+                    locked_deployment.config.deployment_repo, "Deployment key rotated."
+                )
+            if not was_locked:
+                deployment = Deployment(deployment.deployment_dir.path, deployment.config)
+                deployment.deployment_dir.deployment_repo.update(
+                    message="Deployment key rotated.", files=[str(vault.key_file)]
+                )
+        except Exception as err:
+            if ctx.obj["DEBUG"]:
+                raise
+            else:
+                raise click.ClickException(err)
+        click.echo("Deployment key written to: {}".format(vault.key_file))
+        try:
+            deployment.inventory.write_deployment_key(vault.key)
+        except Exception as err:
+            if ctx.obj["DEBUG"]:
+                raise
+            else:
+                raise click.ClickException(
+                    "Writing the new deployment key to inventory writers failed: {}. "
+                    "They still hold the old key, run 'ansible-deployment push' "
+                    "to update them.".format(err)
+                )
+        if was_locked:
+            click.echo("Commit the new key with 'ansible-deployment commit' after the next unlock.")
+
+
 @cli.command()
 @click.pass_context
 @click.argument("host", type=HostType())
@@ -242,8 +300,7 @@ def ssh(ctx, host):
     Run 'ssh' command to connect to a inventory host.
     """
     try:
-        with unlock_deployment(ctx.obj["DEPLOYMENT"], 'r') as deployment:
-            deployment.ssh(host)
+        ctx.obj["DEPLOYMENT"].ssh(host)
     except Exception as err:
         if ctx.obj["DEBUG"]:
             raise
@@ -264,7 +321,9 @@ def push(ctx, template_mode=False, force=False):
     deployment = ctx.obj["DEPLOYMENT"]
     with lock_deployment(deployment) as locked_deployment:
         try:
-            locked_deployment.deployment_dir.deployment_repo.push(force)
+            locked_deployment.deployment_dir.deployment_repo.push(
+                force, blobs=locked_deployment.deployment_dir.vault.blobs
+            )
         except Exception as err:
             if ctx.obj["DEBUG"]:
                 raise
@@ -293,7 +352,7 @@ def pull(ctx):
     """
     deployment = ctx.obj["DEPLOYMENT"]
     with lock_deployment(deployment) as locked_deployment:
-        blobs = { "deployment_data": "./deployment.tar.gz.enc" }
+        blobs = locked_deployment.deployment_dir.vault.blobs
         try:
             locked_deployment.deployment_dir.delete(keep=['.git'])
             locked_deployment.deployment_dir.deployment_repo.pull(blobs=blobs)
@@ -435,6 +494,88 @@ def fetch_key(ctx, inventory_source):
     except Exception as err:
         raise click.ClickException(err)
 
+@cli.command()
+@click.pass_context
+@click.option("--auto", is_flag=True,
+              help="Only run if the repository exceeds the maintenance thresholds.")
+def maintenance(ctx, auto):
+    """
+    Repack and prune the deployment git repository.
+    """
+    deployment_repo = ctx.obj["DEPLOYMENT"].deployment_dir.deployment_repo
+    if deployment_repo.repo is None:
+        cli_helpers.err_exit("Deployment is not initialized")
+    try:
+        before = deployment_repo.object_stats()
+        if deployment_repo.maintenance(force=not auto):
+            after = deployment_repo.object_stats()
+            click.echo("Objects: {} loose, {} packs, {} KiB -> {} loose, {} packs, {} KiB".format(
+                before["count"], before["packs"], before["size"] + before["size-pack"],
+                after["count"], after["packs"], after["size"] + after["size-pack"],
+            ))
+        else:
+            click.echo("No maintenance required.")
+    except Exception as err:
+        if ctx.obj["DEBUG"]:
+            raise
+        else:
+            raise click.ClickException(err)
+
+
+@cli.group()
+def agent():
+    """
+    Manage the vault agent serving a locked deployment from memory.
+    """
+
+
+@agent.command("start")
+@click.pass_context
+@click.option("--ttl", type=int, default=DEFAULT_AGENT_TTL, show_default=True,
+              help="Idle time in seconds after which the agent exits.")
+def agent_start(ctx, ttl):
+    """
+    Start vault agent.
+    """
+    deployment = ctx.obj["DEPLOYMENT"]
+    if not deployment.deployment_dir.vault.locked:
+        cli_helpers.err_exit("Deployment is not locked")
+    try:
+        client = start_agent(deployment.deployment_dir.path, ttl)
+        click.echo(f"Vault agent serving {client.status()['files']} files")
+    except Exception as err:
+        if ctx.obj["DEBUG"]:
+            raise
+        else:
+            raise click.ClickException(err)
+
+
+@agent.command("stop")
+@click.pass_context
+def agent_stop(ctx):
+    """
+    Stop vault agent.
+    """
+    client = VaultAgentClient(agent_socket_path(ctx.obj["DEPLOYMENT"].deployment_dir.path))
+    try:
+        client.stop()
+    except OSError:
+        cli_helpers.err_exit("Vault agent not running")
+
+
+@agent.command("status")
+@click.pass_context
+def agent_status(ctx):
+    """
+    Show vault agent status.
+    """
+    client = VaultAgentClient(agent_socket_path(ctx.obj["DEPLOYMENT"].deployment_dir.path))
+    try:
+        click.echo(json.dumps(client.status(), indent=DEFAULT_OUTPUT_JSON_INDENT))
+    except OSError:
+        cli_helpers.err_exit("Vault agent not running")
+
+
 def main():
     """
     This function is only used to set 'auto_envvars_prefix'.
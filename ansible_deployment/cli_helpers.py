@@ -74,9 +74,9 @@ def echo_file_diff(deployment_dir, file_name):
         deployment_dir (DeploymentDirectory): Deployment directory.
         file_name (str): File name to display diff for.
     """
-    if file_name in deployment_dir.deployment_repo.changes["unstaged"]:
+    if file_name in deployment_dir.deployment_repo.status["unstaged"]:
         click.echo(deployment_dir.deployment_repo.repo.git.diff("HEAD", "--", file_name))
-    elif file_name in deployment_dir.deployment_repo["staged"]:
+    elif file_name in deployment_dir.deployment_repo.status["staged"]:
         click.echo(deployment_dir.deployment_repo.repo.git.diff("--staged", "HEAD", "--", file_name))
 
 
@@ -10,18 +10,64 @@ DEFAULT_DEPLOYMENT_PATH = Path.cwd()
 DEFAULT_DEPLOYMENT_CONFIG_PATH = Path.cwd() / "deployment.json"
 DEFAULT_OUTPUT_JSON_INDENT = 2
 
-RepoConfig = namedtuple("RepoConfig", "url reference")
+RepoConfig = namedtuple(
+    "RepoConfig",
+    "url reference depth filter sparse shared_cache copy_mode",
+    defaults=(None, None, False, False, "copy"),
+)
 """
 Represents a remote git repository configuration.
 
+The clone options are only used for repositories cloned by
+ansible-deployment, like the roles repository.
+
 Args:
     url (str): A clonable git repository url.
     reference (str): Git reference to checkout.
+    depth (int): Clone and fetch only the last `depth` commits.
+    filter (str): Partial clone filter like ``blob:none``. Filtered
+                  objects are fetched on demand.
+    sparse (bool): Only check out the paths in use, like the configured roles.
+    shared_cache (bool): Share the repository objects with all deployments
+                         of the current user through a cache repository.
+                         `depth` and `filter` do not apply if set.
+    copy_mode (str): How roles are copied into the deployment. May be
+                     ``copy``, ``hardlink`` or ``reflink``.
+"""
+
+VaultConfig = namedtuple(
+    "VaultConfig",
+    "mode compression compression_level compression_threads exclude_roles "
+    "git_bundles max_git_bundles ephemeral_unlock encryption_threads",
+    defaults=("archive", "gzip", None, None, False, False, 16, False, None),
+)
+"""
+Represents the deployment vault configuration.
+
+Args:
+    mode (str): Vault mode. Either ``archive`` to store the deployment as a
+                single encrypted archive or ``incremental`` to store it as
+                content-addressed encrypted objects.
+    compression (str): Archive compression. May be ``gzip``, ``zstd`` or ``none``.
+    compression_level (int): Compression level. Defaults to the algorithm's default.
+    compression_threads (int): Number of compression threads.
+                               Defaults to the number of CPUs.
+    exclude_roles (bool): Only store the roles repo commit instead of the
+                          roles directory and rebuild it on unlock.
+    git_bundles (bool): Store the git history as a chain of encrypted
+                        incremental git bundles.
+    max_git_bundles (int): Number of bundles after which the chain is
+                           compacted into a single bundle.
+    ephemeral_unlock (bool): Unlock read-only commands into a RAM backed
+                             directory instead of the deployment directory.
+    encryption_threads (int): Number of encryption threads.
+                              Defaults to the number of CPUs.
 """
 
 DeploymentConfig = namedtuple(
     "DeploymentConfig",
-    "name deployment_repo roles_repo roles inventory_sources inventory_writers",
+    "name deployment_repo roles_repo roles inventory_sources inventory_writers vault",
+    defaults=(VaultConfig(),),
 )
 """
 Represents the deployment configuration.
@@ -39,24 +85,56 @@ Args:
     roles (sequence): A sequence of role names.
     inventory_sources (sequence): Sequence of inventory plugin names.
     inventory_writers (sequence): Sequence of inventory plugin names.
+    vault (VaultConfig): Namedtuple containing vault configuration.
 """
 
 def parse_repo_config(raw_repo_config):
     """
     Parses json repo configuration.
 
+    Unknown keys are ignored, so deployment configs with options of other
+    versions stay loadable.
+
     Args:
         raw_repo_config (dict): json repo configuration.
     Returns:
         RepoConfig: Parsed repo config as namedtuple.
     """
-
+    for key in ("url", "reference"):
+        if key not in raw_repo_config:
+            raise ValueError(f"Missing repo config option: {key}")
     repo_config = RepoConfig(
-        raw_repo_config["url"], raw_repo_config["reference"]
+        **{key: value for key, value in raw_repo_config.items() if key in RepoConfig._fields}
     )
+    if repo_config.depth is not None and repo_config.depth < 1:
+        raise ValueError(f"Invalid repo depth: {repo_config.depth}")
+    if repo_config.copy_mode not in ("copy", "hardlink", "reflink"):
+        raise ValueError(f"Invalid repo copy mode: {repo_config.copy_mode}")
     return repo_config
 
 
+def parse_vault_config(raw_vault_config):
+    """
+    Parses json vault configuration.
+
+    Unknown keys are ignored, so deployment configs with options of other
+    versions stay loadable.
+
+    Args:
+        raw_vault_config (dict): json vault configuration.
+    Returns:
+        VaultConfig: Parsed vault config as namedtuple.
+    """
+    vault_config = VaultConfig(
+        **{key: value for key, value in raw_vault_config.items() if key in VaultConfig._fields}
+    )
+    if vault_config.mode not in ("archive", "incremental"):
+        raise ValueError(f"Invalid vault mode: {vault_config.mode}")
+    if vault_config.compression not in ("gzip", "zstd", "none"):
+        raise ValueError(f"Invalid vault compression: {vault_config.compression}")
+    return vault_config
+
+
 def load_config_file(config_file_path):
     """
     Loads deployment configuration from json file.
@@ -73,5 +151,6 @@ def load_config_file(config_file_path):
         config = json.load(config_file_stream)
     config["deployment_repo"] = parse_repo_config(config['deployment_repo'])
     config["roles_repo"] = parse_repo_config(config['roles_repo'])
+    config["vault"] = parse_vault_config(config.get('vault', {}))
 
     return DeploymentConfig(**config)
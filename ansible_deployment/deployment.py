@@ -7,16 +7,60 @@ from pathlib import Path
 from collections import namedtuple
 import json
 import os
+import shutil
 import subprocess
+import tempfile
 from ansible_deployment import (
     AnsibleDeployment,
-    Role,
     Inventory,
     Playbook,
     DeploymentDirectory,
 )
-from ansible_deployment.config import load_config_file, DeploymentConfig
+from ansible_deployment.config import load_config_file
+from ansible_deployment.deployment_vault import DeploymentVaultError, ephemeral_directory
+from ansible_deployment.role_index import RoleIndex
 from ansible_deployment.exceptions import NotSupportedByPlugin
+from ansible_deployment import yaml_io
+
+
+@contextmanager
+def ephemeral_unlock_deployment(deployment):
+    """
+    Context manager function for unlocking a deployment into memory.
+
+    The locked deployment is extracted into a private directory on a RAM
+    backed file system. The deployment directory is not modified and the
+    extracted files are deleted on exit. If no RAM backed file system is
+    available, nothing is extracted and `DeploymentVaultError` is raised.
+    The representation of the unlocked deployment shows the paths of the
+    deployment directory instead of the temporary directory.
+
+    Args:
+        deployment (Deployment): Locked Deployment object.
+    Returns:
+        ansible_deployment.Deployment: unlocked Deployment object.
+    """
+    ephemeral_dir = ephemeral_directory()
+    if ephemeral_dir is None:
+        raise DeploymentVaultError(
+            "No RAM backed directory (/dev/shm or $XDG_RUNTIME_DIR) available to unlock "
+            "into, disable the vault option ephemeral_unlock to unlock in place"
+        )
+    ephemeral_path = Path(tempfile.mkdtemp(prefix="ansible-deployment-", dir=ephemeral_dir))
+    cwd = os.getcwd()
+    try:
+        deployment.deployment_dir.extract(ephemeral_path)
+        os.chdir(ephemeral_path)
+        unlocked_deployment = Deployment(ephemeral_path, deployment.config)
+        deployment_path = deployment.deployment_dir.path
+        unlocked_deployment.deployment_dir.filtered_representation["path"] = str(deployment_path)
+        unlocked_deployment.playbook.filtered_representation = (
+            deployment_path / unlocked_deployment.playbook.path.relative_to(ephemeral_path)
+        )
+        yield unlocked_deployment
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(ephemeral_path, ignore_errors=True)
 
 
 @contextmanager
@@ -24,30 +68,50 @@ def unlock_deployment(deployment, mode='w'):
     """
     Context manager function for unlocking deployment.
 
+    If the deployment content did not change while it was unlocked,
+    the previously encrypted deployment and shadow repository are reused.
+
+    Mode 'e' is meant for read-only commands. It unlocks into memory with
+    `ephemeral_unlock_deployment` if the vault's `ephemeral_unlock` option
+    is enabled and behaves like 'r' otherwise.
+
     Args:
         deployment (Deployment): Deployment object.
-        mode (str): Open mode (either 'r' or 'w').
+        mode (str): Open mode (either 'r', 'w' or 'e').
     Returns:
         ansible_deployment.Deployment: unlocked Deployment object.
     """
     was_locked = deployment.deployment_dir.vault.locked
+    if mode == 'e':
+        if was_locked and deployment.config.vault.ephemeral_unlock:
+            with ephemeral_unlock_deployment(deployment) as unlocked_deployment:
+                yield unlocked_deployment
+            return
+        mode = 'r'
     unlocked_deployment = deployment
     if was_locked:
-        deployment.deployment_dir.vault.unlock()
+        deployment.deployment_dir.unlock()
+        unlock_fingerprint = deployment.deployment_dir.vault.unlock_fingerprint
         unlocked_deployment = Deployment(deployment.deployment_dir.path, deployment.config)
     try:
         yield unlocked_deployment
     finally:
         if was_locked:
-            if mode == 'w':
-                unlocked_deployment.deployment_dir.vault.lock()
-                unlocked_deployment.deployment_dir.delete(keep=['.git'])
-                unlocked_deployment.inventory.plugin.delete_added_files()
-            else:
-                unlocked_deployment.deployment_dir.vault.lock_file_path.touch()
+            vault = unlocked_deployment.deployment_dir.vault
+            if vault.unchanged_since(unlock_fingerprint):
                 unlocked_deployment.deployment_dir.delete(keep=['.git', 'deployment.tar.gz.enc'])
                 unlocked_deployment.inventory.plugin.delete_added_files()
-            unlocked_deployment.deployment_dir.vault.setup_shadow_repo(unlocked_deployment.config.deployment_repo)
+                vault.relock()
+            else:
+                if mode == 'w':
+                    unlocked_deployment.deployment_dir.lock()
+                    unlocked_deployment.deployment_dir.delete(keep=['.git'])
+                    unlocked_deployment.inventory.plugin.delete_added_files()
+                else:
+                    vault.lock_file_path.touch()
+                    unlocked_deployment.deployment_dir.delete(keep=['.git', 'deployment.tar.gz.enc'])
+                    unlocked_deployment.inventory.plugin.delete_added_files()
+                vault.setup_shadow_repo(unlocked_deployment.config.deployment_repo)
 
 @contextmanager
 def lock_deployment(deployment):
@@ -63,7 +127,7 @@ def lock_deployment(deployment):
     if was_locked:
         locked_deployment = deployment
     else:
-        deployment.deployment_dir.vault.lock()
+        deployment.deployment_dir.lock()
         deployment.inventory.plugin.delete_added_files()
         deployment.deployment_dir.delete(keep=['.git'])
         deployment.deployment_dir.vault.setup_shadow_repo(deployment.config.deployment_repo)
@@ -72,7 +136,7 @@ def lock_deployment(deployment):
         yield locked_deployment
     finally:
         if not was_locked:
-            locked_deployment.deployment_dir.vault.unlock()
+            locked_deployment.deployment_dir.unlock()
             locked_deployment.deployment_dir.vault.delete()
 
 
@@ -117,7 +181,7 @@ class Deployment(AnsibleDeployment):
         self.inventory = Inventory(
             path, config, deployment_key=None, read_sources=read_sources
         )
-        self.deployment_dir = DeploymentDirectory(path, config.roles_repo, config.deployment_repo, deployment_key=self.inventory.deployment_key)
+        self.deployment_dir = DeploymentDirectory(path, config.roles_repo, config.deployment_repo, deployment_key=self.inventory.deployment_key, vault_config=config.vault)
         self.inventory.deployment_key = self.deployment_dir.vault.key
         self.config = config
         self.roles = self._create_role_objects(config.roles)
@@ -140,11 +204,8 @@ class Deployment(AnsibleDeployment):
         Returns:
             list: A list of initialized role objects.
         """
-        parsed_roles = []
-        for role_name in role_names:
-            role_path = self.deployment_dir.path / '.roles.git' / role_name
-            parsed_roles.append(Role(name=role_name, path=role_path))
-        return parsed_roles
+        role_index = RoleIndex(self.deployment_dir.roles_repo)
+        return role_index.load_roles(role_names, self.deployment_dir.roles_repo_path)
 
     def initialize_deployment_directory(self):
         """
@@ -174,6 +235,7 @@ class Deployment(AnsibleDeployment):
         """
         json_dump = self.config._asdict()
         json_dump["roles_repo"] = self.config.roles_repo._asdict()
+        json_dump["vault"] = self.config.vault._asdict()
         with open(self.deployment_dir.config_file, "w") as config_file_stream:
             json.dump(json_dump, config_file_stream, indent=4)
 
@@ -200,7 +262,7 @@ class Deployment(AnsibleDeployment):
         if extra_vars:
             for extra_var in extra_vars:
                 command += ["-e", extra_var]
-        subprocess.run(command, check=True, env=deployment_env)
+        subprocess.run(command, check=True, env=deployment_env, cwd=self.deployment_dir.path)
 
     def update_inventory(self, sources_override=()):
         """
@@ -213,13 +275,7 @@ class Deployment(AnsibleDeployment):
             for override in sources_override:
                 if override not in self.config.inventory_sources and override != "local":
                     raise KeyError(f"Invalid inventory source override: {override}")
-            self.config = DeploymentConfig(
-                            name=self.config.name,
-                            deployment_repo=self.config.deployment_repo,
-                            roles_repo=self.config.roles_repo,
-                            roles=self.config.roles,
-                            inventory_sources=sources_override,
-                            inventory_writers=self.config.inventory_writers)
+            self.config = self.config._replace(inventory_sources=sources_override)
         self.inventory = Inventory(
             self.deployment_dir.path, self.config, self.deployment_dir.vault.key,
             self.roles
@@ -232,13 +288,7 @@ class Deployment(AnsibleDeployment):
         Args:
             inventory_source (str): Name of inventory source to fetch key from.
         """
-        self.config = DeploymentConfig(
-                        name=self.config.name,
-                        deployment_repo=self.config.deployment_repo,
-                        roles_repo=self.config.roles_repo,
-                        roles=self.config.roles,
-                        inventory_sources=(inventory_source,),
-                        inventory_writers=self.config.inventory_writers)
+        self.config = self.config._replace(inventory_sources=(inventory_source,))
         self.inventory = Inventory(
             self.deployment_dir.path, self.config, None,
             self.roles
@@ -281,18 +331,67 @@ class Deployment(AnsibleDeployment):
             with open(known_hosts_file_path, "a") as known_hosts_file:
                 known_hosts_file.write(keyscan.stdout.decode())
 
+    def _read_locked_connection_details(self, host):
+        """
+        Get ssh connection details for a given host from a locked vault.
+
+        Only the inventory files needed for `host` are decrypted. The user
+        defaults to "ansible" if the inventory does not define one.
+
+        Args:
+            host (str): Inventory hostname.
+
+        Returns:
+            dict: Connection details (user, hostname, port)
+        """
+        vault = self.deployment_dir.vault
+        hosts = yaml_io.safe_load(vault.read_file("hosts.yml")) or {}
+        if host not in (hosts.get("all", {}).get("hosts") or {}):
+            raise KeyError("Host not in inventory.")
+        host_vars = {}
+        group_vars = {"ansible_user": "ansible"}
+        for file_name, variables in ((f"host_vars/{host}", host_vars),
+                                     ("group_vars/all", group_vars)):
+            try:
+                variables.update(yaml_io.safe_load(vault.read_file(file_name)) or {})
+            except FileNotFoundError:
+                pass
+        return Inventory.connection_details(host, host_vars, group_vars)
+
     def ssh(self, host):
         """
         Run ssh to connect to a given deployment host as `ansible_user`.
 
+        If the deployment is locked, connection details and the ssh key
+        are read from the vault without unlocking it.
+
         Args:
             host (str): Target host.
         """
-        connection_details = self.get_connection_details(host)
-        ssh_key = self.deployment_dir.ssh_private_key
+        vault = self.deployment_dir.vault
+        if vault.locked:
+            connection_details = self._read_locked_connection_details(host)
+            ssh_key_name = self.deployment_dir.ssh_private_key.relative_to(
+                self.deployment_dir.path
+            )
+            with vault.temporary_file(ssh_key_name) as ssh_key:
+                self._run_ssh(ssh_key, connection_details)
+        else:
+            connection_details = self.get_connection_details(host)
+            self._run_ssh(self.deployment_dir.ssh_private_key, connection_details)
+
+    @staticmethod
+    def _run_ssh(ssh_key, connection_details):
+        """
+        Run ssh with given key and connection details.
+
+        Args:
+            ssh_key (Path): Path to ssh private key.
+            connection_details (dict): Connection details (user, hostname, port)
+        """
         subprocess.run(
             ["ssh", "-i", ssh_key, "-l", connection_details["ansible_user"],
-             "-p", connection_details["ansible_port"],
+             "-p", str(connection_details["ansible_port"]),
              connection_details["ansible_host"]],
             check=True,
         )
@@ -6,14 +6,19 @@ or classes in the future.
 """
 
 import shutil
-import yaml
 import subprocess
+import tarfile
 from pathlib import Path
 from ansible_deployment.class_skeleton import AnsibleDeployment
-from ansible_deployment.role import Role
+from ansible_deployment.role_sync import RoleSync
 from ansible_deployment.deployment_vault import DeploymentVault
 from ansible_deployment.deployment_repo import DeploymentRepo
 from ansible_deployment.config import load_config_file
+from ansible_deployment import yaml_io
+
+
+class DeploymentDirectoryError(Exception):
+    pass
 
 
 class DeploymentDirectory(AnsibleDeployment):
@@ -25,6 +30,7 @@ class DeploymentDirectory(AnsibleDeployment):
         roles_repo (RepoConfig): Namedtuple containing roles repo config.
         config_file (path): Path to deployment config file.
         vault_files (sequence): Sequence of files to put in vault.
+        vault_config (VaultConfig): Namedtuple containing vault config.
 
     Attributes:
         path (Path): Path to deployment directory.
@@ -32,6 +38,8 @@ class DeploymentDirectory(AnsibleDeployment):
         roles_repo (DeploymentRepo): Roles src repository.
         deployment_repo (DeploymentRepo): Deployment git repository.
         config_file (Path): Path to deployment config file.
+        roles_commit_file (Path): File recording the roles repo commit
+                                  of a vault locked without roles.
         vault (DeploymentVault): Vault object for file encryption.
     """
 
@@ -44,7 +52,7 @@ class DeploymentDirectory(AnsibleDeployment):
     directory_layout = ("host_vars", "group_vars", "roles", ".ssh", ".roles.git", ".git")
     deployment_files = ["playbook.yml", "hosts.yml", "ansible.cfg"]
 
-    def __init__(self, path, roles_repo_config, deployment_repo_config, deployment_key_file="deployment.key", deployment_key=None):
+    def __init__(self, path, roles_repo_config, deployment_repo_config, deployment_key_file="deployment.key", deployment_key=None, vault_config=None):
         self._roles_repo_config = roles_repo_config
 
         self.path = Path(path)
@@ -62,6 +70,7 @@ class DeploymentDirectory(AnsibleDeployment):
         self.roles_path = self.path / "roles"
         self.roles_repo_path = self.path / ".roles.git"
         self.roles_repo = DeploymentRepo(self.roles_repo_path, remote_config=roles_repo_config)
+        self.roles_commit_file = self.path / ".roles.commit"
 
         git_repo_content = [] + self.deployment_files
         git_repo_content += self.directory_layout[:-2]
@@ -70,13 +79,17 @@ class DeploymentDirectory(AnsibleDeployment):
         self.deployment_repo = DeploymentRepo(self.path, files=git_repo_content, remote_config=deployment_repo_config)
 
         if self.deployment_repo.repo is not None:
-            self.vault_files = self.deployment_repo.current_content + ['.git']
+            self.vault_files = sorted(self.deployment_repo.current_content) + ['.git']
         else:
             self.vault_files = []
-        self.vault = DeploymentVault(self.vault_files, self.path, deployment_key)
+        excluded_files = ()
+        if vault_config is not None and vault_config.exclude_roles:
+            excluded_files = (self.roles_path.name,)
+        self.vault = DeploymentVault(
+            self.vault_files, self.path, deployment_key, vault_config, excluded_files
+        )
 
         if not self.vault.locked and self.deployment_repo.repo:
-            self.deployment_repo.update_changed_files()
             if "deployment.json" in self.vault.files:
                 self.vault.files.remove("deployment.json")
 
@@ -89,16 +102,138 @@ class DeploymentDirectory(AnsibleDeployment):
             if not directory_path.exists():
                 directory_path.mkdir()
 
-    def _copy_roles_to_deployment(self):
+    def _copy_roles_to_deployment(self, roles_path=None):
         """
         Copy roles to deployment directory.
+
+        A sparse roles repo checkout is restricted to the configured roles first.
+        Roles are synchronized incrementally, so only changed files are
+        written and files of removed roles are deleted.
+
+        Args:
+            roles_path (Path): Target roles directory. Defaults to `self.roles_path`.
+
+        Returns:
+            dict: Number of ``copied``, ``updated``, ``deleted`` and
+                  ``unchanged`` files.
         """
+        roles_path = roles_path or self.roles_path
         roles = load_config_file(self.config_file).roles
-        shutil.rmtree(self.roles_path)
-        self.roles_path.mkdir()
-        for role_name in roles:
-            role = Role(name=role_name, path=self.roles_repo_path / role_name)
-            role.copy_to(self.roles_path)
+        if self._roles_repo_config.sparse:
+            self.roles_repo.sparse_checkout(roles)
+        role_sync = RoleSync(self.roles_repo_path, roles_path, self._roles_repo_config.copy_mode)
+        return role_sync.sync(roles)
+
+    def _restore_roles(self, commit):
+        """
+        Rebuild the roles directory from the roles repo at a given commit.
+
+        The roles repo is cloned if it does not exist. The roles are read
+        with `_archive_roles`, so HEAD and local changes of an existing
+        roles repo are kept.
+
+        Args:
+            commit (str): Roles repo commit sha.
+        """
+        if self.roles_repo.repo is None:
+            self.roles_repo.clone()
+        self._archive_roles(commit, self.roles_path)
+
+    def _fetch_roles_commit(self, commit):
+        """
+        Fetch a commit into the roles repo if it is missing.
+
+        A shallow roles repo fetches `commit` directly, if it is not part
+        of the fetched history. Neither HEAD nor the working tree change.
+
+        Args:
+            commit (str): Roles repo commit sha.
+        """
+        repo = self.roles_repo.repo
+        try:
+            repo.commit(commit)
+        except ValueError:
+            self.roles_repo.fetch()
+            try:
+                repo.commit(commit)
+            except ValueError:
+                self.roles_repo.fetch(commit)
+
+    def _archive_roles(self, commit, roles_path):
+        """
+        Write the configured roles at a given commit to a roles directory.
+
+        The roles are read from the roles repo's object database with
+        `git archive`, so its HEAD and working tree are left untouched.
+
+        Args:
+            commit (str): Roles repo commit sha.
+            roles_path (Path): Target roles directory.
+        """
+        if self.roles_repo.repo is None:
+            raise DeploymentDirectoryError(
+                f"Roles repo {self.roles_repo_path} is missing, unlock the deployment first"
+            )
+        self._fetch_roles_commit(commit)
+        roles = [role.rstrip("/") for role in load_config_file(self.config_file).roles]
+        roles_path.mkdir()
+        with subprocess.Popen(
+            ["git", "-C", str(self.roles_repo_path), "archive", "--format=tar", commit, "--", *roles],
+            stdout=subprocess.PIPE,
+        ) as process:
+            with tarfile.open(fileobj=process.stdout, mode="r|") as archive:
+                archive.extractall(roles_path)
+        if process.returncode != 0:
+            raise DeploymentDirectoryError(f"Reading roles at commit {commit} failed")
+
+    def lock(self):
+        """
+        Lock the deployment vault.
+
+        If roles are excluded from the vault, only the current roles repo
+        commit is recorded in `self.roles_commit_file`.
+        """
+        if self.roles_path.name in self.vault.excluded_files and self.roles_repo.repo:
+            self.roles_commit_file.write_text(self.roles_repo.repo.head.commit.hexsha)
+        self.vault.lock()
+
+    def unlock(self, force_unlock=False):
+        """
+        Unlock the deployment vault.
+
+        The roles directory is rebuilt if the vault was locked without it.
+        `self.roles_commit_file` is only needed while locked and removed
+        afterwards.
+
+        Args:
+            force_unlock (bool): Unlock even if verification failed.
+        """
+        self.vault.unlock(force_unlock)
+        if self.roles_commit_file.exists() and not self.roles_path.exists():
+            self._restore_roles(self.roles_commit_file.read_text().strip())
+        self.roles_commit_file.unlink(missing_ok=True)
+
+    def extract(self, target_path):
+        """
+        Extract a locked deployment into another directory.
+
+        Besides the vault content, the config and key file are copied and
+        the roles repo is linked, so `target_path` can be loaded as an
+        unlocked deployment. Roles excluded from the vault are read from
+        the roles repo at the recorded commit without changing it.
+
+        Args:
+            target_path (path): Empty target directory.
+        """
+        target_path = Path(target_path)
+        self.vault.extract(target_path)
+        shutil.copy2(self.config_file, target_path)
+        shutil.copy2(self.vault.key_file, target_path)
+        if self.roles_repo_path.exists():
+            (target_path / self.roles_repo_path.name).symlink_to(self.roles_repo_path.resolve())
+        roles_path = target_path / self.roles_path.name
+        if self.roles_commit_file.exists() and not roles_path.exists():
+            self._archive_roles(self.roles_commit_file.read_text().strip(), roles_path)
 
     def write_role_defaults_to_group_vars(self, roles):
         """
@@ -113,9 +248,9 @@ class DeploymentDirectory(AnsibleDeployment):
             if (group_vars_file_path).exists():
                 group_vars_file_path.unlink()
 
-            for defaults_file in role.defaults.values():
+            for defaults_file in (role.defaults or {}).values():
                 with open(group_vars_file_path, "a") as group_vars_file_stream:
-                    yaml.dump(defaults_file["data"], group_vars_file_stream)
+                    yaml_io.dump(defaults_file["data"], group_vars_file_stream)
 
     def _write_ansible_cfg(self):
         """
@@ -155,6 +290,7 @@ class DeploymentDirectory(AnsibleDeployment):
         """
         if full_delete:
             self.vault.delete(delete_shadowgit=True)
+            self.roles_commit_file.unlink(missing_ok=True)
 
         files_to_delete = self.deployment_repo.current_content
         for path_name in files_to_delete:
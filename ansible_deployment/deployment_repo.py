@@ -2,18 +2,136 @@
 Module containting the DeploymentRepo class.
 """
 
+import atexit
+import fcntl
+import hashlib
+import os
+import shutil
+import tempfile
 from pathlib import Path
-import gitdb.exc as git_exc
 from git import Repo
 from git.exc import GitCommandError
 from ansible_deployment.class_skeleton import AnsibleDeployment
 
 DEPLOYMENT_CORE_FILES = ('deployment.key', 'deployment.json')
+NEW_FILE_DIRECTORIES = ('host_vars/', 'group_vars/', 'roles/')
+MAINTENANCE_LOOSE_OBJECTS = 1000
+MAINTENANCE_LOOSE_SIZE_KIB = 256 * 1024
+MAINTENANCE_PACKS = 20
+SHARED_CACHE_PATH = (
+    Path(os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache")) / "ansible-deployment" / "roles"
+)
+
+_repos = {}
+_content_cache = {}
 
 class RepoOriginError(Exception):
     pass
 
 
+def get_repo(path):
+    """
+    Get the shared Repo object of a repository.
+
+    Repo objects keep long-lived ``git cat-file --batch`` processes for
+    object and tree lookups. Sharing one object per repository path lets
+    all DeploymentRepo instances reuse these processes. A new object is
+    created if the git directory was replaced since.
+
+    Args:
+        path (Path): Local path to git repository.
+
+    Returns:
+        git.Repo: Shared Repo object.
+    """
+    path = Path(path).resolve()
+    git_dir_stat = (path / ".git").stat()
+    git_dir_id = (git_dir_stat.st_dev, git_dir_stat.st_ino)
+    if path in _repos:
+        repo_git_dir_id, repo = _repos[path]
+        if repo_git_dir_id == git_dir_id:
+            return repo
+        repo.close()
+    repo = Repo(path)
+    _repos[path] = (git_dir_id, repo)
+    return repo
+
+
+def close_repo(path):
+    """
+    Close the shared Repo object of a repository.
+
+    Must be called before the git directory is moved or deleted.
+
+    Args:
+        path (Path): Local path to git repository.
+    """
+    cached = _repos.pop(Path(path).resolve(), None)
+    if cached is not None:
+        cached[1].close()
+
+
+@atexit.register
+def close_repos():
+    """
+    Close all shared Repo objects and their git processes.
+    """
+    for _, repo in _repos.values():
+        repo.close()
+    _repos.clear()
+
+
+def shared_cache_path(url):
+    """
+    Get the path of the shared cache repository of a remote url.
+
+    Args:
+        url (str): Remote repository url.
+
+    Returns:
+        Path: Path to bare cache repository.
+    """
+    return SHARED_CACHE_PATH / hashlib.sha256(url.encode()).hexdigest()
+
+
+def update_shared_cache(url):
+    """
+    Create or fetch the shared cache repository of a remote url.
+
+    The cache is a bare repository holding all branches and tags of the
+    remote. Repositories cloned from the cache use its objects through
+    git alternates, so objects are only fetched once per user and host.
+    The cache is never pruned, since those repositories depend on it.
+    Concurrent updates are serialized by a lock file.
+
+    Args:
+        url (str): Remote repository url.
+
+    Returns:
+        Path: Path to bare cache repository.
+    """
+    cache_path = shared_cache_path(url)
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(cache_path.with_name(cache_path.name + ".lock"), "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        if not cache_path.exists():
+            tmp_path = Path(tempfile.mkdtemp(prefix=".init-", dir=cache_path.parent))
+            try:
+                with Repo.init(tmp_path, bare=True) as repo:
+                    repo.git.remote("add", "origin", url)
+                    repo.git.config("remote.origin.fetch", "+refs/heads/*:refs/heads/*")
+                    repo.git.config("--add", "remote.origin.fetch", "+refs/tags/*:refs/tags/*")
+                    repo.git.config("gc.auto", "0")
+                    repo.git.config("gc.pruneExpire", "never")
+            except BaseException:
+                shutil.rmtree(tmp_path, ignore_errors=True)
+                raise
+            tmp_path.rename(cache_path)
+        with Repo(cache_path) as repo:
+            repo.git.fetch("--prune", "origin")
+    return cache_path
+
+
 class DeploymentRepo(AnsibleDeployment):
     """
     Represents a git repository used with ansible_deployment.
@@ -28,23 +146,28 @@ class DeploymentRepo(AnsibleDeployment):
         path (Path): Local path to git repository.
         remote_config (RepoConfig): Repository origin information.
         content (list): List of files included in repository.
+        current_content (set): Top level paths of the ``master`` branch
+                               except `DEPLOYMENT_CORE_FILES`.
         changes (dict): Dictionary containing repository changes.
-                        Valid keys are: 'all', 'staged' and 'unstaged'.
+                        Valid keys are: 'all', 'staged', 'unstaged' and 'new'.
+        status (dict): Sets of 'staged', 'unstaged', 'untracked' and 'new'
+                       paths for membership tests.
     """
 
-    def __init__(self, path, remote_config=None, files=None, blobs={}):
+    def __init__(self, path, remote_config=None, files=None, blobs=None):
         self.remote_config = remote_config
         self.path = path
 
         self.content = files
-        self.current_content = []
-        self.blobs = blobs
+        self.current_content = set()
+        self.blobs = blobs if blobs is not None else {}
         self.changes = {"all": [], "staged": [], "unstaged": [], "new": []}
+        self.status = {"staged": set(), "unstaged": set(), "untracked": set(), "new": set()}
         self._git_path = self.path / ".git"
         self._encrypted = (self._git_path / "HEAD.enc").exists()
 
         if (self._git_path / "HEAD").exists() and not self._encrypted:
-            self.repo = Repo(self.path)
+            self.repo = get_repo(self.path)
             self.update_remote_config(remote_config)
             self.update_changed_files()
             self.current_content = self._get_current_content()
@@ -55,17 +178,22 @@ class DeploymentRepo(AnsibleDeployment):
         """
         Get current repo content.
 
+        The content is cached per commit of ``master``, so the tree is
+        only listed again after ``master`` moved.
+
         Args:
             ignore_paths (sequence): Sequence of paths to ignore from content list.
 
         Returns:
-            list: List of paths.
+            set: Set of paths.
         """
-        current_content = self.repo.git.ls_tree('--name-only', 'master').split('\n')
-        for path in ignore_paths:
-            if path in current_content:
-                current_content.remove(path)
-        return current_content
+        commit = self.repo.commit('master')
+        cache_key = (Path(self.path).resolve(), commit.hexsha, tuple(ignore_paths))
+        if cache_key not in _content_cache:
+            _content_cache[cache_key] = frozenset(
+                item.path for item in commit.tree
+            ).difference(ignore_paths)
+        return set(_content_cache[cache_key])
         
     def update_remote_config(self, remote_config):
         """
@@ -83,45 +211,140 @@ class DeploymentRepo(AnsibleDeployment):
         elif self.repo.remotes.origin.url != remote_config.url:
             self.repo.remotes.origin.set_url(remote_config.url)
 
+    def _read_status(self):
+        """
+        Read the repository status with a single ``git status`` call.
+
+        Returns:
+            dict: Sets of 'staged', 'unstaged' and 'untracked' paths.
+        """
+        output = self.repo.git.status(
+            "--porcelain", "-z", "--no-renames", "--untracked-files=all",
+            strip_newline_in_stdout=False
+        )
+        status = {"staged": set(), "unstaged": set(), "untracked": set()}
+        for entry in output.split("\0"):
+            if not entry:
+                continue
+            index_status, worktree_status, path = entry[0], entry[1], entry[3:]
+            if index_status == "?":
+                status["untracked"].add(path)
+                continue
+            if index_status != " ":
+                status["staged"].add(path)
+            if worktree_status != " ":
+                status["unstaged"].add(path)
+        return status
+
     def update_changed_files(self):
         """
         Update `self.changes` dict to represent state of git repo.
         """
-        for untracked_file in self.repo.untracked_files:
-            if untracked_file in self.changes["new"]:
+        status = self._read_status()
+        if not self.repo.head.is_valid():
+            status["staged"] = {"deployment.json"}
+        content = {str(path) for path in self.content} if self.content is not None else set()
+        for untracked_file in sorted(status["untracked"]):
+            if untracked_file in self.status["new"]:
                 continue
-            if "host_vars/" in untracked_file:
-                self.changes["new"].append(untracked_file)
-            elif "group_vars/" in untracked_file:
-                self.changes["new"].append(untracked_file)
-            elif "roles/" in untracked_file:
-                self.changes["new"].append(untracked_file)
-            elif self.content is not None and untracked_file in self.content:
+            if (any(directory in untracked_file for directory in NEW_FILE_DIRECTORIES)
+                    or untracked_file in content):
+                self.status["new"].add(untracked_file)
                 self.changes["new"].append(untracked_file)
 
-        self.changes["unstaged"] = [diff.a_path for diff in self.repo.index.diff(None)]
-        try:
-            self.changes["staged"] = [
-                diff.a_path for diff in self.repo.index.diff("HEAD")
-            ]
-        except git_exc.BadName:
-            self.changes["staged"] = ["deployment.json"]
+        self.status.update(status)
+        self.changes["unstaged"] = sorted(status["unstaged"])
+        self.changes["staged"] = sorted(status["staged"])
         self.changes["all"] = self.changes["staged"] + self.changes["unstaged"]
 
-    def _cleanup_blobs(self):
-        current_tags = self.repo.git.tag().split("\n")
-        for blob_name in self.blobs:
-            if blob_name in current_tags:
-                self.repo.git.tag('-d', blob_name)
-        self.repo.git.gc()
-        self.repo.git.prune()
-
     def _store_blobs(self):
+        """
+        Store `self.blobs` as git blob objects referenced by annotated tags.
+
+        git streams the files into its object database. Filters are
+        disabled, so the blobs match the files byte for byte. Existing
+        tags are replaced, the previous blobs are removed by `maintenance`.
+        """
         for blob_name in self.blobs:
             blob_path = self.blobs[blob_name]
-            blob_hash = self.repo.git.hash_object('-w', blob_path)
+            blob_hash = self.repo.git.hash_object('-w', '--no-filters', str(blob_path))
             message = "ansible-deployment blob object"
-            self.repo.git.tag(blob_hash, a=blob_name, m=message)
+            self.repo.git.tag(blob_hash, a=blob_name, m=message, f=True)
+
+    def object_stats(self):
+        """
+        Get object database statistics.
+
+        Returns:
+            dict: Integer values of ``git count-objects -v`` by name.
+        """
+        stats = {}
+        for line in self.repo.git.count_objects("-v").splitlines():
+            name, value = line.split(":", 1)
+            stats[name] = int(value)
+        return stats
+
+    def maintenance(self, force=False):
+        """
+        Repack and prune the object database if it exceeds a threshold.
+
+        Loose objects are packed incrementally and unreachable loose
+        objects, like replaced blobs, are pruned once there are more than
+        `MAINTENANCE_LOOSE_OBJECTS` of them or they take up more than
+        `MAINTENANCE_LOOSE_SIZE_KIB`. All packs are consolidated once
+        there are more than `MAINTENANCE_PACKS`.
+
+        Args:
+            force (bool): Run maintenance regardless of thresholds.
+
+        Returns:
+            bool: True if maintenance was run.
+        """
+        stats = self.object_stats()
+        consolidate = force or stats["packs"] > MAINTENANCE_PACKS
+        if not consolidate and (
+            stats["count"] <= MAINTENANCE_LOOSE_OBJECTS
+            and stats["size"] <= MAINTENANCE_LOOSE_SIZE_KIB
+        ):
+            return False
+        if consolidate:
+            self.repo.git.repack("-a", "-d", "-q")
+        else:
+            self.repo.git.repack("-d", "-q")
+        self.repo.git.prune()
+        return True
+
+    def stage(self, files):
+        """
+        Stage a sequence of files.
+
+        Existing files are added and missing files are removed from the
+        index. All additions are written to the index at once and all
+        removals are applied by a single ``git rm`` call.
+
+        Args:
+            files (sequence): Files and directories to stage.
+        """
+        added_files = []
+        removed_files = []
+        for git_file in dict.fromkeys(str(git_file) for git_file in files):
+            if Path(git_file).exists():
+                added_files.append(git_file)
+            else:
+                removed_files.append(git_file)
+        if removed_files:
+            try:
+                self.repo.git.rm("--cached", "-r", "-q", "--ignore-unmatch", "--", *removed_files)
+            except GitCommandError:
+                # Retry one by one, so a single invalid path does not
+                # prevent the removal of the other files.
+                for git_file in removed_files:
+                    try:
+                        self.repo.git.rm("--cached", "-r", "-q", "--ignore-unmatch", "--", git_file)
+                    except GitCommandError:
+                        pass
+        if added_files:
+            self.repo.index.add(added_files)
 
     def update(
         self,
@@ -141,29 +364,74 @@ class DeploymentRepo(AnsibleDeployment):
         """
         if files is None:
             files = self.content
-        for git_file in files:
-            if Path(git_file).exists():
-                self.repo.index.add(str(git_file))
-            else:
-                try:
-                    self.repo.index.remove(str(git_file))
-                except GitCommandError as e:
-                    pass
+        self.stage(files)
 
         self.update_changed_files()
         commit_message = "ansible-deployment: {}".format(message.capitalize())
         if len(self.changes["staged"]) > 0 or force_commit:
             self.repo.index.commit(commit_message)
+            self.current_content = self._get_current_content()
 
-        self._cleanup_blobs()
         self._store_blobs()
+        self.maintenance()
 
     def _pull_blobs(self):
+        """
+        Write the blob objects referenced by the tags in `self.blobs` to their paths.
+
+        Blob content is streamed from git to a temporary file replacing
+        the target path once complete.
+        """
         for blob_name in self.blobs:
-            blob_path = self.blobs[blob_name]
-            blob_data = self.repo.git.show(blob_name).split("\n")[5]
-            with open(blob_path, "w") as blob_file:
-                blob_file.write(blob_data)
+            blob_path = Path(self.blobs[blob_name])
+            tmp_path = blob_path.with_name(blob_path.name + ".tmp")
+            try:
+                with open(tmp_path, "wb") as blob_file:
+                    self.repo.git.cat_file(
+                        "blob", f"{blob_name}^{{blob}}", output_stream=blob_file
+                    )
+            except GitCommandError:
+                tmp_path.unlink(missing_ok=True)
+                raise
+            tmp_path.replace(blob_path)
+
+    @property
+    def _shared_cache(self):
+        return self.remote_config is not None and self.remote_config.shared_cache
+
+    def _fetch_options(self):
+        """
+        Get the clone and fetch options of `self.remote_config`.
+
+        Returns:
+            dict: Keyword arguments for git commands.
+        """
+        if self.remote_config is None or self._shared_cache:
+            return {}
+        options = {}
+        if self.remote_config.depth is not None:
+            options["depth"] = self.remote_config.depth
+        return options
+
+    def fetch(self, refspec=None):
+        """
+        Fetch changes from origin.
+
+        With a shared cache the cache repository is fetched from origin
+        and the repository fetches from the cache, which only updates its
+        refs since all objects are shared.
+
+        Args:
+            refspec (str): Refspec to fetch. Ignored with a shared cache,
+                           which contains all branches and tags.
+        """
+        if self._shared_cache:
+            cache_path = update_shared_cache(self.remote_config.url)
+            self.repo.git.fetch(
+                "--force", "--tags", str(cache_path), "+refs/heads/*:refs/remotes/origin/*"
+            )
+        else:
+            self.repo.remotes.origin.fetch(refspec, **self._fetch_options())
 
     def pull(self, blobs={}):
         """
@@ -172,19 +440,29 @@ class DeploymentRepo(AnsibleDeployment):
         if 'origin' not in self.repo.remotes:
             raise RepoOriginError("Missing git remote origin")
         self.blobs = blobs
-        self.repo.remotes.origin.fetch()
+        self.fetch()
         if self.remote_config is not None:
             self.repo.git.checkout(self.remote_config.reference)
         if not self.repo.head.is_detached:
             self.repo.git.reset(f'origin/{self.remote_config.reference}', '--hard')
-            self.repo.git.pull('-f', '--tags', 'origin', self.remote_config.reference)
+            if not self._shared_cache:
+                self.repo.git.pull(
+                    '-f', '--tags', 'origin', self.remote_config.reference,
+                    **self._fetch_options()
+                )
             self._pull_blobs()
 
-    def push(self, force_push=False):
+    def push(self, force_push=False, blobs=None):
         """
         Push changes to origin.
+
+        Args:
+            force_push (bool): Whether or not to force push.
+            blobs (dict): Name (key) and Path (value) of object blobs to push.
         """
         push_successful = False
+        if blobs is not None:
+            self.blobs = blobs
         if 'origin' not in self.repo.remotes:
             raise RepoOriginError("Missing git remote origin")
         self.repo.remotes.origin.fetch()
@@ -205,14 +483,36 @@ class DeploymentRepo(AnsibleDeployment):
         Clone remote reopository.
 
         Clones the repository specified in `self.remote_config` into
-        `self.path`
+        `self.path`. A sparse clone only checks out top level files until
+        paths are added with `sparse_checkout`. With a shared cache the
+        repository is cloned from the cache repository and origin is set
+        to the remote url afterwards.
         """
-        self.repo = Repo.clone_from(
-            self.remote_config.url, self.path, branch=self.remote_config.reference
-        )
+        url = self.remote_config.url
+        options = dict(self._fetch_options(), branch=self.remote_config.reference)
+        if self.remote_config.filter is not None and not self._shared_cache:
+            options["filter"] = self.remote_config.filter
+        if self.remote_config.sparse:
+            options["sparse"] = True
+        if self._shared_cache:
+            url = str(update_shared_cache(url))
+            options["shared"] = True
+        Repo.clone_from(url, self.path, **options).close()
+        self.repo = get_repo(self.path)
+        self.update_remote_config(self.remote_config)
+
+    def sparse_checkout(self, paths):
+        """
+        Restrict the working tree to top level files and the given directories.
+
+        Args:
+            paths (sequence): Directory paths relative to the repository.
+        """
+        self.repo.git.sparse_checkout("set", "--cone", *paths)
 
     def init(self):
         """
         Initialize empty repository.
         """
-        self.repo = Repo.init(self.path)
+        Repo.init(self.path).close()
+        self.repo = get_repo(self.path)
@@ -3,18 +3,60 @@ Module containing the DeploymentVault class.
 """
 
 import hashlib
+import io
 import shutil
+import os
+import subprocess
 import tarfile
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from pathlib import Path
 from cryptography.fernet import Fernet
 from ansible_deployment.class_skeleton import AnsibleDeployment
-from ansible_deployment.deployment_repo import DeploymentRepo
+from ansible_deployment.config import VaultConfig
+from ansible_deployment.deployment_repo import DeploymentRepo, close_repo
+from ansible_deployment.vault_agent import VaultAgentClient, VaultAgentError, agent_socket_path
+from ansible_deployment.vault_bundles import VaultBundleChain, VaultBundleChainError
+from ansible_deployment.vault_compression import BlockCompressor, open_decompressed
+from ansible_deployment.vault_format import (
+    MAGIC,
+    HashingReader,
+    HashingWriter,
+    VaultStreamReader,
+    VaultFormatError,
+    VaultStreamWriter,
+    is_container,
+    reencrypt,
+)
+from ansible_deployment.vault_index import IndexingTarFile, VaultIndex, VaultIndexError
+from ansible_deployment.vault_objects import VaultObjectStore, VaultObjectStoreError
+
+EPHEMERAL_DIRECTORIES = ("/dev/shm", "XDG_RUNTIME_DIR")
 
 
 class DeploymentVaultError(Exception):
     pass
 
 
+def ephemeral_directory():
+    """
+    Get a writable directory on a RAM backed file system.
+
+    `EPHEMERAL_DIRECTORIES` are tried in order. Names not starting with
+    a slash are looked up as environment variables.
+
+    Returns:
+        str: Directory path or None if no directory is usable.
+    """
+    for directory in EPHEMERAL_DIRECTORIES:
+        if not directory.startswith("/"):
+            directory = os.environ.get(directory)
+        if directory and os.path.isdir(directory) and os.access(directory, os.W_OK):
+            return directory
+    return None
+
+
 class DeploymentVault(AnsibleDeployment):
     """
     Represents a deployment vault used for file encryption.
@@ -22,6 +64,9 @@ class DeploymentVault(AnsibleDeployment):
     Args:
         vault_files (sequence): Sequence of paths defining vault content.
         path (path): Vault root directory.
+        key (bytes): Key used for encryption.
+        config (VaultConfig): Namedtuple containing vault config.
+        excluded_files (sequence): Top level paths never stored in the vault.
 
     Attributes:
         path (Path): Vault root directory.
@@ -29,19 +74,31 @@ class DeploymentVault(AnsibleDeployment):
         new_key (bool): True if a new key was created.
         key_file (Path): Path to key file.
                          Defaults to `self.path / 'deployment.key'`
+        staged_key_file (Path): Path to the new key during key rotation.
         key (byte): Key used for encryption.
         files (sequence): Sequence of paths defining vault content.
+        config (VaultConfig): Namedtuple containing vault config.
+        excluded_files (sequence): Top level paths never stored in the vault.
+        restored_files (list): Top level paths restored by the last unlock.
+        unlock_fingerprint (dict): Fingerprint of the vault content taken
+                                   after the last unlock.
 
     Note:
         If `key_file` is not present at initialization, it will be created.
     """
 
+    filtered_attributes = ["config", "unlock_fingerprint"]
     encryption_suffix = ".enc"
     key_file_name = "deployment.key"
     tar_file_name = "deployment.tar.gz"
     lock_file_name = ".LOCKED"
+    object_store_name = "deployment.objects"
+    bundle_chain_name = "deployment.bundles"
+    index_file_name = "deployment.index.enc"
 
-    def __init__(self, vault_files, path, key=None):
+    def __init__(self, vault_files, path, key=None, config=None, excluded_files=()):
+        self.config = config if config is not None else VaultConfig()
+        self.excluded_files = excluded_files
         self.new_key = False
         self.locked = False
         self.path = Path(path)
@@ -52,7 +109,13 @@ class DeploymentVault(AnsibleDeployment):
         self.encrypted_tar_path = Path(str(self.tar_path) + self.encryption_suffix)
         self.encrypted_tar_sha256sum_path = Path(str(self.encrypted_tar_path) + ".SHA256")
         self.encrypted_tar_sha256sum = None
+        self.index_path = self.path / self.index_file_name
+        self.staged_tar_path = Path(str(self.encrypted_tar_path) + ".new")
+        self.staged_index_path = Path(str(self.index_path) + ".new")
+        self.restored_files = []
+        self.unlock_fingerprint = None
         self.key_file = self.path / self.key_file_name
+        self.staged_key_file = Path(str(self.key_file) + ".new")
         self._load_key(key)
         self.files = vault_files
         self.locked_files = list(
@@ -81,13 +144,23 @@ class DeploymentVault(AnsibleDeployment):
             self._save_key()
             self.new_key = True
 
-    def _save_key(self):
+    def _save_key(self, key=None, key_file=None):
         """
-        Write `self.key` to `self.key_file`.
+        Write a key to a key file readable only by the current user.
+
+        The key is written to disk before this method returns.
+
+        Args:
+            key (bytes): Key to write. Defaults to `self.key`.
+            key_file (Path): Target file. Defaults to `self.key_file`.
         """
-        with open(self.key_file, "wb") as fobj:
-            fobj.write(self.key)
-        self.key_file.chmod(0o600)
+        key_file = key_file or self.key_file
+        file_descriptor = os.open(key_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with open(file_descriptor, "wb") as fobj:
+            fobj.write(key if key is not None else self.key)
+            fobj.flush()
+            os.fsync(fobj.fileno())
+        key_file.chmod(0o600)
 
     @staticmethod
     def _generate_key():
@@ -101,73 +174,114 @@ class DeploymentVault(AnsibleDeployment):
 
     def _encrypt_file(self, file_path):
         """
-        Encrypt a single file.
+        Encrypt a single file into a streaming vault container.
+
+        The plain file is replaced by ``file_path.enc``.
 
         Args:
             file_path (Path): Path object for target file.
         """
-        cipher_suite = Fernet(self.key)
-        with open(file_path, "rb") as fobj:
-            plain_data = fobj.read()
-        if int(oct(file_path.stat().st_mode)[-3]) < 6:
-            file_path.chmod(0o640)
-        with open(file_path, "wb") as fobj:
-            fobj.write(cipher_suite.encrypt(plain_data))
-        file_path.replace(str(file_path) + self.encryption_suffix)
-
-    def _sha256sum(self, file_path):
-        """
-        Create sha256 sum of file and write it to ``file_path.SHA256``.
-        """
-        h  = hashlib.sha256()
-        b  = bytearray(128*1024)
-        mv = memoryview(b)
-        with open(file_path, 'rb', buffering=0) as f:
-            for n in iter(lambda : f.readinto(mv), 0):
-                h.update(mv[:n])
-        return h.hexdigest()
+        encrypted_file_path = Path(str(file_path) + self.encryption_suffix)
+        with open(file_path, "rb") as src, open(encrypted_file_path, "wb") as dst:
+            with VaultStreamWriter(dst, self.key, threads=self.config.encryption_threads) as writer:
+                shutil.copyfileobj(src, writer)
+        file_path.unlink()
 
     def _encrypt_files(self, files):
         """
         Encrypt a sequence of files.
 
+        The files are written to a tar stream that is compressed, encrypted
+        and hashed in a single pass. No plain archive is written to disk.
+        Compression is configured by `self.config`.
+
+        The position of every member, compressed block and encrypted frame
+        is recorded in an encrypted index written to `self.index_path`.
+
         Args:
             files (sequence): Sequence of Path objects.
         """
-        with tarfile.open(self.tar_path, 'w:gz') as tar:
-            for file_name in files:
-                file_path = Path(file_name)
-                if file_path.exists() and file_path.name != self.key_file.name:
-                    tar.add(file_path)
-        self._encrypt_file(self.tar_path)
-        self.encrypted_tar_sha256sum = self._sha256sum(self.encrypted_tar_path)
+        sha256 = hashlib.sha256()
+        index = VaultIndex(self.index_path, self.key)
+        with open(self.encrypted_tar_path, "wb") as fobj:
+            with HashingWriter(fobj, sha256) as hashing_writer:
+                with VaultStreamWriter(
+                    hashing_writer, self.key, threads=self.config.encryption_threads
+                ) as writer:
+                    with BlockCompressor(
+                        writer,
+                        self.config.compression,
+                        self.config.compression_level,
+                        self.config.compression_threads,
+                        on_block=index.add_block,
+                    ) as compressor:
+                        with IndexingTarFile.open(
+                            fileobj=compressor, mode="w|", index=index
+                        ) as tar:
+                            for file_name in files:
+                                file_path = Path(file_name)
+                                if file_path.exists() and file_path.name != self.key_file.name:
+                                    tar.add(file_path, filter=self._filter_tarinfo)
+        self.encrypted_tar_sha256sum = sha256.hexdigest()
+        index.write(
+            self.encrypted_tar_sha256sum,
+            self.config.compression,
+            writer.frame_size,
+            writer.frame_offsets,
+        )
 
     def _decrypt_files(self, files):
         """
         Decrypt a sequence of files.
 
+        Files are decrypted independently on
+        `self.config.encryption_threads` threads.
+
         Args:
             files (sequence): Sequence of Path objects.
         """
+        file_paths = []
         for file_name in files:
             file_path = Path(file_name)
-            if not file_path.exists():
-                pass
-            elif file_path.is_file():
-                self._decrypt_file(file_path)
+            if file_path.is_file():
+                file_paths.append(file_path)
             elif file_path.is_dir():
-                files_in_subdir = list(file_path.glob("*"))
-                self._decrypt_files(files_in_subdir)
+                file_paths.extend(path for path in sorted(file_path.glob("**/*")) if path.is_file())
+        cipher_suite = Fernet(self.key)
+        threads = self.config.encryption_threads or os.cpu_count() or 1
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            for _ in executor.map(
+                lambda file_path: self._decrypt_file(file_path, cipher_suite), file_paths
+            ):
+                pass
 
-    def _decrypt_file(self, file_path):
+    def _decrypt_file(self, file_path, cipher_suite=None):
         """
         Decrypt a single file.
 
         Args:
             file_path (Path): Path object for target file.
+            cipher_suite (Fernet): Cipher used for legacy files.
         """
-        cipher_suite = Fernet(self.key)
         unencrypted_file_path = str(file_path)[: -len(self.encryption_suffix)]
+        if not is_container(file_path):
+            self._decrypt_legacy_file(file_path, unencrypted_file_path, cipher_suite)
+            return
+        with open(file_path, "rb") as src, open(unencrypted_file_path, "wb") as dst:
+            with VaultStreamReader(src, self.key, threads=1) as reader:
+                shutil.copyfileobj(reader, dst)
+
+    def _decrypt_legacy_file(self, file_path, unencrypted_file_path, cipher_suite=None):
+        """
+        Decrypt a file encrypted as a single Fernet token.
+
+        Args:
+            file_path (Path): Path object for encrypted file.
+            unencrypted_file_path (str): Path of decrypted file.
+            cipher_suite (Fernet): Cipher used for decryption.
+        """
+        if cipher_suite is None:
+            cipher_suite = Fernet(self.key)
         with open(file_path, "rb") as fobj:
             encrypted_data = fobj.read()
         with open(unencrypted_file_path, "wb") as fobj:
@@ -192,13 +306,25 @@ class DeploymentVault(AnsibleDeployment):
         Args:
             remote_config (RepoConfig): RepoConfig Namedtuple.
         """
-        exclude_files = ('deployment.key', '.terraform', 'deployment.tar.gz.enc', '.ssh')
-        include_files = ('.LOCKED', '.drone.yml', '.gitlab-ci', '.gitignore')
-
-
+        close_repo(self.path)
         shutil.rmtree(self.git_path)
         if self.shadow_git_path.exists():
             shutil.move(self.shadow_git_path, self.git_path)
+        self.update_shadow_repo(remote_config, "Shadow repository activated.")
+
+    def update_shadow_repo(self, remote_config, message):
+        """
+        Commit the encrypted vault files to the shadow repository.
+
+        Tracked files missing on disk, like objects or bundles removed
+        by a key rotation or compaction, are removed from the repository.
+
+        Args:
+            remote_config (RepoConfig): RepoConfig Namedtuple.
+            message (str): Commit message.
+        """
+        exclude_files = ('deployment.key', '.terraform', 'deployment.tar.gz.enc', '.ssh')
+        include_files = ('.LOCKED', '.roles.commit', '.drone.yml', '.gitlab-ci', '.gitignore')
 
         deployment_files = list(
             self.path.glob("[!.]*")
@@ -210,29 +336,241 @@ class DeploymentVault(AnsibleDeployment):
         for file in deployment_files:
             if file.name not in exclude_files and file.exists():
                 shadow_repo_files.append(file)
-        shadow_repo = DeploymentRepo(self.path, files=shadow_repo_files, remote_config=remote_config)
-        shadow_repo.blobs['deployment_data'] = self.encrypted_tar_path
+        shadow_repo = DeploymentRepo(self.path, files=shadow_repo_files,
+                                     remote_config=remote_config, blobs=self.blobs)
         shadow_repo.init()
+        deleted_files = shadow_repo.repo.git.ls_files("-z", "--deleted").split("\0")
+        shadow_repo_files += [self.path / file_name for file_name in deleted_files if file_name]
 
         shadow_repo.update(
-            message="Shadow repository activated.",
+            message=message,
             force_commit=False,
             files=shadow_repo_files
         )
 
-    def _restore_deployment_dir(self):
+    @property
+    def object_store(self):
+        """
+        Object store used in incremental mode.
+        """
+        return VaultObjectStore(
+            self.path / self.object_store_name, self.key, self.config.encryption_threads
+        )
+
+    @property
+    def bundle_chain(self):
+        """
+        Bundle chain storing the git history if `git_bundles` is enabled.
+        """
+        return VaultBundleChain(
+            self.path / self.bundle_chain_name, self.key, self.config.encryption_threads
+        )
+
+    @property
+    def blobs(self):
+        """
+        Name (key) and Path (value) of files stored as git blob objects.
         """
-        Restores deployment dir from tar archive.
+        if self.config.mode == "incremental":
+            return {}
+        return {"deployment_data": self.encrypted_tar_path}
+
+    def _open_archive(self, fobj):
         """
+        Open an encrypted archive for streaming extraction.
+
+        Args:
+            fobj (file): Binary file object of the encrypted archive.
+
+        Returns:
+            tarfile.TarFile: Tar archive reading from the decrypted stream.
+        """
+        if fobj.peek(len(MAGIC))[:len(MAGIC)] == MAGIC:
+            reader = io.BufferedReader(
+                VaultStreamReader(fobj, self.key, threads=self.config.encryption_threads)
+            )
+        else:
+            cipher_suite = Fernet(self.key)
+            reader = io.BufferedReader(io.BytesIO(cipher_suite.decrypt(fobj.read())))
+        return tarfile.open(fileobj=open_decompressed(reader), mode="r|")
+
+    @staticmethod
+    def _merge_tree(source, destination):
+        """
+        Move all entries of `source` into `destination`.
+
+        Existing files are replaced and existing directories are merged.
 
+        Args:
+            source (Path): Source directory.
+            destination (Path): Destination directory.
+        """
+        for source_path in source.iterdir():
+            destination_path = destination / source_path.name
+            if source_path.is_dir() and not source_path.is_symlink() and destination_path.is_dir():
+                DeploymentVault._merge_tree(source_path, destination_path)
+            else:
+                if destination_path.is_dir() and not destination_path.is_symlink():
+                    shutil.rmtree(destination_path)
+                source_path.replace(destination_path)
+
+    def _extract_archive(self, target_path, expected_sha256sum, force_unlock=False):
+        """
+        Extract the encrypted archive into a directory.
+
+        The archive is hashed, decrypted and extracted in a single read.
+
+        Args:
+            target_path (Path): Empty target directory.
+            expected_sha256sum (str): Expected sha256 sum of the encrypted archive.
+            force_unlock (bool): Do not fail if verification failed.
+
+        Returns:
+            list: Names of all extracted members.
+        """
+        sha256 = hashlib.sha256()
+        with open(self.encrypted_tar_path, "rb") as fobj:
+            hashing_reader = HashingReader(fobj, sha256)
+            with self._open_archive(io.BufferedReader(hashing_reader)) as tar:
+                tar.extractall(target_path)
+                member_names = tar.getnames()
+            hashing_reader.drain()
+        if sha256.hexdigest() != expected_sha256sum and not force_unlock:
+            raise DeploymentVaultError("Verification of encrypted deployment failed")
+        return member_names
+
+    def _restore_deployment_dir(self, expected_sha256sum, force_unlock=False):
+        """
+        Restores deployment dir from the encrypted archive.
+
+        The archive is extracted into a staging directory. Its content is
+        only moved into the deployment directory if the hash matches
+        `expected_sha256sum`.
+
+        Args:
+            expected_sha256sum (str): Expected sha256 sum of the encrypted archive.
+            force_unlock (bool): Restore even if verification failed.
+        """
+        staging_path = Path(tempfile.mkdtemp(prefix=".unlock-", dir=self.path))
+        try:
+            member_names = self._extract_archive(staging_path, expected_sha256sum, force_unlock)
+            if self.git_path.exists():
+                close_repo(self.path)
+                shutil.move(self.git_path, self.shadow_git_path)
+            self._merge_tree(staging_path, self.path)
+        finally:
+            shutil.rmtree(staging_path, ignore_errors=True)
+        self.restored_files = sorted({Path(name).parts[0] for name in member_names})
+
+    def _load_object_store_manifest(self, force_unlock=False):
+        """
+        Load and verify the object store manifest.
+
+        Args:
+            force_unlock (bool): Skip verification.
+
+        Returns:
+            dict: Manifest entries by relative path.
+        """
+        expected_hash = None
+        if not force_unlock:
+            expected_hash = self.object_store.manifest_sha256sum_path.read_text()
+        try:
+            return self.object_store.load_manifest(expected_hash)
+        except VaultObjectStoreError as err:
+            raise DeploymentVaultError("Verification of encrypted deployment failed") from err
+
+    def _restore_from_object_store(self, force_unlock=False):
+        """
+        Restores deployment dir from the object store.
+
+        Args:
+            force_unlock (bool): Restore even if verification failed.
+        """
+        entries = self._load_object_store_manifest(force_unlock)
         if self.git_path.exists():
+            close_repo(self.path)
             shutil.move(self.git_path, self.shadow_git_path)
+        self.object_store.restore(self.path, entries)
+        self.restored_files = sorted({Path(name).parts[0] for name in entries})
 
-        with tarfile.open(self.tar_path) as tar:
-            tar.extractall(self.path)
+    def extract(self, target_path):
+        """
+        Extract the content of a locked vault into another directory.
 
-        self.tar_path.unlink()
+        The vault stays locked and the deployment directory is not modified.
+        The files are served by a running vault agent if there is one.
 
+        Args:
+            target_path (path): Empty target directory.
+        """
+        target_path = Path(target_path)
+        if not self.locked:
+            raise DeploymentVaultError("Deployment is not locked")
+        agent_entries = self._read_agent_entries()
+        if agent_entries is not None:
+            self._write_entries(target_path, agent_entries)
+        elif self.object_store.exists() and not self.encrypted_tar_path.exists():
+            self.object_store.restore(target_path, self._load_object_store_manifest())
+        else:
+            self._extract_archive(target_path, self.encrypted_tar_sha256sum_path.read_text())
+        if (target_path / self.git_path.name).exists():
+            self._restore_git_history(git_path=target_path / self.git_path.name)
+
+    def _is_excluded(self, file_name):
+        """
+        Check if a path is not stored in the vault.
+
+        Paths below one of `self.excluded_files` and the key file are
+        excluded. The git object directory is excluded if the git
+        history is stored in the bundle chain.
+
+        Args:
+            file_name (str): Path relative to `self.path`.
+
+        Returns:
+            bool: True if path is excluded from the vault.
+        """
+        parts = Path(file_name).parts
+        if not parts:
+            return False
+        if parts[0] in self.excluded_files or parts[-1] == self.key_file.name:
+            return True
+        return self.config.git_bundles and parts[:2] == (self.git_path.name, "objects")
+
+    def _filter_tarinfo(self, tarinfo):
+        return None if self._is_excluded(tarinfo.name) else tarinfo
+
+    def _store_git_history(self, files):
+        """
+        Store the git history in the bundle chain if `git_bundles` is enabled.
+
+        Args:
+            files (sequence): Sequence of files stored in the vault.
+        """
+        if (self.config.git_bundles and self.git_path.name in map(str, files)
+                and self.git_path.exists()):
+            self.bundle_chain.store(self.git_path, self.config.max_git_bundles)
+        else:
+            self.bundle_chain.delete()
+
+    def _restore_git_history(self, force_unlock=False, git_path=None):
+        """
+        Restore the git objects from the bundle chain.
+
+        Args:
+            force_unlock (bool): Restore even if verification failed.
+            git_path (Path): Target git directory. Defaults to `self.git_path`.
+        """
+        if not self.bundle_chain.exists():
+            return
+        expected_hash = None
+        if not force_unlock:
+            expected_hash = self.bundle_chain.manifest_sha256sum_path.read_text()
+        try:
+            self.bundle_chain.restore(git_path or self.git_path, expected_hash)
+        except VaultBundleChainError as err:
+            raise DeploymentVaultError("Verification of encrypted git history failed") from err
 
     def lock(self):
         """
@@ -245,13 +583,147 @@ class DeploymentVault(AnsibleDeployment):
         repository.
         """
         if not self.locked:
-            self._encrypt_files(self.files)
-            self._write_hash()
+            files = [
+                file_name for file_name in self.files if not self._is_excluded(file_name)
+            ]
+            self._store_git_history(files)
+            if self.config.mode == "incremental":
+                self.encrypted_tar_sha256sum = self.object_store.store(
+                    self.path, files, exclude=self._is_excluded
+                )
+                self.encrypted_tar_path.unlink(missing_ok=True)
+                self.encrypted_tar_sha256sum_path.unlink(missing_ok=True)
+                self.index_path.unlink(missing_ok=True)
+            else:
+                self._encrypt_files(files)
+                self._write_hash()
+                self.object_store.delete()
             self.locked = True
             self.lock_file_path.touch()
         else:
             raise DeploymentVaultError("Deployment already locked")
 
+    def _prepare_archive_rotation(self, new_key):
+        """
+        Re-encrypt the archive and its index with a new key into staged files.
+
+        The archive is verified against its sha256 sum while it is
+        re-encrypted. The current archive and index stay untouched.
+
+        Args:
+            new_key (bytes): New key.
+
+        Returns:
+            str: sha256 sum of the re-encrypted archive.
+        """
+        expected_hash = self.encrypted_tar_sha256sum_path.read_text()
+        index = self._load_index()
+        try:
+            with open(self.encrypted_tar_path, "rb") as src, \
+                    open(self.staged_tar_path, "w+b") as dst:
+                sha256sum, new_sha256sum, frame_offsets = reencrypt(
+                    src, dst, self.key, new_key, self.config.encryption_threads
+                )
+        except VaultFormatError as err:
+            raise DeploymentVaultError("Decryption of deployment failed") from err
+        if sha256sum != expected_hash:
+            raise DeploymentVaultError("Verification of encrypted deployment failed")
+        if index is not None:
+            index.path = self.staged_index_path
+            index.key = new_key
+            index.write(new_sha256sum, index.compression, index.frame_size, frame_offsets)
+        return new_sha256sum
+
+    def _abort_key_rotation(self, object_store, bundle_chain):
+        """
+        Remove all files staged by a failed key rotation.
+
+        Args:
+            object_store (VaultObjectStore): Object store being rotated.
+            bundle_chain (VaultBundleChain): Bundle chain being rotated.
+        """
+        self.staged_tar_path.unlink(missing_ok=True)
+        self.staged_index_path.unlink(missing_ok=True)
+        object_store.abort_key_rotation()
+        bundle_chain.abort_key_rotation()
+        self.staged_key_file.unlink(missing_ok=True)
+
+    def rotate_key(self, new_key=None):
+        """
+        Re-encrypt the locked vault with a new key.
+
+        The archive or object store, the archive index and the bundle
+        chain are re-encrypted as streams from the old to the new key,
+        so no plaintext file is written and memory usage is constant.
+
+        Rotation is done in two phases. First every container is verified
+        against its sha256 sum and re-encrypted into staged files, while
+        the vault stays unchanged and readable with the old key. If this
+        fails, the staged files are removed. Only then the new key is
+        written to `self.staged_key_file` and the staged files replace
+        the current ones. Finally the staged key replaces `self.key_file`.
+        If the rotation is interrupted after the new key was staged,
+        `self.staged_key_file` holds the key of the replaced containers.
+
+        A running vault agent is stopped, since it holds the old key.
+
+        Args:
+            new_key (bytes): New key. A key is generated if omitted.
+
+        Returns:
+            bytes: New key.
+        """
+        if not self.locked:
+            raise DeploymentVaultError("Deployment must be locked to rotate its key")
+        new_key = new_key if new_key is not None else self._generate_key()
+        try:
+            VaultAgentClient(agent_socket_path(self.path)).stop()
+        except (OSError, VaultAgentError):
+            pass
+        object_store = self.object_store
+        bundle_chain = self.bundle_chain
+        rotate_archive = self.encrypted_tar_path.exists()
+        rotate_object_store = not rotate_archive and object_store.exists()
+        rotate_bundle_chain = bundle_chain.exists()
+        try:
+            if rotate_archive:
+                new_sha256sum = self._prepare_archive_rotation(new_key)
+            elif rotate_object_store:
+                try:
+                    object_store.prepare_key_rotation(new_key)
+                except (VaultFormatError, VaultObjectStoreError) as err:
+                    raise DeploymentVaultError(
+                        "Verification of encrypted deployment failed"
+                    ) from err
+            if rotate_bundle_chain:
+                try:
+                    bundle_chain.prepare_key_rotation(
+                        new_key, bundle_chain.manifest_sha256sum_path.read_text()
+                    )
+                except (VaultFormatError, VaultBundleChainError) as err:
+                    raise DeploymentVaultError(
+                        "Verification of encrypted git history failed"
+                    ) from err
+            self._save_key(new_key, self.staged_key_file)
+        except BaseException:
+            self._abort_key_rotation(object_store, bundle_chain)
+            raise
+        if rotate_archive:
+            self.staged_tar_path.replace(self.encrypted_tar_path)
+            self.encrypted_tar_sha256sum = new_sha256sum
+            self._write_hash()
+            if self.staged_index_path.exists():
+                self.staged_index_path.replace(self.index_path)
+            else:
+                self.index_path.unlink(missing_ok=True)
+        elif rotate_object_store:
+            self.encrypted_tar_sha256sum = object_store.commit_key_rotation()
+        if rotate_bundle_chain:
+            bundle_chain.commit_key_rotation()
+        self.staged_key_file.replace(self.key_file)
+        self.key = new_key
+        return new_key
+
     def _write_hash(self):
         """
         Write sha256sum to file.
@@ -259,11 +731,6 @@ class DeploymentVault(AnsibleDeployment):
         with open(self.encrypted_tar_sha256sum_path, 'w') as f:
             f.write(self.encrypted_tar_sha256sum)
 
-    def _verify_hash(self, file_path, expected_sha256sum):
-        """Verify sha256 sum of file against an expected value."""
-        sha256sum = self._sha256sum(file_path)
-        return expected_sha256sum == sha256sum
-
     def unlock(self, force_unlock=False):
         """
         Decrypts all vault files and restores the deployment repository.
@@ -272,22 +739,369 @@ class DeploymentVault(AnsibleDeployment):
         to ``self.path / '.git.shadow/config``.
         """
         if self.locked:
-            with open(self.encrypted_tar_sha256sum_path) as f:
-                expected_hash = f.read()
-            valid_hash = self._verify_hash(self.encrypted_tar_path, expected_hash)
-            if not valid_hash and not force_unlock:
-                raise DeploymentVaultError("Verification of encrypted deployment failed")
-            self._decrypt_file(self.encrypted_tar_path)
-            self._restore_deployment_dir()
+            if self.object_store.exists() and not self.encrypted_tar_path.exists():
+                self._restore_from_object_store(force_unlock)
+            else:
+                with open(self.encrypted_tar_sha256sum_path) as f:
+                    expected_hash = f.read()
+                self._restore_deployment_dir(expected_hash, force_unlock)
+            self._restore_git_history(force_unlock)
+            self._exclude_vault_directories()
+            self.unlock_fingerprint = self.fingerprint(self.restored_files)
             self.locked = False
             self.lock_file_path.unlink()
         else:
             raise DeploymentVaultError("Deployment already unlocked")
 
+    def _exclude_vault_directories(self):
+        """
+        Exclude the object store and bundle chain from the unlocked repository.
+
+        Both are kept while the deployment is unlocked, so the next lock
+        only stores changes. They are added to ``.git/info/exclude``, so
+        they do not show up as untracked files.
+        """
+        if not self.git_path.is_dir():
+            return
+        exclude_path = self.git_path / "info" / "exclude"
+        patterns = [f"/{self.object_store_name}/", f"/{self.bundle_chain_name}/"]
+        existing = exclude_path.read_text().splitlines() if exclude_path.exists() else []
+        missing = [pattern for pattern in patterns if pattern not in existing]
+        if missing:
+            exclude_path.parent.mkdir(exist_ok=True)
+            with open(exclude_path, "a") as exclude_file:
+                exclude_file.write("".join(f"{pattern}\n" for pattern in missing))
+
+    def _load_index(self):
+        """
+        Load the archive index if it matches the current archive.
+
+        Returns:
+            VaultIndex: Loaded index or None if no usable index exists.
+        """
+        if not self.index_path.exists() or not self.encrypted_tar_sha256sum_path.exists():
+            return None
+        index = VaultIndex(self.index_path, self.key)
+        try:
+            index.load()
+        except (VaultIndexError, VaultFormatError, ValueError):
+            return None
+        if index.archive_sha256sum != self.encrypted_tar_sha256sum_path.read_text():
+            return None
+        return index
+
+    def _scan_archive(self, file_name):
+        """
+        Read a single file by decrypting the archive up to its member.
+
+        Args:
+            file_name (str): Archive member name.
+
+        Returns:
+            bytes: File content.
+        """
+        with open(self.encrypted_tar_path, "rb") as fobj:
+            with self._open_archive(io.BufferedReader(fobj)) as tar:
+                for member in tar:
+                    if member.name == file_name and member.isfile():
+                        return tar.extractfile(member).read()
+        raise FileNotFoundError(file_name)
+
+    def read_file(self, file_name):
+        """
+        Read a single vault file without unlocking the vault.
+
+        While locked, the file is served by a running vault agent or read
+        from the object store in incremental mode or from the encrypted
+        archive. Only the blocks containing the file are decrypted if the
+        archive's index is available, otherwise the archive is decrypted
+        up to the file.
+
+        Args:
+            file_name (str): Path relative to `self.path`.
+
+        Returns:
+            bytes: File content.
+
+        Raises:
+            FileNotFoundError: If the file is not part of the vault.
+        """
+        file_name = Path(file_name).as_posix()
+        if not self.locked:
+            return (self.path / file_name).read_bytes()
+        agent = self._agent_client()
+        if agent is not None:
+            try:
+                return agent.read_file(file_name, self.state_sha256sum)
+            except FileNotFoundError:
+                raise
+            except (OSError, VaultAgentError):
+                pass
+        if self.object_store.exists() and not self.encrypted_tar_path.exists():
+            try:
+                return self.object_store.read(file_name)
+            except VaultObjectStoreError as err:
+                raise DeploymentVaultError(f"Reading {file_name} failed: {err}") from err
+        index = self._load_index()
+        if index is None:
+            return self._scan_archive(file_name)
+        return index.read_member(self.encrypted_tar_path, file_name)
+
+    def _agent_client(self):
+        """
+        Get a client for a vault agent serving this deployment.
+
+        Returns:
+            VaultAgentClient: Client or None if no agent is running.
+        """
+        try:
+            agent = VaultAgentClient(agent_socket_path(self.path))
+            if agent.available():
+                return agent
+        except (OSError, VaultAgentError):
+            pass
+        return None
+
+    def _read_agent_entries(self):
+        """
+        Read all entries of a locked vault from a running vault agent.
+
+        Returns:
+            list: Entries like yielded by `read_entries` or None if no
+                  agent is serving the vault.
+        """
+        agent = self._agent_client()
+        if agent is None:
+            return None
+        try:
+            return agent.read_entries(self.state_sha256sum)
+        except (OSError, VaultAgentError):
+            return None
+
+    def read_entries(self, use_agent=True):
+        """
+        Read all entries of a locked vault.
+
+        Entries are dicts with a `type` of ``file``, ``dir``, ``symlink``
+        or ``link`` (a hard link to the earlier entry `target`) and the
+        `mode` and `mtime_ns` of files and directories. Entries are
+        served by a running vault agent if `use_agent` is set. The
+        encrypted archive is verified after its last entry was read.
+
+        Args:
+            use_agent (bool): Read entries from a running vault agent.
+
+        Yields:
+            tuple: Path relative to `self.path`, entry and file content,
+                   which is None for all but files.
+        """
+        if use_agent:
+            entries = self._read_agent_entries()
+            if entries is not None:
+                yield from entries
+                return
+        if self.object_store.exists() and not self.encrypted_tar_path.exists():
+            object_store = self.object_store
+            entries = object_store.load_manifest(
+                object_store.manifest_sha256sum_path.read_text()
+            )
+            for relative_path, entry in entries.items():
+                data = None
+                if entry["type"] == "file":
+                    data = object_store.read_object(entry["object"])
+                yield relative_path, entry, data
+            return
+        sha256 = hashlib.sha256()
+        with open(self.encrypted_tar_path, "rb") as fobj:
+            hashing_reader = HashingReader(fobj, sha256)
+            with self._open_archive(io.BufferedReader(hashing_reader)) as tar:
+                for member in tar:
+                    yield member.name, self._tar_entry(member), (
+                        tar.extractfile(member).read() if member.isfile() else None
+                    )
+            hashing_reader.drain()
+        if sha256.hexdigest() != self.encrypted_tar_sha256sum_path.read_text():
+            raise DeploymentVaultError("Verification of encrypted deployment failed")
+
+    @staticmethod
+    def _tar_entry(member):
+        """
+        Describe an archive member like an object store manifest entry.
+
+        Args:
+            member (tarfile.TarInfo): Archive member.
+
+        Returns:
+            dict: Entry.
+        """
+        if member.isdir():
+            return {"type": "dir", "mode": member.mode}
+        if member.issym():
+            return {"type": "symlink", "target": member.linkname}
+        if member.islnk():
+            return {"type": "link", "target": member.linkname}
+        return {"type": "file", "mode": member.mode, "mtime_ns": int(member.mtime * 10 ** 9)}
+
+    def read_files(self):
+        """
+        Read all files of a locked vault.
+
+        Files are served by a running vault agent if there is one.
+
+        Yields:
+            tuple: Path relative to `self.path` and file content.
+        """
+        for relative_path, entry, data in self.read_entries():
+            if entry["type"] == "file":
+                yield relative_path, data
+
+    @staticmethod
+    def _write_entries(target_path, entries):
+        """
+        Write vault entries into a directory.
+
+        Hard links are created last, so their targets exist.
+
+        Args:
+            target_path (Path): Target directory.
+            entries (sequence): Entries like yielded by `read_entries`.
+        """
+        links = []
+        for relative_path, entry, data in entries:
+            file_path = target_path / relative_path
+            if entry["type"] == "dir":
+                file_path.mkdir(parents=True, exist_ok=True)
+                file_path.chmod(entry["mode"])
+                continue
+            file_path.parent.mkdir(parents=True, exist_ok=True)
+            if entry["type"] == "symlink":
+                file_path.symlink_to(entry["target"])
+            elif entry["type"] == "link":
+                links.append((file_path, target_path / entry["target"]))
+            else:
+                file_descriptor = os.open(file_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+                with open(file_descriptor, "wb") as fobj:
+                    fobj.write(data)
+                file_path.chmod(entry["mode"])
+                os.utime(file_path, ns=(entry["mtime_ns"], entry["mtime_ns"]))
+        for file_path, link_target in links:
+            os.link(link_target, file_path)
+
+    @property
+    def state_sha256sum(self):
+        """
+        sha256 sum identifying the current locked vault content.
+        """
+        for sha256sum_path in (self.encrypted_tar_sha256sum_path,
+                               self.object_store.manifest_sha256sum_path):
+            if sha256sum_path.exists():
+                return sha256sum_path.read_text()
+        return None
+
+    @contextmanager
+    def temporary_file(self, file_name):
+        """
+        Context manager providing a vault file as a private temporary file.
+
+        The file is created on a RAM backed file system, so the decrypted
+        content never touches persistent storage.
+
+        Args:
+            file_name (str): Path relative to `self.path`.
+
+        Returns:
+            Path: Path to temporary file readable only by the current user.
+        """
+        tmp_dir = ephemeral_directory()
+        if tmp_dir is None:
+            raise DeploymentVaultError(
+                "No RAM backed directory (/dev/shm or $XDG_RUNTIME_DIR) available "
+                f"to decrypt {file_name} into, unlock the deployment instead"
+            )
+        file_descriptor, tmp_name = tempfile.mkstemp(prefix=".vault-", dir=tmp_dir)
+        try:
+            with os.fdopen(file_descriptor, "wb") as fobj:
+                fobj.write(self.read_file(file_name))
+            yield Path(tmp_name)
+        finally:
+            Path(tmp_name).unlink(missing_ok=True)
+
+    def fingerprint(self, files):
+        """
+        Create a fingerprint of the vault content.
+
+        The fingerprint maps every path below `files` to its mode, size
+        and modification time. Directories are only represented by their
+        mode, since added or removed entries show up as paths on their own.
+        Paths in `self.excluded_files` are ignored. The git index is
+        represented by a hash of its staged entries, so git refreshing
+        cached stat data in the index does not change the fingerprint.
+
+        Args:
+            files (sequence): Sequence of files and directories.
+
+        Returns:
+            dict: Fingerprint entries by relative path.
+        """
+        fingerprint = {}
+        for relative_path, file_path in VaultObjectStore._walk(self.path, files):
+            if self._is_excluded(relative_path):
+                continue
+            stat = file_path.lstat()
+            if file_path.is_dir() and not file_path.is_symlink():
+                fingerprint[relative_path] = (stat.st_mode,)
+            else:
+                fingerprint[relative_path] = (stat.st_mode, stat.st_size, stat.st_mtime_ns)
+        git_index_path = (self.git_path / "index").relative_to(self.path).as_posix()
+        if git_index_path in fingerprint:
+            staged_entries = subprocess.run(
+                ["git", "ls-files", "--stage", "-z"],
+                cwd=self.path, check=True, capture_output=True
+            ).stdout
+            fingerprint[git_index_path] = hashlib.sha256(staged_entries).hexdigest()
+        return fingerprint
+
+    def unchanged_since(self, fingerprint):
+        """
+        Check if the vault content is unchanged and may be relocked.
+
+        Args:
+            fingerprint (dict): Fingerprint taken after unlock.
+
+        Returns:
+            bool: True if `relock` can be used instead of `lock`.
+        """
+        if self.locked or fingerprint is None or not self.shadow_git_path.exists():
+            return False
+        if not self.encrypted_tar_path.exists() and not self.object_store.exists():
+            return False
+        files = {Path(path).parts[0] for path in fingerprint}
+        files.update(str(file_name) for file_name in self.files)
+        return self.fingerprint(sorted(files)) == fingerprint
+
+    def relock(self):
+        """
+        Locks an unchanged vault without encrypting it again.
+
+        The encrypted deployment written by the last lock is reused and
+        the shadow repository saved during unlock is restored as is.
+        The caller is responsible for deleting the decrypted files.
+        """
+        if self.locked:
+            raise DeploymentVaultError("Deployment already locked")
+        close_repo(self.path)
+        shutil.rmtree(self.git_path)
+        shutil.move(self.shadow_git_path, self.git_path)
+        self.locked = True
+        self.lock_file_path.touch()
+
     def delete(self, delete_shadowgit=False):
         self.lock_file_path.unlink(missing_ok=True)
         self.encrypted_tar_path.unlink(missing_ok=True)
         self.encrypted_tar_sha256sum_path.unlink(missing_ok=True)
+        self.index_path.unlink(missing_ok=True)
         self.tar_path.unlink(missing_ok=True)
         if delete_shadowgit:
             shutil.rmtree(self.shadow_git_path, ignore_errors=True)
+            self.object_store.delete()
+            self.bundle_chain.delete()
@@ -2,8 +2,8 @@
 This module contains the Inventory class.
 """
 
-import yaml
 import collections
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from ansible_deployment import AnsibleDeployment, SSHKeypair
 from ansible_deployment.inventory_plugins import (
@@ -11,6 +11,7 @@ from ansible_deployment.inventory_plugins import (
     inventory_sources,
     inventory_writers,
 )
+from ansible_deployment import yaml_io
 
 class DeploymentKeyError(Exception):
     pass
@@ -75,6 +76,34 @@ class Inventory(AnsibleDeployment):
 
         self.filtered_representation = self._construct_filtered_representation()
 
+    @staticmethod
+    def connection_details(host, host_vars, all_group_vars):
+        """
+        Get the ssh connection details of a host from its variables.
+
+        Args:
+            host (str): Inventory hostname.
+            host_vars (dict): Host vars of `host`.
+            all_group_vars (dict): Group vars of group `all`.
+
+        Returns:
+            dict: Connection details (ansible_host, ansible_user, ansible_port).
+                  The port defaults to "22".
+
+        Raises:
+            KeyError: If neither `host_vars` nor `all_group_vars` define
+                      `ansible_user`.
+        """
+        if "ansible_user" in host_vars:
+            ansible_user = host_vars["ansible_user"]
+        else:
+            ansible_user = all_group_vars["ansible_user"]
+        return {
+            "ansible_host": host_vars.get("ansible_host", host),
+            "ansible_user": ansible_user,
+            "ansible_port": host_vars.get("ansible_port", "22"),
+        }
+
     def _construct_filtered_representation(self):
         """
         Constructs a dictionary with a filtered inventory representation.
@@ -84,25 +113,9 @@ class Inventory(AnsibleDeployment):
         """
         filtered_representation = {}
         for host in self.hosts["all"]["hosts"]:
-            filtered_representation[host] = {}
-            if "ansible_host" in self.host_vars[host]:
-                filtered_representation[host]["ansible_host"] = self.host_vars[
-                    host
-                ]["ansible_host"]
-            else:
-                filtered_representation[host]["ansible_host"] = host
-            if "ansible_user" in self.host_vars[host]:
-                filtered_representation[host]["ansible_user"] = self.host_vars[
-                    host
-                ]["ansible_user"]
-            else:
-                filtered_representation[host]["ansible_user"] = self.group_vars["all"]["ansible_user"]
-            if "ansible_port" in self.host_vars[host]:
-                filtered_representation[host]["ansible_port"] = self.host_vars[
-                    host
-                ]["ansible_port"]
-            else:
-                filtered_representation[host]["ansible_port"] = "22"
+            filtered_representation[host] = self.connection_details(
+                host, self.host_vars[host], self.group_vars["all"]
+            )
         filtered_representation["loaded_sources"] = self.loaded_sources
         filtered_representation["loaded_writers"] = self.loaded_writers
         return filtered_representation
@@ -171,10 +184,20 @@ class Inventory(AnsibleDeployment):
     def run_reader_plugins(self):
         """
         Run loaded inventory sources.
+
+        Sources are read concurrently on a thread pool. Their inventories
+        are merged in configured order as soon as all earlier sources are
+        merged, so later sources still overwrite values of earlier ones.
         """
-        for plugin in self.loaded_sources:
-            plugin.update_inventory()
-            self._update_plugin_inventory(plugin)
+        if len(self.loaded_sources) == 1:
+            self.local_inventory.update_inventory()
+            self._update_plugin_inventory(self.local_inventory)
+            return
+        with ThreadPoolExecutor(max_workers=len(self.loaded_sources)) as executor:
+            futures = [executor.submit(plugin.update_inventory) for plugin in self.loaded_sources]
+            for plugin, future in zip(self.loaded_sources, futures):
+                future.result()
+                self._update_plugin_inventory(plugin)
 
     def update_added_files(self):
         for plugin in self.loaded_sources:
@@ -213,12 +236,22 @@ class Inventory(AnsibleDeployment):
                 template_mode
             )
 
+    def write_deployment_key(self, deployment_key):
+        """
+        Replace the deployment key stored by loaded inventory writers.
+
+        Args:
+            deployment_key (bytes): New deployment key.
+        """
+        for plugin in self.loaded_writers:
+            plugin.write_deployment_key(deployment_key)
+
     def write_inventory(self):
         """
         Writes inventory file to inventory_path.
         """
         with open(self.path / "hosts.yml", "w") as inventory_file_stream:
-            yaml.dump(self.hosts, inventory_file_stream)
+            yaml_io.dump(self.hosts, inventory_file_stream)
         self.ssh_keypair.write()
 
     def write_vars(self):
@@ -227,11 +260,11 @@ class Inventory(AnsibleDeployment):
         """
         for hostname, host in self.host_vars.items():
             with open(self.path / "host_vars" / hostname, "w") as hostvars_file_stream:
-                yaml.dump(host, hostvars_file_stream)
+                yaml_io.dump(host, hostvars_file_stream)
 
         for group in self.group_vars:
             with open(self.path / "group_vars" / group, "w") as groupvars_file_stream:
-                yaml.dump(self.group_vars[group], groupvars_file_stream)
+                yaml_io.dump(self.group_vars[group], groupvars_file_stream)
 
     def write(self):
         """
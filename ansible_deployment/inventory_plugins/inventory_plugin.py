@@ -5,6 +5,7 @@ from pathlib import Path
 from ansible_deployment import SSHKeypair
 from ansible_deployment.class_skeleton import AnsibleDeployment
 from ansible_deployment.config import DEFAULT_OUTPUT_JSON_INDENT
+from ansible_deployment.exceptions import NotSupportedByPlugin
 
 
 class InventoryPlugin(AnsibleDeployment):
@@ -59,7 +60,7 @@ class InventoryPlugin(AnsibleDeployment):
             roles (list): List of role objects.
         """
         for role in roles:
-            for vars_file in role.defaults:
+            for vars_file in role.defaults or {}:
                 self.group_vars[role.group_name] = self.group_vars.get(role.group_name, {}) | role.defaults[vars_file]['data']
 
     def _set_groups(self):
@@ -81,6 +82,15 @@ class InventoryPlugin(AnsibleDeployment):
             files to add to the deployment repository.
         """
 
+    def write_deployment_key(self, deployment_key):
+        """
+        Replace the deployment key stored by a writer plugin.
+
+        Args:
+            deployment_key (bytes): New deployment key.
+        """
+        raise NotSupportedByPlugin(self.name)
+
     def delete_added_files(self):
         for path_name in self.added_files:
             p = Path(path_name)
@@ -1,9 +1,9 @@
 """
 Local inventory source plugin.
 """
-import yaml
 from pathlib import Path
 from ansible_deployment.inventory_plugins.inventory_plugin import InventoryPlugin
+from ansible_deployment import yaml_io
 
 
 class Local(InventoryPlugin):
@@ -28,13 +28,13 @@ class Local(InventoryPlugin):
                 continue
             vars_name = vars_file.stem
             with open(vars_file) as vars_file_stream:
-                self.vars[vars_type][vars_name] = yaml.safe_load(vars_file_stream)
+                self.vars[vars_type][vars_name] = yaml_io.safe_load(vars_file_stream)
 
     def _load_hosts(self):
         hosts_file_path = Path("./hosts.yml")
         if hosts_file_path.exists():
             with open(hosts_file_path) as f:
-                self.hosts = yaml.safe_load(f)
+                self.hosts = yaml_io.safe_load(f)
 
     def update_inventory(self):
         self.ssh_keypair.private_key_path = Path('./.ssh/id_rsa')
@@ -24,8 +24,7 @@ class VaultWriter(InventoryPlugin):
         self.write_secret("hosts", hosts)
 
         if not template_mode:
-            deployment_key = {"data": base64.encodebytes(deployment_key).decode("ascii")}
-            self.write_secret("deployment_key", deployment_key)
+            self.write_deployment_key(deployment_key)
             self.write_secret("ssh_private_key", self.ssh_keypair.private_key)
             self.write_secret("ssh_public_key", self.ssh_keypair.public_key)
 
@@ -34,6 +33,15 @@ class VaultWriter(InventoryPlugin):
         for host in host_vars:
             self.write_secret(f"host_vars/{host}", host_vars[host])
 
+    def write_deployment_key(self, deployment_key):
+        """
+        Write deployment key to vault.
+
+        Arguments:
+            deployment_key (bytes): Deployment key.
+        """
+        deployment_key = {"data": base64.encodebytes(deployment_key).decode("ascii")}
+        self.write_secret("deployment_key", deployment_key)
 
     def write_secret(self, secret_name, secret_value):
         """
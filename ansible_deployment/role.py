@@ -4,8 +4,8 @@ This module contains the Role class.
 
 import shutil
 from pathlib import Path
-import yaml
 from ansible_deployment import AnsibleDeployment
+from ansible_deployment import yaml_io
 
 
 class Role(AnsibleDeployment):
@@ -28,9 +28,12 @@ class Role(AnsibleDeployment):
 
     Notes:
         The attributes containing role sub directory information are 'None'
-        if the corresponding sub directory does not exist.
+        if the corresponding sub directory does not exist. Sub directories
+        are parsed on first access.
     """
 
+    sub_directories = ("defaults", "vars", "tasks", "files", "handlers", "templates", "meta")
+
     filtered_attributes = [
         "vars",
         "defaults",
@@ -45,13 +48,50 @@ class Role(AnsibleDeployment):
         self.path = Path(path)
         self.name = name
         self.group_name = name.replace('/', '_').replace('-', '_')
-        self.defaults = self._parse_role_sub_directory("defaults")
-        self.vars = self._parse_role_sub_directory("vars")
-        self.tasks = self._parse_role_sub_directory("tasks")
-        self.files = self._parse_role_sub_directory("files")
-        self.handlers = self._parse_role_sub_directory("handlers")
-        self.templates = self._parse_role_sub_directory("templates")
-        self.meta = self._parse_role_sub_directory("meta")
+
+    def __getattr__(self, attribute):
+        """
+        Parse a role sub directory on first access.
+
+        The parsed sub directory is stored as instance attribute, so it
+        is only parsed once.
+
+        Args:
+            attribute (str): Attribute to look up.
+
+        Returns:
+            dict: A file based dictionary. None if directory does not exist.
+        """
+        if attribute not in self.sub_directories:
+            raise AttributeError(f"'{type(self).__name__}' object has no attribute '{attribute}'")
+        sub_directory = self._parse_role_sub_directory(attribute)
+        setattr(self, attribute, sub_directory)
+        return sub_directory
+
+    def __getitem__(self, attribute):
+        """
+        Lookup a given attribute, parsing sub directories on first access.
+
+        Args:
+            attribute (str): Attribute to look up.
+        Returns:
+            Value of attribute.
+        """
+        if attribute in self.sub_directories:
+            return getattr(self, attribute)
+        return super().__getitem__(attribute)
+
+    def __contains__(self, attribute):
+        """
+        Check if attribute is a sub directory or in self.__dict__.
+
+        Args:
+            attribute (str): Atrribute to check
+
+        Returns:
+            bool: True if attribute is available.
+        """
+        return attribute in self.sub_directories or super().__contains__(attribute)
 
     @staticmethod
     def _parse_yaml_file(file_path):
@@ -65,7 +105,7 @@ class Role(AnsibleDeployment):
             Parsed yaml data.
         """
         with open(file_path) as file_stream:
-            yaml_data = yaml.safe_load(file_stream)
+            yaml_data = yaml_io.safe_load(file_stream)
         return yaml_data
 
     @staticmethod
@@ -95,16 +135,12 @@ class Role(AnsibleDeployment):
         sub_directory_path = self.path / sub_directory_name
         directory_files = {}
 
-        if not sub_directory_path.exists:
+        if not sub_directory_path.exists():
             return None
 
-        all_files = list(sub_directory_path.glob("**/*"))
-        yaml_files = list(sub_directory_path.glob("**/*.yml"))
-        yaml_files += list(sub_directory_path.glob("**/*.yaml"))
-
-        for file_path in all_files:
+        for file_path in sub_directory_path.glob("**/*"):
             file_data = None
-            if file_path in yaml_files:
+            if file_path.suffix in (".yml", ".yaml") and file_path.is_file():
                 file_data = self._parse_yaml_file(file_path)
             file_info = self._generate_file_info(file_path, file_data)
             directory_files[file_path.name] = file_info
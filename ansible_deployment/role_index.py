@@ -0,0 +1,178 @@
+"""
+Module containing the RoleIndex class.
+"""
+
+import pickle
+from pathlib import Path
+from ansible_deployment.class_skeleton import AnsibleDeployment
+from ansible_deployment.role import Role
+
+INDEX_VERSION = 1
+
+
+class RoleIndex(AnsibleDeployment):
+    """
+    Persistent index of parsed role sub directories.
+
+    The index is stored inside the roles repo's git directory and records
+    the parsed `indexed_sub_directories` of every role together with the
+    role's git tree hash. Entries are reused as long as the role tree of
+    the roles repo HEAD is unchanged, so a pull only invalidates changed
+    roles. If HEAD did not move since the index was written, no tree is
+    looked up at all. Roles with uncommitted changes are always parsed.
+
+    Args:
+        roles_repo (DeploymentRepo): Roles src repository.
+
+    Attributes:
+        roles_repo (DeploymentRepo): Roles src repository.
+        index_path (Path): Path to index file.
+    """
+
+    indexed_sub_directories = ("defaults", "vars", "meta")
+
+    def __init__(self, roles_repo):
+        self.roles_repo = roles_repo
+        self.index_path = Path(roles_repo.path) / ".git" / "ansible-deployment" / "roles.index"
+
+    def _read(self):
+        """
+        Read the index file.
+
+        Returns:
+            dict: Index with `commit` and `roles`. An empty index if the
+                  index file is missing, outdated or corrupt.
+        """
+        try:
+            with open(self.index_path, "rb") as index_file:
+                index = pickle.load(index_file)
+            if index.get("version") == INDEX_VERSION:
+                return index
+        except Exception:
+            # A corrupt index is rebuilt.
+            pass
+        return {"version": INDEX_VERSION, "commit": None, "roles": {}}
+
+    def _write(self, index):
+        """
+        Atomically write the index file.
+
+        Args:
+            index (dict): Index with `commit` and `roles`.
+        """
+        self.index_path.parent.mkdir(exist_ok=True)
+        tmp_path = self.index_path.with_name(self.index_path.name + ".tmp")
+        with open(tmp_path, "wb") as index_file:
+            pickle.dump(index, index_file, protocol=pickle.HIGHEST_PROTOCOL)
+        tmp_path.replace(self.index_path)
+
+    def _dirty_roles(self, role_names):
+        """
+        Get the roles with uncommitted changes in the roles repo.
+
+        Args:
+            role_names (sequence): Role names.
+
+        Returns:
+            set: Names of roles with changed or untracked files.
+        """
+        output = self.roles_repo.repo.git.status(
+            "--porcelain", "-z", "--no-renames", "--untracked-files=all", "--", *role_names
+        )
+        changed_paths = [entry[3:] for entry in output.split("\0") if entry]
+        return {
+            role_name for role_name in role_names
+            if any(path.startswith(role_name.rstrip("/") + "/") for path in changed_paths)
+        }
+
+    @staticmethod
+    def _tree_sha(commit, role_name):
+        try:
+            return commit.tree.join(role_name.rstrip("/")).hexsha
+        except KeyError:
+            return None
+
+    def _parse_entry(self, role, tree_sha):
+        """
+        Parse the indexed sub directories of a role into an index entry.
+
+        File paths are stored relative to the role directory, so the
+        index stays valid if the deployment directory is moved.
+
+        Args:
+            role (Role): Role object.
+            tree_sha (str): Git tree hash of the role.
+
+        Returns:
+            dict: Index entry.
+        """
+        entry = {"tree": tree_sha, "sub_directories": {}}
+        for sub_directory_name in self.indexed_sub_directories:
+            sub_directory = getattr(role, sub_directory_name)
+            if sub_directory is not None:
+                sub_directory = {
+                    file_name: dict(file_info, path=file_info["path"].relative_to(role.path))
+                    for file_name, file_info in sub_directory.items()
+                }
+            entry["sub_directories"][sub_directory_name] = sub_directory
+        return entry
+
+    @staticmethod
+    def _apply_entry(role, entry):
+        """
+        Set the indexed sub directories of a role from an index entry.
+
+        Args:
+            role (Role): Role object.
+            entry (dict): Index entry.
+        """
+        for sub_directory_name, sub_directory in entry["sub_directories"].items():
+            if sub_directory is not None:
+                sub_directory = {
+                    file_name: dict(file_info, path=role.path / file_info["path"])
+                    for file_name, file_info in sub_directory.items()
+                }
+            setattr(role, sub_directory_name, sub_directory)
+
+    def load_roles(self, role_names, roles_path):
+        """
+        Create role objects using the index.
+
+        Indexed sub directories of unchanged roles are set from the index,
+        all others are parsed and written to the index.
+
+        Args:
+            role_names (sequence): A sequence of role names.
+            roles_path (Path): Directory containing the roles.
+
+        Returns:
+            list: A list of initialized role objects.
+        """
+        roles = [Role(name=role_name, path=Path(roles_path) / role_name) for role_name in role_names]
+        repo = self.roles_repo.repo
+        if repo is None or not repo.head.is_valid() or not roles:
+            return roles
+        commit = repo.head.commit
+        index = self._read()
+        head_moved = index["commit"] != commit.hexsha
+        dirty_roles = self._dirty_roles(role_names)
+        entries = {}
+        for role in roles:
+            if role.name in dirty_roles or not role.path.is_dir():
+                if not head_moved and role.name in index["roles"]:
+                    entries[role.name] = index["roles"][role.name]
+                continue
+            entry = index["roles"].get(role.name)
+            if entry is None or head_moved:
+                tree_sha = self._tree_sha(commit, role.name)
+                if tree_sha is None:
+                    continue
+                if entry is None or entry["tree"] != tree_sha:
+                    entry = self._parse_entry(role, tree_sha)
+            self._apply_entry(role, entry)
+            entries[role.name] = entry
+        if head_moved or entries.keys() != index["roles"].keys() or any(
+            entries[name] is not index["roles"].get(name) for name in entries
+        ):
+            self._write({"version": INDEX_VERSION, "commit": commit.hexsha, "roles": entries})
+        return roles
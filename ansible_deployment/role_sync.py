@@ -0,0 +1,235 @@
+"""
+Module containing the RoleSync class.
+"""
+
+import fcntl
+import filecmp
+import os
+import shutil
+from pathlib import Path
+from ansible_deployment.class_skeleton import AnsibleDeployment
+
+FICLONE = 0x40049409
+COPY_MODES = ("copy", "hardlink", "reflink")
+
+
+class RoleSyncError(Exception):
+    pass
+
+
+class RoleSync(AnsibleDeployment):
+    """
+    Incrementally synchronizes role directories into a roles directory.
+
+    Files are compared by size and mtime. Files of equal size but
+    different mtime are compared by content, so unchanged files are
+    never rewritten. Changed files are replaced atomically and files or
+    directories not belonging to a synchronized role are deleted.
+
+    With copy mode ``hardlink`` files are linked to their source and
+    with ``reflink`` they share their data blocks with the source on
+    file systems supporting it. Both fall back to a copy if linking fails.
+
+    Args:
+        source_path (path): Directory containing the source roles.
+        destination_path (path): Roles directory.
+        copy_mode (str): ``copy``, ``hardlink`` or ``reflink``.
+
+    Attributes:
+        source_path (Path): Directory containing the source roles.
+        destination_path (Path): Roles directory.
+        copy_mode (str): ``copy``, ``hardlink`` or ``reflink``.
+    """
+
+    def __init__(self, source_path, destination_path, copy_mode="copy"):
+        if copy_mode not in COPY_MODES:
+            raise RoleSyncError(f"Invalid copy mode: {copy_mode}")
+        self.source_path = Path(source_path)
+        self.destination_path = Path(destination_path)
+        self.copy_mode = copy_mode
+
+    @staticmethod
+    def _walk(path):
+        """
+        List all directories and files below a path.
+
+        Symbolic links are followed like ``shutil.copytree`` does by default.
+
+        Args:
+            path (Path): Directory to list.
+
+        Returns:
+            tuple: Set of relative directory paths and dict of
+                   `os.stat_result` by relative file path.
+        """
+        directories = set()
+        files = {}
+        for root, dir_names, file_names in os.walk(path, followlinks=True):
+            relative_root = Path(root).relative_to(path)
+            for dir_name in dir_names:
+                directories.add(relative_root / dir_name)
+            for file_name in file_names:
+                files[relative_root / file_name] = os.stat(Path(root) / file_name)
+        return directories, files
+
+    def _expected_content(self, role_names):
+        """
+        Collect the directories and files of all roles.
+
+        Args:
+            role_names (sequence): Role names relative to `self.source_path`.
+
+        Returns:
+            tuple: Set of relative directory paths and dict of
+                   `os.stat_result` of the source file by relative path.
+        """
+        directories = set()
+        files = {}
+        for role_name in role_names:
+            role_path = self.source_path / role_name
+            if not role_path.is_dir():
+                raise FileNotFoundError(f"Role not found: {role_path}")
+            role = Path(role_name)
+            directories.update(role.parents)
+            directories.add(role)
+            role_directories, role_files = self._walk(role_path)
+            directories.update(role / directory for directory in role_directories)
+            files.update((role / file, stat) for file, stat in role_files.items())
+        directories.discard(Path("."))
+        return directories, files
+
+    def _delete_unexpected(self, directories, files):
+        """
+        Delete everything below `self.destination_path` not part of the roles.
+
+        Args:
+            directories (set): Expected relative directory paths.
+            files (dict): Expected relative file paths.
+
+        Returns:
+            int: Number of deleted files and directories.
+        """
+        deleted = 0
+        for root, dir_names, file_names in os.walk(self.destination_path):
+            relative_root = Path(root).relative_to(self.destination_path)
+            for dir_name in list(dir_names):
+                path = Path(root) / dir_name
+                if path.is_symlink():
+                    path.unlink()
+                    dir_names.remove(dir_name)
+                    deleted += 1
+                elif relative_root / dir_name not in directories:
+                    shutil.rmtree(path)
+                    dir_names.remove(dir_name)
+                    deleted += 1
+            for file_name in file_names:
+                if relative_root / file_name not in files:
+                    (Path(root) / file_name).unlink()
+                    deleted += 1
+        return deleted
+
+    def _link_or_copy(self, source, destination):
+        """
+        Create `destination` from `source` according to `self.copy_mode`.
+
+        Args:
+            source (Path): Source file.
+            destination (Path): New destination file.
+        """
+        if self.copy_mode == "hardlink":
+            try:
+                os.link(source, destination)
+                return
+            except OSError:
+                pass
+        if self.copy_mode == "reflink":
+            with open(source, "rb") as src, open(destination, "wb") as dst:
+                try:
+                    fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+                except OSError:
+                    shutil.copyfileobj(src, dst)
+            shutil.copystat(source, destination)
+            return
+        shutil.copy2(source, destination)
+
+    def _replace_file(self, relative_path):
+        """
+        Atomically replace a destination file by its source.
+
+        Args:
+            relative_path (Path): File path relative to the roles directories.
+        """
+        destination = self.destination_path / relative_path
+        tmp_path = destination.with_name(f".{destination.name}.sync")
+        tmp_path.unlink(missing_ok=True)
+        try:
+            self._link_or_copy(self.source_path / relative_path, tmp_path)
+            tmp_path.replace(destination)
+        except BaseException:
+            tmp_path.unlink(missing_ok=True)
+            raise
+
+    def _sync_file(self, relative_path, source_stat):
+        """
+        Synchronize a single file.
+
+        Args:
+            relative_path (Path): File path relative to the roles directories.
+            source_stat (os.stat_result): Stat result of the source file.
+
+        Returns:
+            str: ``copied``, ``updated`` or ``unchanged``.
+        """
+        source = self.source_path / relative_path
+        destination = self.destination_path / relative_path
+        try:
+            destination_stat = os.lstat(destination)
+        except FileNotFoundError:
+            self._replace_file(relative_path)
+            return "copied"
+        if (destination_stat.st_dev, destination_stat.st_ino) == (
+            source_stat.st_dev, source_stat.st_ino
+        ):
+            return "unchanged"
+        if (
+            os.path.islink(destination)
+            or destination_stat.st_size != source_stat.st_size
+            or (
+                destination_stat.st_mtime_ns != source_stat.st_mtime_ns
+                and not filecmp.cmp(source, destination, shallow=False)
+            )
+        ):
+            self._replace_file(relative_path)
+            return "updated"
+        if (
+            destination_stat.st_mtime_ns != source_stat.st_mtime_ns
+            or destination_stat.st_mode != source_stat.st_mode
+        ):
+            if self.copy_mode == "hardlink":
+                self._replace_file(relative_path)
+                return "updated"
+            shutil.copystat(source, destination)
+        return "unchanged"
+
+    def sync(self, role_names):
+        """
+        Synchronize roles into `self.destination_path`.
+
+        Args:
+            role_names (sequence): Role names relative to `self.source_path`.
+
+        Returns:
+            dict: Number of ``copied``, ``updated``, ``deleted`` and
+                  ``unchanged`` files.
+        """
+        directories, files = self._expected_content(role_names)
+        stats = {"copied": 0, "updated": 0, "deleted": 0, "unchanged": 0}
+        self.destination_path.mkdir(parents=True, exist_ok=True)
+        stats["deleted"] = self._delete_unexpected(directories, files)
+        for directory in sorted(directories):
+            if not (self.destination_path / directory).exists():
+                (self.destination_path / directory).mkdir()
+                shutil.copystat(self.source_path / directory, self.destination_path / directory)
+        for relative_path, source_stat in files.items():
+            stats[self._sync_file(relative_path, source_stat)] += 1
+        return stats
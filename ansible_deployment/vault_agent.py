@@ -0,0 +1,323 @@
+"""
+Module containing the VaultAgent and VaultAgentClient classes.
+
+The vault agent is an opt-in background process decrypting a locked
+deployment once and serving its files from memory over a unix socket.
+It exits after being idle for a configurable time.
+
+Requests and responses are single lines of json. The socket is only
+accessible by the current user.
+"""
+
+import argparse
+import base64
+import hashlib
+import json
+import os
+import socket
+import socketserver
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from ansible_deployment.class_skeleton import AnsibleDeployment
+
+DEFAULT_AGENT_TTL = 900
+
+
+class VaultAgentError(Exception):
+    pass
+
+
+def agent_socket_path(deployment_path, create=False):
+    """
+    Get the agent socket path of a deployment.
+
+    The socket directory is only created if `create` is set. An existing
+    socket directory must be owned by the current user.
+
+    Args:
+        deployment_path (path): Path to deployment directory.
+        create (bool): Create the socket directory if it is missing.
+
+    Returns:
+        Path: Path to unix socket.
+    """
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime_dir:
+        socket_dir = Path(runtime_dir) / "ansible-deployment"
+    else:
+        socket_dir = Path(tempfile.gettempdir()) / f"ansible-deployment-{os.getuid()}"
+    if create:
+        socket_dir.mkdir(mode=0o700, exist_ok=True)
+    if socket_dir.exists() and socket_dir.stat().st_uid != os.getuid():
+        raise VaultAgentError(f"{socket_dir} is not owned by current user")
+    name = hashlib.sha256(str(Path(deployment_path).resolve()).encode()).hexdigest()
+    return socket_dir / f"{name[:16]}.sock"
+
+
+class VaultAgent(AnsibleDeployment):
+    """
+    Serves the files of a locked deployment vault from memory.
+
+    Args:
+        vault (DeploymentVault): Locked deployment vault.
+        socket_path (path): Path to unix socket.
+        ttl (int): Idle time in seconds after which the agent exits.
+
+    Attributes:
+        vault (DeploymentVault): Locked deployment vault.
+        socket_path (Path): Path to unix socket.
+        ttl (int): Idle time in seconds after which the agent exits.
+        entries (list): Relative path, entry and content of all vault
+                        entries as yielded by `DeploymentVault.read_entries`.
+        files (dict): Decrypted file content by relative path.
+        state_sha256sum (str): Vault state the files were read from.
+    """
+
+    filtered_attributes = ["entries", "files"]
+
+    def __init__(self, vault, socket_path, ttl=DEFAULT_AGENT_TTL):
+        self.vault = vault
+        self.socket_path = Path(socket_path)
+        self.ttl = ttl
+        self.entries = []
+        self.files = {}
+        self.state_sha256sum = None
+        self._running = False
+
+    def load(self):
+        """
+        Decrypt all vault files into memory.
+        """
+        state_sha256sum = self.vault.state_sha256sum
+        self.entries = list(self.vault.read_entries(use_agent=False))
+        self.files = {
+            relative_path: data for relative_path, entry, data in self.entries
+            if entry["type"] == "file"
+        }
+        self.state_sha256sum = state_sha256sum
+
+    def handle(self, request):
+        """
+        Handle a single request.
+
+        Args:
+            request (dict): Request with an `op` key.
+
+        Returns:
+            dict: Response.
+        """
+        operation = request.get("op")
+        if operation == "stop":
+            self._running = False
+            return {"ok": True}
+        if operation == "status":
+            return {"ok": True, "files": len(self.files), "state": self.state_sha256sum}
+        if operation == "read":
+            if request.get("state") != self.state_sha256sum:
+                self.load()
+            data = self.files.get(request.get("path"))
+            if data is None:
+                return {"error": "FileNotFoundError", "message": request.get("path")}
+            return {"ok": True, "data": base64.b64encode(data).decode()}
+        if operation == "entries":
+            if request.get("state") != self.state_sha256sum:
+                self.load()
+            entries = [
+                [relative_path, entry, None if data is None else base64.b64encode(data).decode()]
+                for relative_path, entry, data in self.entries
+            ]
+            return {"ok": True, "entries": entries}
+        return {"error": "VaultAgentError", "message": f"Unknown operation: {operation}"}
+
+    def serve(self):
+        """
+        Serve requests until stopped or idle for `self.ttl` seconds.
+        """
+        agent = self
+
+        class RequestHandler(socketserver.StreamRequestHandler):
+            def handle(self):
+                if hasattr(socket, "SO_PEERCRED"):
+                    credentials = self.request.getsockopt(
+                        socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i")
+                    )
+                    if struct.unpack("3i", credentials)[1] != os.getuid():
+                        return
+                try:
+                    response = agent.handle(json.loads(self.rfile.readline()))
+                except Exception as err:
+                    response = {"error": type(err).__name__, "message": str(err)}
+                self.wfile.write(json.dumps(response).encode() + b"\n")
+
+        self.socket_path.unlink(missing_ok=True)
+        old_umask = os.umask(0o177)
+        try:
+            server = socketserver.UnixStreamServer(str(self.socket_path), RequestHandler)
+        finally:
+            os.umask(old_umask)
+        server.timeout = self.ttl
+        server.handle_timeout = self.stop
+        self._running = True
+        try:
+            while self._running:
+                server.handle_request()
+        finally:
+            server.server_close()
+            self.socket_path.unlink(missing_ok=True)
+            self.entries = []
+            self.files = {}
+
+    def stop(self):
+        """
+        Stop serving requests.
+        """
+        self._running = False
+
+
+class VaultAgentClient(AnsibleDeployment):
+    """
+    Client for a running VaultAgent.
+
+    Args:
+        socket_path (path): Path to unix socket.
+
+    Attributes:
+        socket_path (Path): Path to unix socket.
+    """
+
+    def __init__(self, socket_path):
+        self.socket_path = Path(socket_path)
+
+    def available(self):
+        """
+        Check if an agent socket exists.
+
+        Returns:
+            bool: True if the agent socket exists.
+        """
+        return self.socket_path.is_socket()
+
+    def request(self, operation, **kwargs):
+        """
+        Send a request to the agent.
+
+        Args:
+            operation (str): Requested operation.
+            **kwargs: Additional request parameters.
+
+        Returns:
+            dict: Response.
+        """
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+            connection.connect(str(self.socket_path))
+            with connection.makefile("rwb") as stream:
+                stream.write(json.dumps(dict(kwargs, op=operation)).encode() + b"\n")
+                stream.flush()
+                response = json.loads(stream.readline())
+        if response.get("error") == "FileNotFoundError":
+            raise FileNotFoundError(response["message"])
+        if "error" in response:
+            raise VaultAgentError(f"{response['error']}: {response['message']}")
+        return response
+
+    def read_file(self, file_name, state_sha256sum):
+        """
+        Read a file from the agent.
+
+        Args:
+            file_name (str): Path relative to the deployment directory.
+            state_sha256sum (str): Current vault state. The agent reloads
+                                   the vault if it serves another state.
+
+        Returns:
+            bytes: File content.
+        """
+        response = self.request("read", path=file_name, state=state_sha256sum)
+        return base64.b64decode(response["data"])
+
+    def read_entries(self, state_sha256sum):
+        """
+        Read all vault entries from the agent.
+
+        Args:
+            state_sha256sum (str): Current vault state. The agent reloads
+                                   the vault if it serves another state.
+
+        Returns:
+            list: Relative path, entry and content (None for directories
+                  and links) of all vault entries.
+        """
+        response = self.request("entries", state=state_sha256sum)
+        return [
+            (relative_path, entry, None if data is None else base64.b64decode(data))
+            for relative_path, entry, data in response["entries"]
+        ]
+
+    def status(self):
+        return self.request("status")
+
+    def stop(self):
+        self.request("stop")
+
+
+def start_agent(deployment_path, ttl=DEFAULT_AGENT_TTL, timeout=30):
+    """
+    Start a vault agent in the background.
+
+    Args:
+        deployment_path (path): Path to deployment directory.
+        ttl (int): Idle time in seconds after which the agent exits.
+        timeout (int): Seconds to wait for the agent to load the vault.
+
+    Returns:
+        VaultAgentClient: Client connected to the started agent.
+    """
+    client = VaultAgentClient(agent_socket_path(deployment_path))
+    with tempfile.TemporaryFile() as agent_log:
+        process = subprocess.Popen(
+            [sys.executable, "-m", "ansible_deployment.vault_agent",
+             str(Path(deployment_path).resolve()), "--ttl", str(ttl)],
+            start_new_session=True, stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL, stderr=agent_log,
+        )
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                agent_log.seek(0)
+                error = agent_log.read().decode().strip().splitlines()
+                raise VaultAgentError(f"Agent failed: {error[-1] if error else process.returncode}")
+            if client.available():
+                try:
+                    client.status()
+                    return client
+                except OSError:
+                    pass
+            time.sleep(0.05)
+        process.kill()
+    raise VaultAgentError("Agent did not start in time")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a locked deployment vault from memory.")
+    parser.add_argument("path", help="Deployment directory.")
+    parser.add_argument("--ttl", type=int, default=DEFAULT_AGENT_TTL,
+                        help="Idle time in seconds after which the agent exits.")
+    args = parser.parse_args()
+    # Imported here, since DeploymentVault uses the client of this module.
+    from ansible_deployment.deployment_vault import DeploymentVault
+    if not (Path(args.path) / DeploymentVault.key_file_name).exists():
+        raise VaultAgentError("Missing deployment key")
+    vault = DeploymentVault([], args.path)
+    if not vault.locked:
+        raise VaultAgentError("Deployment is not locked")
+    agent = VaultAgent(vault, agent_socket_path(args.path, create=True), args.ttl)
+    agent.load()
+    agent.serve()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,405 @@
+"""
+Module containing the VaultBundleChain class.
+"""
+
+import hashlib
+import io
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+from pathlib import Path
+from ansible_deployment.class_skeleton import AnsibleDeployment
+from ansible_deployment.vault_format import (
+    HashingReader,
+    HashingWriter,
+    VaultFormatError,
+    VaultStreamReader,
+    VaultStreamWriter,
+    reencrypt,
+)
+
+CHAIN_VERSION = 1
+INDEX_REF = "refs/ansible-deployment/index"
+
+
+class VaultBundleChainError(Exception):
+    pass
+
+
+class VaultBundleChain(AnsibleDeployment):
+    """
+    Represents the git history of a deployment as encrypted git bundles.
+
+    Every lock adds a bundle containing only the objects that are not
+    reachable from the refs recorded by earlier bundles. Objects staged
+    in the git index are included by a temporary ref to the index tree.
+    Once the chain reaches its maximum length it is compacted into a
+    single bundle.
+
+    Args:
+        path (path): Bundle chain directory.
+        key (bytes): Key used for encryption.
+        threads (int): Number of encryption threads.
+                       Defaults to the number of CPUs.
+
+    Attributes:
+        path (Path): Bundle chain directory.
+        manifest_path (Path): Path to the encrypted chain manifest.
+        manifest_sha256sum_path (Path): Path to the manifest's sha256 sum.
+        staged_manifest_path (Path): Path to the manifest prepared by a
+                                     key rotation.
+        threads (int): Number of encryption threads.
+    """
+
+    filtered_attributes = ["key", "_rotation"]
+    manifest_file_name = "chain.enc"
+    bundle_suffix = ".bundle.enc"
+
+    def __init__(self, path, key, threads=None):
+        self.path = Path(path)
+        self.key = key
+        self.threads = threads
+        self.manifest_path = self.path / self.manifest_file_name
+        self.manifest_sha256sum_path = Path(str(self.manifest_path) + ".SHA256")
+        self.staged_manifest_path = Path(str(self.manifest_path) + ".new")
+        self._rotation = None
+
+    def exists(self):
+        """
+        Check if the bundle chain contains a manifest.
+
+        Returns:
+            bool: True if a manifest exists.
+        """
+        return self.manifest_path.exists()
+
+    def load_manifest(self, expected_sha256sum=None):
+        """
+        Decrypt and parse the chain manifest.
+
+        Args:
+            expected_sha256sum (str): If given, the encrypted manifest is
+                                      verified against this sha256 sum.
+
+        Returns:
+            list: Bundle entries in chain order.
+        """
+        sha256 = hashlib.sha256()
+        with open(self.manifest_path, "rb") as fobj:
+            hashing_reader = io.BufferedReader(HashingReader(fobj, sha256))
+            with VaultStreamReader(hashing_reader, self.key) as reader:
+                manifest = json.load(reader)
+        if expected_sha256sum is not None and sha256.hexdigest() != expected_sha256sum:
+            raise VaultBundleChainError("Verification of bundle chain failed")
+        if manifest.get("version") != CHAIN_VERSION:
+            raise VaultBundleChainError(
+                f"Unsupported bundle chain version: {manifest.get('version')}"
+            )
+        return manifest["bundles"]
+
+    def _encrypt_manifest(self, bundles, manifest_path):
+        """
+        Encrypt and atomically write a chain manifest to a path.
+
+        Args:
+            bundles (list): Bundle entries in chain order.
+            manifest_path (Path): Target path.
+
+        Returns:
+            str: sha256 sum of the encrypted manifest.
+        """
+        sha256 = hashlib.sha256()
+        manifest = {"version": CHAIN_VERSION, "bundles": bundles}
+        tmp_path = Path(str(manifest_path) + ".tmp")
+        with open(tmp_path, "wb") as fobj:
+            with HashingWriter(fobj, sha256) as hashing_writer:
+                with VaultStreamWriter(hashing_writer, self.key) as writer:
+                    writer.write(json.dumps(manifest, sort_keys=True).encode())
+        tmp_path.replace(manifest_path)
+        return sha256.hexdigest()
+
+    def _write_manifest(self, bundles):
+        """
+        Encrypt and write the chain manifest.
+
+        Args:
+            bundles (list): Bundle entries in chain order.
+
+        Returns:
+            str: sha256 sum of the encrypted manifest.
+        """
+        sha256sum = self._encrypt_manifest(bundles, self.manifest_path)
+        self.manifest_sha256sum_path.write_text(sha256sum)
+        return sha256sum
+
+    @staticmethod
+    def _git(git_path, *args, **kwargs):
+        return subprocess.run(
+            ["git", "--git-dir", str(git_path), *args],
+            check=True, capture_output=True, **kwargs
+        )
+
+    @staticmethod
+    def _refs(git_path):
+        """
+        Get all refs of a repository.
+
+        Args:
+            git_path (Path): Path to git directory.
+
+        Returns:
+            dict: Object name by ref name.
+        """
+        output = VaultBundleChain._git(
+            git_path, "for-each-ref", "--format=%(objectname) %(refname)"
+        ).stdout.decode()
+        refs = {}
+        for line in output.splitlines():
+            object_name, ref_name = line.split(" ", 1)
+            refs[ref_name] = object_name
+        return refs
+
+    def _existing_tips(self, git_path, bundles):
+        """
+        Get the recorded ref targets still present in a repository.
+
+        Args:
+            git_path (Path): Path to git directory.
+            bundles (list): Bundle entries in chain order.
+
+        Returns:
+            list: Object names.
+        """
+        tips = sorted({tip for bundle in bundles for tip in bundle["refs"].values()})
+        if not tips:
+            return []
+        output = self._git(
+            git_path, "cat-file", "--batch-check=%(objectname) %(objecttype)",
+            input="\n".join(tips).encode() + b"\n"
+        ).stdout.decode()
+        return [line.split()[0] for line in output.splitlines() if not line.endswith("missing")]
+
+    def _create_bundle(self, git_path, bundle_path, exclude_tips):
+        """
+        Create an encrypted bundle of all objects not reachable from `exclude_tips`.
+
+        Args:
+            git_path (Path): Path to git directory.
+            bundle_path (Path): Path to encrypted bundle.
+            exclude_tips (sequence): Object names already contained in the chain.
+
+        Returns:
+            str: sha256 sum of the encrypted bundle or None if no new
+                 objects exist.
+        """
+        sha256 = hashlib.sha256()
+        tmp_path = Path(str(bundle_path) + ".tmp")
+        process = subprocess.Popen(
+            ["git", "--git-dir", str(git_path), "bundle", "create", "--quiet", "-",
+             "--all", "--reflog", "--stdin"],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+        )
+        process.stdin.write("".join(f"^{tip}\n" for tip in exclude_tips).encode())
+        process.stdin.close()
+        with open(tmp_path, "wb") as fobj:
+            with HashingWriter(fobj, sha256) as hashing_writer:
+                with VaultStreamWriter(hashing_writer, self.key, threads=self.threads) as writer:
+                    shutil.copyfileobj(process.stdout, writer)
+        stderr = process.stderr.read().decode()
+        if process.wait() != 0:
+            tmp_path.unlink()
+            if "empty bundle" in stderr:
+                return None
+            raise VaultBundleChainError(f"Creating git bundle failed: {stderr}")
+        tmp_path.replace(bundle_path)
+        return sha256.hexdigest()
+
+    def store(self, git_path, max_bundles=16):
+        """
+        Add the objects created since the last store to the chain.
+
+        Args:
+            git_path (Path): Path to git directory.
+            max_bundles (int): Compact the chain into a single bundle
+                               once it reaches this length.
+
+        Returns:
+            str: sha256 sum of the encrypted manifest.
+        """
+        git_path = Path(git_path)
+        bundles = self.load_manifest() if self.exists() else []
+        if len(bundles) >= max_bundles:
+            bundles = []
+        self.path.mkdir(parents=True, exist_ok=True)
+        index_tree = None
+        try:
+            index_tree = self._git(git_path, "write-tree").stdout.decode().strip()
+        except subprocess.CalledProcessError:
+            pass
+        if index_tree:
+            self._git(git_path, "update-ref", "--no-deref", INDEX_REF, index_tree)
+        try:
+            refs = self._refs(git_path)
+            bundle_name = f"{len(bundles):04d}-{os.urandom(4).hex()}{self.bundle_suffix}"
+            sha256sum = self._create_bundle(
+                git_path, self.path / bundle_name, self._existing_tips(git_path, bundles)
+            )
+        finally:
+            if index_tree:
+                self._git(git_path, "update-ref", "-d", INDEX_REF)
+        if sha256sum is not None:
+            bundles.append({"file": bundle_name, "sha256": sha256sum, "refs": refs})
+        manifest_sha256sum = self._write_manifest(bundles)
+        self._remove_unreferenced_bundles(bundles)
+        return manifest_sha256sum
+
+    def _remove_unreferenced_bundles(self, bundles):
+        """
+        Delete all bundles not referenced by the chain.
+
+        Deleted bundles are removed from the shadow repository by its next
+        commit in `DeploymentVault.update_shadow_repo`.
+
+        Args:
+            bundles (list): Bundle entries in chain order.
+        """
+        referenced = {bundle["file"] for bundle in bundles}
+        for bundle_path in self.path.glob(f"*{self.bundle_suffix}"):
+            if bundle_path.name not in referenced:
+                bundle_path.unlink()
+
+    def _restore_bundle(self, bundle, objects_path, scratch_path):
+        """
+        Decrypt a bundle and add its objects to an object directory.
+
+        The objects are unbundled through a scratch repository without refs,
+        so refs of the target repository pointing to objects of later
+        bundles do not fail the unbundle.
+
+        Args:
+            bundle (dict): Bundle entry.
+            objects_path (Path): Target object directory.
+            scratch_path (Path): Scratch directory.
+        """
+        sha256 = hashlib.sha256()
+        plain_bundle_path = scratch_path / "bundle"
+        with open(self.path / bundle["file"], "rb") as src, open(plain_bundle_path, "wb") as dst:
+            hashing_reader = io.BufferedReader(HashingReader(src, sha256))
+            with VaultStreamReader(hashing_reader, self.key, threads=self.threads) as reader:
+                shutil.copyfileobj(reader, dst)
+        if sha256.hexdigest() != bundle["sha256"]:
+            raise VaultBundleChainError(f"Verification of bundle {bundle['file']} failed")
+        env = dict(os.environ, GIT_OBJECT_DIRECTORY=str(objects_path))
+        self._git(scratch_path / "repo.git", "bundle", "unbundle", str(plain_bundle_path), env=env)
+        plain_bundle_path.unlink()
+
+    def restore(self, git_path, expected_sha256sum=None):
+        """
+        Restore all objects of the chain into a git directory.
+
+        Args:
+            git_path (Path): Path to git directory.
+            expected_sha256sum (str): If given, the encrypted manifest is
+                                      verified against this sha256 sum.
+        """
+        bundles = self.load_manifest(expected_sha256sum)
+        objects_path = Path(git_path) / "objects"
+        for directory in ("info", "pack"):
+            (objects_path / directory).mkdir(parents=True, exist_ok=True)
+        scratch_path = Path(tempfile.mkdtemp(prefix=".unbundle-", dir=git_path))
+        try:
+            self._git(scratch_path / "repo.git", "init", "--quiet", "--bare")
+            for bundle in bundles:
+                try:
+                    self._restore_bundle(bundle, objects_path.resolve(), scratch_path)
+                except VaultFormatError as err:
+                    raise VaultBundleChainError(
+                        f"Decryption of bundle {bundle['file']} failed"
+                    ) from err
+        finally:
+            shutil.rmtree(scratch_path, ignore_errors=True)
+
+    def prepare_key_rotation(self, new_key, expected_sha256sum=None):
+        """
+        Re-encrypt the chain with a new key without activating it.
+
+        Bundles are re-encrypted as a stream into new files and the new
+        manifest is written to `self.staged_manifest_path`. The current
+        chain stays untouched until `commit_key_rotation` is called. New
+        bundles are removed again if re-encryption fails.
+
+        Args:
+            new_key (bytes): New key.
+            expected_sha256sum (str): If given, the encrypted manifest is
+                                      verified against this sha256 sum.
+
+        Returns:
+            str: sha256 sum of the new encrypted manifest.
+        """
+        bundles = self.load_manifest(expected_sha256sum)
+        new_bundles = []
+        try:
+            for number, bundle in enumerate(bundles):
+                bundle_name = f"{number:04d}-{os.urandom(4).hex()}{self.bundle_suffix}"
+                tmp_path = self.path / (bundle_name + ".tmp")
+                try:
+                    with open(self.path / bundle["file"], "rb") as src, open(tmp_path, "w+b") as dst:
+                        sha256sum, new_sha256sum, _ = reencrypt(
+                            src, dst, self.key, new_key, self.threads
+                        )
+                    if sha256sum != bundle["sha256"]:
+                        raise VaultBundleChainError(
+                            f"Verification of bundle {bundle['file']} failed"
+                        )
+                except VaultFormatError as err:
+                    raise VaultBundleChainError(
+                        f"Decryption of bundle {bundle['file']} failed"
+                    ) from err
+                tmp_path.replace(self.path / bundle_name)
+                new_bundles.append(dict(bundle, file=bundle_name, sha256=new_sha256sum))
+            new_chain = VaultBundleChain(self.path, new_key, self.threads)
+            sha256sum = new_chain._encrypt_manifest(new_bundles, self.staged_manifest_path)
+        except BaseException:
+            for tmp_path in self.path.glob("*.tmp"):
+                tmp_path.unlink()
+            for bundle in new_bundles:
+                (self.path / bundle["file"]).unlink(missing_ok=True)
+            raise
+        self._rotation = (new_key, new_bundles, sha256sum)
+        return sha256sum
+
+    def commit_key_rotation(self):
+        """
+        Activate the chain prepared by `prepare_key_rotation`.
+
+        The staged manifest replaces the current one and the bundles
+        encrypted with the old key are removed.
+
+        Returns:
+            str: sha256 sum of the new encrypted manifest.
+        """
+        new_key, new_bundles, sha256sum = self._rotation
+        self.staged_manifest_path.replace(self.manifest_path)
+        self.manifest_sha256sum_path.write_text(sha256sum)
+        self.key = new_key
+        self._rotation = None
+        self._remove_unreferenced_bundles(new_bundles)
+        return sha256sum
+
+    def abort_key_rotation(self):
+        """
+        Remove the staged manifest and bundles of `prepare_key_rotation`.
+        """
+        if self._rotation is not None:
+            for bundle in self._rotation[1]:
+                (self.path / bundle["file"]).unlink(missing_ok=True)
+            self._rotation = None
+        self.staged_manifest_path.unlink(missing_ok=True)
+
+    def delete(self):
+        """
+        Delete the bundle chain.
+        """
+        shutil.rmtree(self.path, ignore_errors=True)
@@ -0,0 +1,185 @@
+"""
+Module containing the compression backends used by DeploymentVault.
+
+Data is compressed in independent blocks, which allows blocks to be
+compressed in parallel on a thread pool while the output stays identical
+for any number of threads. Every block is a complete gzip member or zstd
+frame, so the output is readable by the regular gzip and zstd tools.
+"""
+
+import collections
+import gzip
+import io
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+COMPRESSION_ALGORITHMS = ("gzip", "zstd", "none")
+DEFAULT_COMPRESSION_LEVELS = {"gzip": 9, "zstd": 3, "none": None}
+DEFAULT_BLOCK_SIZE = 1024 * 1024
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+
+class VaultCompressionError(Exception):
+    pass
+
+
+def _require_zstandard():
+    if zstandard is None:
+        raise VaultCompressionError(
+            "zstd compression requires the 'zstandard' package to be installed"
+        )
+
+
+class BlockCompressor(io.RawIOBase):
+    """
+    Writable stream compressing data in independent blocks.
+
+    Args:
+        fileobj (file): Binary file object receiving compressed data.
+        algorithm (str): One of `COMPRESSION_ALGORITHMS`.
+        level (int): Compression level. Defaults to the algorithm's default.
+        threads (int): Number of compression threads.
+                       Defaults to the number of CPUs.
+        block_size (int): Uncompressed size of a block.
+        on_block (callable): Called with the uncompressed and compressed
+                             size of every block in output order.
+    """
+
+    def __init__(self, fileobj, algorithm="gzip", level=None, threads=None,
+                 block_size=DEFAULT_BLOCK_SIZE, on_block=None):
+        super().__init__()
+        if algorithm not in COMPRESSION_ALGORITHMS:
+            raise VaultCompressionError(f"Unsupported compression: {algorithm}")
+        if algorithm == "zstd":
+            _require_zstandard()
+        self._fileobj = fileobj
+        self._algorithm = algorithm
+        self._level = level if level is not None else DEFAULT_COMPRESSION_LEVELS[algorithm]
+        self._threads = threads or os.cpu_count() or 1
+        self._block_size = block_size
+        self._on_block = on_block
+        self._buffer = bytearray()
+        self._pending = collections.deque()
+        self._local = threading.local()
+        self._executor = None
+        if self._threads > 1 and algorithm != "none":
+            self._executor = ThreadPoolExecutor(max_workers=self._threads)
+
+    def writable(self):
+        return True
+
+    def _compress_block(self, block):
+        """
+        Compress a single block.
+
+        Args:
+            block (bytes): Uncompressed block.
+
+        Returns:
+            bytes: Compressed block.
+        """
+        if self._algorithm == "gzip":
+            return gzip.compress(block, compresslevel=self._level, mtime=0)
+        if self._algorithm == "zstd":
+            if not hasattr(self._local, "compressor"):
+                self._local.compressor = zstandard.ZstdCompressor(level=self._level)
+            return self._local.compressor.compress(block)
+        return block
+
+    def _write_completed(self, wait=False):
+        """
+        Write compressed blocks to `self._fileobj` in submission order.
+
+        Args:
+            wait (bool): Wait for all pending blocks.
+        """
+        while self._pending and (wait or self._pending[0][1].done()
+                                 or len(self._pending) > 2 * self._threads):
+            block_size, future = self._pending.popleft()
+            self._write_block(block_size, future.result())
+
+    def _write_block(self, block_size, compressed_block):
+        self._fileobj.write(compressed_block)
+        if self._on_block is not None:
+            self._on_block(block_size, len(compressed_block))
+
+    def _submit_block(self, block):
+        if self._executor is None:
+            self._write_block(len(block), self._compress_block(block))
+        else:
+            future = self._executor.submit(self._compress_block, block)
+            self._pending.append((len(block), future))
+            self._write_completed()
+
+    def write(self, data):
+        self._buffer += data
+        while len(self._buffer) >= self._block_size:
+            self._submit_block(bytes(self._buffer[:self._block_size]))
+            del self._buffer[:self._block_size]
+        return len(data)
+
+    def close(self):
+        """
+        Compress remaining data and close the stream.
+
+        The underlying file object is not closed.
+        """
+        if not self.closed:
+            if self._buffer:
+                self._submit_block(bytes(self._buffer))
+                self._buffer = bytearray()
+            self._write_completed(wait=True)
+            if self._executor is not None:
+                self._executor.shutdown()
+        super().close()
+
+
+def decompress_block(block, algorithm):
+    """
+    Decompress a single block written by `BlockCompressor`.
+
+    Args:
+        block (bytes): Compressed block.
+        algorithm (str): Algorithm the block was compressed with.
+
+    Returns:
+        bytes: Uncompressed block.
+    """
+    if algorithm == "gzip":
+        return gzip.decompress(block)
+    if algorithm == "zstd":
+        _require_zstandard()
+        return zstandard.ZstdDecompressor().decompress(block)
+    return block
+
+
+def open_decompressed(fileobj):
+    """
+    Open a decompressing stream for compressed data.
+
+    The compression is detected from the data, so any supported algorithm
+    as well as single member gzip streams written by older versions can
+    be read.
+
+    Args:
+        fileobj (file): Buffered binary file object supporting `peek`.
+
+    Returns:
+        file: Readable stream of decompressed data.
+    """
+    magic = fileobj.peek(4)[:4]
+    if magic.startswith(GZIP_MAGIC):
+        return gzip.GzipFile(fileobj=fileobj, mode="rb")
+    if magic == ZSTD_MAGIC:
+        _require_zstandard()
+        return zstandard.ZstdDecompressor().stream_reader(
+            fileobj, read_across_frames=True, closefd=False
+        )
+    return fileobj
@@ -0,0 +1,564 @@
+"""
+Module containing the streaming container format used by DeploymentVault.
+
+A vault container consists of a header followed by a sequence of frames.
+Each frame holds at most ``frame_size`` bytes of plaintext and is
+encrypted and authenticated on its own, so data can be encrypted and
+decrypted with constant memory. Frames are independent, so they are
+encrypted and decrypted in parallel on a thread pool while being written
+and consumed in frame order.
+
+Format version 2 (written)::
+
+    ADVAULT2 <frame_size> <salt>\n
+    <frame>
+    ...
+    <frame>
+
+Frames are raw binary: a big-endian 32 bit word holding the final flag in
+its highest bit and the length of the ciphertext in the remaining bits,
+followed by the AES-256-GCM ciphertext and tag. The container key is
+derived from the deployment key and the random 16 byte ``salt`` (hex
+encoded in the header) with HKDF-SHA256, so the frame index can serve as
+nonce. The header, frame index and final flag are authenticated as
+associated data.
+
+Format version 1 (read only)::
+
+    ADVAULT1 <frame_size>
+    <fernet token>
+    ...
+    <fernet token>
+
+Every token encrypts ``struct.pack(">QB", frame_index, final) + data``.
+
+In both versions binding the frame index and the final flag into the
+authenticated data detects reordered, dropped and truncated frames.
+
+Files not starting with the container magic are treated as legacy
+archives consisting of a single Fernet token.
+"""
+
+import base64
+import collections
+import hashlib
+import io
+import os
+import struct
+from concurrent.futures import ThreadPoolExecutor
+from cryptography.exceptions import InvalidTag
+from cryptography.fernet import Fernet, InvalidToken
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+
+MAGIC = b"ADVAULT"
+FORMAT_VERSION = 2
+SUPPORTED_FORMAT_VERSIONS = (1, 2)
+DEFAULT_FRAME_SIZE = 1024 * 1024
+FRAME_HEADER = struct.Struct(">QB")
+FRAME_LENGTH = struct.Struct(">I")
+FINAL_FLAG = 1 << 31
+SALT_SIZE = 16
+NONCE = struct.Struct(">4xQ")
+HKDF_INFO = b"ansible-deployment vault v2"
+
+
+class VaultFormatError(Exception):
+    pass
+
+
+def is_container(file_path):
+    """
+    Check if a file is a vault container.
+
+    Args:
+        file_path (Path): Path to encrypted file.
+
+    Returns:
+        bool: True if file starts with the container magic.
+    """
+    with open(file_path, "rb") as fobj:
+        return fobj.read(len(MAGIC)) == MAGIC
+
+
+def _derive_cipher(key, salt):
+    """
+    Derive the AES-GCM cipher of a version 2 container.
+
+    Args:
+        key (bytes): Fernet key.
+        salt (bytes): Salt of the container.
+
+    Returns:
+        AESGCM: Cipher of the container.
+    """
+    hkdf = HKDF(algorithm=hashes.SHA256(), length=32, salt=salt, info=HKDF_INFO)
+    return AESGCM(hkdf.derive(base64.urlsafe_b64decode(key)))
+
+
+def _read_exact(fileobj, size):
+    data = fileobj.read(size)
+    while len(data) < size:
+        chunk = fileobj.read(size - len(data))
+        if not chunk:
+            break
+        data += chunk
+    return data
+
+
+def _parse_header(header):
+    """
+    Parse a container header line.
+
+    Args:
+        header (bytes): Header line.
+
+    Returns:
+        tuple: Format version, frame size and salt.
+    """
+    if not header.startswith(MAGIC):
+        raise VaultFormatError("Missing vault container header")
+    try:
+        version, frame_size, *salt = header[len(MAGIC):].split()
+        version = int(version)
+        frame_size = int(frame_size)
+        salt = bytes.fromhex(salt[0].decode()) if salt else None
+    except ValueError as err:
+        raise VaultFormatError("Invalid vault container header") from err
+    if version not in SUPPORTED_FORMAT_VERSIONS:
+        raise VaultFormatError(f"Unsupported vault format version: {version}")
+    if version == 2 and (salt is None or len(salt) != SALT_SIZE):
+        raise VaultFormatError("Invalid vault container header")
+    return version, frame_size, salt
+
+
+def _decrypt_frame(cipher_suite, token, expected_index):
+    """
+    Decrypt and authenticate a single version 1 frame.
+
+    Args:
+        cipher_suite (Fernet): Cipher used for decryption.
+        token (bytes): Encrypted frame.
+        expected_index (int): Expected frame index.
+
+    Returns:
+        tuple: Frame data and final flag.
+    """
+    try:
+        plain_data = cipher_suite.decrypt(token)
+    except InvalidToken as err:
+        raise VaultFormatError(
+            f"Authentication of frame {expected_index} failed"
+        ) from err
+    frame_index, final = FRAME_HEADER.unpack_from(plain_data)
+    if frame_index != expected_index:
+        raise VaultFormatError(
+            f"Unexpected frame {frame_index}, expected {expected_index}"
+        )
+    return memoryview(plain_data)[FRAME_HEADER.size:], bool(final)
+
+
+def _decrypt_aead_frame(cipher, header, ciphertext, final, frame_index):
+    """
+    Decrypt and authenticate a single version 2 frame.
+
+    Args:
+        cipher (AESGCM): Cipher of the container.
+        header (bytes): Header line of the container.
+        ciphertext (bytes): Encrypted frame without length word.
+        final (bool): Final flag of the frame.
+        frame_index (int): Index of the frame.
+
+    Returns:
+        tuple: Frame data and final flag.
+    """
+    try:
+        plain_data = cipher.decrypt(
+            NONCE.pack(frame_index), ciphertext,
+            header + FRAME_HEADER.pack(frame_index, final)
+        )
+    except InvalidTag as err:
+        raise VaultFormatError(
+            f"Authentication of frame {frame_index} failed"
+        ) from err
+    return memoryview(plain_data), final
+
+
+def _read_aead_frame(fileobj):
+    """
+    Read a version 2 frame.
+
+    Args:
+        fileobj (file): Binary file object positioned at the frame.
+
+    Returns:
+        tuple: Ciphertext and final flag or None at the end of the file.
+    """
+    length_word = _read_exact(fileobj, FRAME_LENGTH.size)
+    if not length_word:
+        return None
+    if len(length_word) < FRAME_LENGTH.size:
+        raise VaultFormatError("Vault container is truncated")
+    (length_word,) = FRAME_LENGTH.unpack(length_word)
+    ciphertext = _read_exact(fileobj, length_word & ~FINAL_FLAG)
+    if len(ciphertext) < length_word & ~FINAL_FLAG:
+        raise VaultFormatError("Vault container is truncated")
+    return ciphertext, bool(length_word & FINAL_FLAG)
+
+
+def read_frame(fileobj, key, offset, frame_index):
+    """
+    Decrypt a single frame at a known position of a vault container.
+
+    Args:
+        fileobj (file): Seekable binary file object of the container.
+        key (bytes): Fernet key.
+        offset (int): File offset of the frame.
+        frame_index (int): Index of the frame.
+
+    Returns:
+        bytes: Frame data.
+    """
+    fileobj.seek(0)
+    header = fileobj.readline()
+    version, _, salt = _parse_header(header)
+    fileobj.seek(offset)
+    if version == 1:
+        token = fileobj.readline().rstrip(b"\n")
+        data, _ = _decrypt_frame(Fernet(key), token, frame_index)
+    else:
+        frame = _read_aead_frame(fileobj)
+        if frame is None:
+            raise VaultFormatError("Vault container is truncated")
+        data, _ = _decrypt_aead_frame(
+            _derive_cipher(key, salt), header, *frame, frame_index
+        )
+    return bytes(data)
+
+
+class VaultStreamWriter(io.RawIOBase):
+    """
+    Writable stream encrypting data into a vault container.
+
+    Args:
+        fileobj (file): Binary file object receiving the container.
+        key (bytes): Fernet key.
+        frame_size (int): Maximum plaintext size per frame.
+        threads (int): Number of encryption threads.
+                       Defaults to the number of CPUs.
+
+    Attributes:
+        frame_offsets (list): File offsets of all written frames.
+    """
+
+    def __init__(self, fileobj, key, frame_size=DEFAULT_FRAME_SIZE, threads=None):
+        super().__init__()
+        if frame_size + 16 >= FINAL_FLAG:
+            raise VaultFormatError(f"Frame size too large: {frame_size}")
+        self._fileobj = fileobj
+        salt = os.urandom(SALT_SIZE)
+        self._cipher = _derive_cipher(key, salt)
+        self._frame_size = frame_size
+        self._threads = threads or os.cpu_count() or 1
+        self._buffer = bytearray()
+        self._frame_index = 0
+        self._pending = collections.deque()
+        self._executor = None
+        self.frame_offsets = []
+        self._header = b"%s%d %d %s\n" % (MAGIC, FORMAT_VERSION, frame_size, salt.hex().encode())
+        self._fileobj.write(self._header)
+        self._offset = len(self._header)
+
+    @property
+    def frame_size(self):
+        return self._frame_size
+
+    def writable(self):
+        return True
+
+    def _encrypt_frame(self, data, frame_index, final):
+        ciphertext = self._cipher.encrypt(
+            NONCE.pack(frame_index), data,
+            self._header + FRAME_HEADER.pack(frame_index, final)
+        )
+        length_word = len(ciphertext) | (FINAL_FLAG if final else 0)
+        return FRAME_LENGTH.pack(length_word) + ciphertext
+
+    def _write_encrypted_frame(self, frame):
+        self.frame_offsets.append(self._offset)
+        self._fileobj.write(frame)
+        self._offset += len(frame)
+
+    def _write_completed(self, wait=False):
+        """
+        Write encrypted frames to `self._fileobj` in frame order.
+
+        Args:
+            wait (bool): Wait for all pending frames.
+        """
+        while self._pending and (wait or self._pending[0].done()
+                                 or len(self._pending) > 2 * self._threads):
+            self._write_encrypted_frame(self._pending.popleft().result())
+
+    def _write_frame(self, data, final=False):
+        frame_index = self._frame_index
+        self._frame_index += 1
+        # The pool is only started once a container spans several frames,
+        # small files are encrypted on the calling thread.
+        if self._executor is None and self._threads > 1 and not final:
+            self._executor = ThreadPoolExecutor(max_workers=self._threads)
+        if self._executor is None:
+            self._write_encrypted_frame(self._encrypt_frame(data, frame_index, final))
+        else:
+            self._pending.append(
+                self._executor.submit(self._encrypt_frame, data, frame_index, final)
+            )
+            self._write_completed()
+
+    def write(self, data):
+        self._buffer += data
+        while len(self._buffer) >= self._frame_size:
+            self._write_frame(bytes(self._buffer[:self._frame_size]))
+            del self._buffer[:self._frame_size]
+        return len(data)
+
+    def close(self):
+        """
+        Write the final frame and close the stream.
+
+        The underlying file object is not closed.
+        """
+        if not self.closed:
+            self._write_frame(bytes(self._buffer), final=True)
+            self._buffer = bytearray()
+            self._write_completed(wait=True)
+            if self._executor is not None:
+                self._executor.shutdown()
+        super().close()
+
+
+class VaultStreamReader(io.RawIOBase):
+    """
+    Readable stream decrypting a vault container.
+
+    Args:
+        fileobj (file): Binary file object positioned at the container start.
+        key (bytes): Fernet key.
+        threads (int): Number of decryption threads.
+                       Defaults to the number of CPUs.
+
+    Attributes:
+        version (int): Format version of the container.
+        frame_size (int): Maximum plaintext size per frame.
+
+    Raises:
+        VaultFormatError: If the container is malformed or fails authentication.
+    """
+
+    def __init__(self, fileobj, key, threads=None):
+        super().__init__()
+        self._fileobj = fileobj
+        self._threads = threads or os.cpu_count() or 1
+        self._buffer = memoryview(b"")
+        self._read_index = 0
+        self._final = False
+        self._eof = False
+        self._pending = collections.deque()
+        self._executor = None
+        header = fileobj.readline()
+        self.version, self.frame_size, salt = _parse_header(header)
+        if self.version == 1:
+            self._cipher_suite = Fernet(key)
+        else:
+            self._header = header
+            self._cipher = _derive_cipher(key, salt)
+
+    def readable(self):
+        return True
+
+    def _read_encrypted_frame(self):
+        """
+        Read the next encrypted frame.
+
+        Returns:
+            tuple: Decrypt function of the frame followed by its arguments
+                   or None at the end of the container.
+        """
+        if self.version == 1:
+            token = self._fileobj.readline().rstrip(b"\n")
+            if not token:
+                return None
+            return _decrypt_frame, self._cipher_suite, token, self._read_index
+        frame = _read_aead_frame(self._fileobj)
+        if frame is None:
+            return None
+        return _decrypt_aead_frame, self._cipher, self._header, *frame, self._read_index
+
+    def _read_ahead(self):
+        """
+        Read encrypted frames and submit them for decryption.
+
+        Up to two frames per thread are decrypted ahead of the consumer.
+        """
+        read_ahead = 2 * self._threads if self._threads > 1 else 1
+        while not self._eof and len(self._pending) < read_ahead:
+            frame = self._read_encrypted_frame()
+            if frame is None:
+                self._eof = True
+                break
+            if self._executor is None and self._threads > 1 and self._pending:
+                self._executor = ThreadPoolExecutor(max_workers=self._threads)
+            if self._executor is None:
+                decrypt, *args = frame
+                self._pending.append(decrypt(*args))
+            else:
+                self._pending.append(self._executor.submit(*frame))
+            self._read_index += 1
+
+    def _read_frame(self):
+        """
+        Decrypt the next frame into `self._buffer`.
+        """
+        self._read_ahead()
+        if not self._pending:
+            raise VaultFormatError("Vault container is truncated")
+        frame = self._pending.popleft()
+        if not isinstance(frame, tuple):
+            frame = frame.result()
+        self._buffer, self._final = frame
+        if self._final and (self._pending or self._fileobj.read(1)):
+            raise VaultFormatError("Trailing data after final frame")
+
+    def readinto(self, buffer):
+        while not len(self._buffer) and not self._final:
+            self._read_frame()
+        size = min(len(buffer), len(self._buffer))
+        buffer[:size] = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        return size
+
+    def close(self):
+        """
+        Close the stream and stop pending decryptions.
+
+        The underlying file object is not closed.
+        """
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
+        self._pending.clear()
+        super().close()
+
+
+class HashingWriter(io.RawIOBase):
+    """
+    Writable stream passing data to a file object while hashing it.
+
+    Args:
+        fileobj (file): Binary file object receiving the data.
+        hash_obj: hashlib object updated with all written data.
+    """
+
+    def __init__(self, fileobj, hash_obj):
+        super().__init__()
+        self._fileobj = fileobj
+        self.hash_obj = hash_obj
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.hash_obj.update(data)
+        return self._fileobj.write(data)
+
+
+class HashingReader(io.RawIOBase):
+    """
+    Readable stream reading from a file object while hashing it.
+
+    Args:
+        fileobj (file): Binary file object to read from.
+        hash_obj: hashlib object updated with all read data.
+    """
+
+    def __init__(self, fileobj, hash_obj):
+        super().__init__()
+        self._fileobj = fileobj
+        self.hash_obj = hash_obj
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        size = self._fileobj.readinto(buffer)
+        self.hash_obj.update(memoryview(buffer)[:size])
+        return size
+
+    def drain(self, buffer_size=128 * 1024):
+        """
+        Read and hash the remaining data of the underlying file object.
+        """
+        buffer = bytearray(buffer_size)
+        while self.readinto(buffer):
+            pass
+
+
+def reencrypt(src, dst, key, new_key, threads=None, plain_hash_objs=()):
+    """
+    Re-encrypt a vault container with another key.
+
+    The plaintext is streamed from `src` to `dst` and never written
+    anywhere else. The frame size is kept, so plaintext offsets of the
+    frames do not change. Legacy archives are decrypted in memory and
+    written as container.
+
+    After writing, the new container is read back, decrypted with
+    `new_key` and compared to the plaintext of the source.
+
+    Args:
+        src (file): Binary file object of the source container.
+        dst (file): Binary file object opened for writing and reading.
+        key (bytes): Key of the source container.
+        new_key (bytes): Key of the new container.
+        threads (int): Number of encryption threads.
+        plain_hash_objs (sequence): hashlib or hmac objects updated
+                                    with the plaintext.
+
+    Returns:
+        tuple: sha256 sum of the source, sha256 sum of the new container
+               and file offsets of the new container's frames.
+    """
+    source_sha256 = hashlib.sha256()
+    target_sha256 = hashlib.sha256()
+    plain_sha256 = hashlib.sha256()
+    plain_hash_objs = (plain_sha256, *plain_hash_objs)
+    hashing_reader = io.BufferedReader(HashingReader(src, source_sha256))
+    if hashing_reader.peek(len(MAGIC))[:len(MAGIC)] == MAGIC:
+        reader = VaultStreamReader(hashing_reader, key, threads)
+        frame_size = reader.frame_size
+    else:
+        try:
+            reader = io.BytesIO(Fernet(key).decrypt(hashing_reader.read()))
+        except InvalidToken as err:
+            raise VaultFormatError("Authentication of legacy archive failed") from err
+        frame_size = DEFAULT_FRAME_SIZE
+    with reader:
+        with HashingWriter(dst, target_sha256) as hashing_writer:
+            with VaultStreamWriter(hashing_writer, new_key, frame_size, threads) as writer:
+                for chunk in iter(lambda: reader.read(frame_size), b""):
+                    for hash_obj in plain_hash_objs:
+                        hash_obj.update(chunk)
+                    writer.write(chunk)
+    dst.flush()
+    dst.seek(0)
+    verify_sha256 = hashlib.sha256()
+    verify_plain_sha256 = hashlib.sha256()
+    hashing_reader = io.BufferedReader(HashingReader(dst, verify_sha256))
+    with VaultStreamReader(hashing_reader, new_key, threads) as reader:
+        for chunk in iter(lambda: reader.read(frame_size), b""):
+            verify_plain_sha256.update(chunk)
+    if (verify_sha256.hexdigest() != target_sha256.hexdigest()
+            or verify_plain_sha256.digest() != plain_sha256.digest()):
+        raise VaultFormatError("Verification of re-encrypted container failed")
+    return source_sha256.hexdigest(), target_sha256.hexdigest(), writer.frame_offsets
@@ -0,0 +1,217 @@
+"""
+Module containing the VaultIndex class.
+"""
+
+import bisect
+import io
+import json
+import tarfile
+from pathlib import Path
+from ansible_deployment.class_skeleton import AnsibleDeployment
+from ansible_deployment.vault_compression import decompress_block
+from ansible_deployment.vault_format import (
+    VaultStreamReader,
+    VaultStreamWriter,
+    read_frame,
+)
+
+INDEX_VERSION = 1
+
+
+class VaultIndexError(Exception):
+    pass
+
+
+class VaultIndex(AnsibleDeployment):
+    """
+    Represents the encrypted member index of a vault archive.
+
+    The index maps archive members to their position in the uncompressed
+    tar stream and records the position of every compressed block and
+    encrypted frame. Since blocks are compressed independently, a member
+    can be read by decrypting and decompressing only the blocks covering it.
+
+    Args:
+        path (path): Path to the encrypted index.
+        key (bytes): Key used for encryption.
+
+    Attributes:
+        path (Path): Path to the encrypted index.
+        archive_sha256sum (str): sha256 sum of the indexed archive.
+        compression (str): Compression algorithm of the archive.
+        frame_size (int): Plaintext size of the archive's frames.
+        frames (list): File offsets of the archive's frames.
+        blocks (list): Uncompressed offset, compressed offset and
+                       compressed size of every block.
+        members (dict): Member information by member name.
+    """
+
+    filtered_attributes = ["key", "frames", "blocks", "members"]
+
+    def __init__(self, path, key):
+        self.path = Path(path)
+        self.key = key
+        self.archive_sha256sum = None
+        self.compression = None
+        self.frame_size = None
+        self.frames = []
+        self.blocks = []
+        self.members = {}
+        self._uncompressed_offset = 0
+        self._compressed_offset = 0
+
+    def add_block(self, uncompressed_size, compressed_size):
+        """
+        Add the next compressed block of the archive.
+
+        Args:
+            uncompressed_size (int): Uncompressed size of block.
+            compressed_size (int): Compressed size of block.
+        """
+        self.blocks.append(
+            (self._uncompressed_offset, self._compressed_offset, compressed_size)
+        )
+        self._uncompressed_offset += uncompressed_size
+        self._compressed_offset += compressed_size
+
+    def add_member(self, tarinfo, data_offset):
+        """
+        Add an archive member.
+
+        Args:
+            tarinfo (tarfile.TarInfo): Member information.
+            data_offset (int): Offset of member data in the tar stream.
+        """
+        if tarinfo.isfile():
+            member_type = "file"
+        elif tarinfo.isdir():
+            member_type = "dir"
+        elif tarinfo.issym():
+            member_type = "symlink"
+        else:
+            member_type = "other"
+        self.members[tarinfo.name] = {
+            "type": member_type,
+            "offset": data_offset,
+            "size": tarinfo.size,
+            "mode": tarinfo.mode,
+            "linkname": tarinfo.linkname,
+        }
+
+    def write(self, archive_sha256sum, compression, frame_size, frames):
+        """
+        Encrypt and write the index.
+
+        Args:
+            archive_sha256sum (str): sha256 sum of the indexed archive.
+            compression (str): Compression algorithm of the archive.
+            frame_size (int): Plaintext size of the archive's frames.
+            frames (list): File offsets of the archive's frames.
+        """
+        self.archive_sha256sum = archive_sha256sum
+        self.compression = compression
+        self.frame_size = frame_size
+        self.frames = frames
+        index = {
+            "version": INDEX_VERSION,
+            "archive_sha256sum": archive_sha256sum,
+            "compression": compression,
+            "frame_size": frame_size,
+            "frames": frames,
+            "blocks": self.blocks,
+            "members": self.members,
+        }
+        with open(self.path, "wb") as fobj:
+            with VaultStreamWriter(fobj, self.key) as writer:
+                writer.write(json.dumps(index).encode())
+
+    def load(self):
+        """
+        Decrypt and load the index.
+        """
+        with open(self.path, "rb") as fobj:
+            with VaultStreamReader(io.BufferedReader(fobj), self.key) as reader:
+                index = json.load(reader)
+        if index.get("version") != INDEX_VERSION:
+            raise VaultIndexError(f"Unsupported vault index version: {index.get('version')}")
+        self.archive_sha256sum = index["archive_sha256sum"]
+        self.compression = index["compression"]
+        self.frame_size = index["frame_size"]
+        self.frames = index["frames"]
+        self.blocks = [tuple(block) for block in index["blocks"]]
+        self.members = index["members"]
+
+    def _read_compressed(self, fobj, offset, size, frame_cache):
+        """
+        Read a range of the compressed stream from the encrypted archive.
+
+        Args:
+            fobj (file): Encrypted archive.
+            offset (int): Offset in the compressed stream.
+            size (int): Size of range.
+            frame_cache (dict): Already decrypted frames by frame index.
+
+        Returns:
+            bytes: Compressed data.
+        """
+        first_frame = offset // self.frame_size
+        last_frame = (offset + size - 1) // self.frame_size
+        data = bytearray()
+        for frame_index in range(first_frame, last_frame + 1):
+            if frame_index not in frame_cache:
+                frame_cache.clear()
+                frame_cache[frame_index] = read_frame(
+                    fobj, self.key, self.frames[frame_index], frame_index
+                )
+            data += frame_cache[frame_index]
+        start = offset - first_frame * self.frame_size
+        return bytes(data[start:start + size])
+
+    def read_member(self, archive_path, name):
+        """
+        Read a single file from the encrypted archive.
+
+        Args:
+            archive_path (Path): Path to encrypted archive.
+            name (str): Member name.
+
+        Returns:
+            bytes: File content.
+        """
+        member = self.members.get(name)
+        if member is None or member["type"] != "file":
+            raise FileNotFoundError(name)
+        start = member["offset"]
+        end = start + member["size"]
+        data = bytearray()
+        if start == end:
+            return bytes(data)
+        block_offsets = [block[0] for block in self.blocks]
+        first_block = bisect.bisect_right(block_offsets, start) - 1
+        frame_cache = {}
+        with open(archive_path, "rb") as fobj:
+            for uncompressed_offset, offset, size in self.blocks[first_block:]:
+                if uncompressed_offset >= end:
+                    break
+                compressed_block = self._read_compressed(fobj, offset, size, frame_cache)
+                block = decompress_block(compressed_block, self.compression)
+                data += block[max(start - uncompressed_offset, 0):end - uncompressed_offset]
+        return bytes(data)
+
+
+class IndexingTarFile(tarfile.TarFile):
+    """
+    TarFile recording the data offset of every added member in a VaultIndex.
+
+    Args:
+        index (VaultIndex): Index receiving members.
+    """
+
+    def __init__(self, *args, index=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.index = index
+
+    def addfile(self, tarinfo, fileobj=None):
+        header = tarinfo.tobuf(self.format, self.encoding, self.errors)
+        self.index.add_member(tarinfo, self.offset + len(header))
+        super().addfile(tarinfo, fileobj)
@@ -0,0 +1,529 @@
+"""
+Module containing the VaultObjectStore class.
+"""
+
+import hashlib
+import hmac
+import io
+import json
+import os
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from ansible_deployment.class_skeleton import AnsibleDeployment
+from ansible_deployment.vault_format import (
+    HashingReader,
+    HashingWriter,
+    VaultFormatError,
+    VaultStreamReader,
+    VaultStreamWriter,
+    reencrypt,
+)
+
+MANIFEST_VERSION = 1
+
+
+class VaultObjectStoreError(Exception):
+    pass
+
+
+class VaultObjectStore(AnsibleDeployment):
+    """
+    Represents a content-addressed store of encrypted vault objects.
+
+    Every file is stored as an encrypted object named after a keyed hash
+    of its content. An encrypted manifest maps the relative paths of the
+    stored files to their objects, so unchanged files are neither
+    re-encrypted on lock nor rewritten on unlock. Changed files are
+    encrypted and decrypted in parallel.
+
+    Args:
+        path (path): Object store directory.
+        key (bytes): Key used for encryption.
+        threads (int): Number of encryption threads.
+                       Defaults to the number of CPUs.
+
+    Attributes:
+        path (Path): Object store directory.
+        objects_path (Path): Directory containing the encrypted objects.
+        manifest_path (Path): Path to the encrypted manifest.
+        manifest_sha256sum_path (Path): Path to the manifest's sha256 sum.
+        staged_manifest_path (Path): Path to the manifest prepared by a
+                                     key rotation.
+        threads (int): Number of encryption threads.
+    """
+
+    filtered_attributes = ["key", "_rotation"]
+    manifest_file_name = "manifest.enc"
+
+    def __init__(self, path, key, threads=None):
+        self.path = Path(path)
+        self.key = key
+        self.threads = threads or os.cpu_count() or 1
+        self.objects_path = self.path / "objects"
+        self.manifest_path = self.path / self.manifest_file_name
+        self.manifest_sha256sum_path = Path(str(self.manifest_path) + ".SHA256")
+        self.staged_manifest_path = Path(str(self.manifest_path) + ".new")
+        self._rotation = None
+
+    def exists(self):
+        """
+        Check if the object store contains a manifest.
+
+        Returns:
+            bool: True if a manifest exists.
+        """
+        return self.manifest_path.exists()
+
+    def _object_hash(self):
+        """
+        Create a keyed hash object used to compute object ids.
+        """
+        return hmac.new(self.key, b"ansible-deployment object", hashlib.sha256)
+
+    def _object_path(self, object_id):
+        return self.objects_path / object_id[:2] / object_id[2:]
+
+    def _file_object_id(self, file_path):
+        """
+        Compute the object id of a file.
+
+        Args:
+            file_path (Path): Path to file.
+
+        Returns:
+            str: Object id.
+        """
+        object_hash = self._object_hash()
+        with open(file_path, "rb") as fobj:
+            for chunk in iter(lambda: fobj.read(128 * 1024), b""):
+                object_hash.update(chunk)
+        return object_hash.hexdigest()
+
+    def _store_object(self, file_path, object_id):
+        """
+        Encrypt a file into the object store.
+
+        Args:
+            file_path (Path): Path to file.
+            object_id (str): Object id of the file.
+        """
+        object_path = self._object_path(object_id)
+        if object_path.exists():
+            return
+        object_path.parent.mkdir(parents=True, exist_ok=True)
+        # Files with equal content may be stored concurrently.
+        tmp_fd, tmp_name = tempfile.mkstemp(
+            prefix=f".{object_path.name}.", suffix=".tmp", dir=object_path.parent
+        )
+        with open(file_path, "rb") as src, open(tmp_fd, "wb") as dst:
+            with VaultStreamWriter(dst, self.key, threads=1) as writer:
+                shutil.copyfileobj(src, writer)
+        Path(tmp_name).replace(object_path)
+
+    def _store_file(self, file_path):
+        """
+        Hash and encrypt a file into the object store.
+
+        Args:
+            file_path (Path): Path to file.
+
+        Returns:
+            str: Object id of the file.
+        """
+        object_id = self._file_object_id(file_path)
+        self._store_object(file_path, object_id)
+        return object_id
+
+    def _restore_object(self, object_id, file_path):
+        """
+        Decrypt an object to a given path.
+
+        The decrypted content is checked against the object id before
+        it replaces `file_path`.
+
+        Args:
+            object_id (str): Object id.
+            file_path (Path): Destination path.
+        """
+        object_path = self._object_path(object_id)
+        if not object_path.exists():
+            raise VaultObjectStoreError(f"Missing vault object: {object_id}")
+        object_hash = self._object_hash()
+        tmp_path = file_path.parent / f".{file_path.name}.tmp"
+        with open(object_path, "rb") as src, open(tmp_path, "wb") as dst:
+            with VaultStreamReader(src, self.key, threads=1) as reader:
+                with HashingWriter(dst, object_hash) as writer:
+                    shutil.copyfileobj(reader, writer)
+        if not hmac.compare_digest(object_hash.hexdigest(), object_id):
+            tmp_path.unlink()
+            raise VaultObjectStoreError(f"Verification of vault object {object_id} failed")
+        tmp_path.replace(file_path)
+
+    def read(self, relative_path):
+        """
+        Decrypt a single stored file.
+
+        Args:
+            relative_path (str): Relative path of the stored file.
+
+        Returns:
+            bytes: File content.
+        """
+        entry = self.load_manifest(self.manifest_sha256sum_path.read_text()).get(relative_path)
+        if entry is None or entry["type"] != "file":
+            raise FileNotFoundError(relative_path)
+        return self.read_object(entry["object"])
+
+    def read_object(self, object_id):
+        """
+        Decrypt and verify a single object.
+
+        Args:
+            object_id (str): Object id.
+
+        Returns:
+            bytes: Object content.
+        """
+        object_path = self._object_path(object_id)
+        if not object_path.exists():
+            raise VaultObjectStoreError(f"Missing vault object: {object_id}")
+        with open(object_path, "rb") as fobj:
+            with VaultStreamReader(fobj, self.key) as reader:
+                data = reader.read()
+        object_hash = self._object_hash()
+        object_hash.update(data)
+        if not hmac.compare_digest(object_hash.hexdigest(), object_id):
+            raise VaultObjectStoreError(f"Verification of vault object {object_id} failed")
+        return data
+
+    @staticmethod
+    def _walk(root_path, files):
+        """
+        Expand a sequence of files and directories.
+
+        Args:
+            root_path (Path): Root directory of relative paths.
+            files (sequence): Sequence of paths.
+
+        Yields:
+            tuple: Relative path and absolute Path object.
+        """
+        for file_name in files:
+            file_path = root_path / file_name
+            if not file_path.exists() and not file_path.is_symlink():
+                continue
+            yield file_path.relative_to(root_path).as_posix(), file_path
+            if file_path.is_dir() and not file_path.is_symlink():
+                for dir_path, dir_names, file_names in os.walk(file_path):
+                    for name in sorted(dir_names) + sorted(file_names):
+                        path = Path(dir_path) / name
+                        yield path.relative_to(root_path).as_posix(), path
+
+    def load_manifest(self, expected_sha256sum=None):
+        """
+        Decrypt and parse the manifest.
+
+        Args:
+            expected_sha256sum (str): If given, the encrypted manifest is
+                                      verified against this sha256 sum.
+
+        Returns:
+            dict: Manifest entries by relative path.
+        """
+        sha256 = hashlib.sha256()
+        with open(self.manifest_path, "rb") as fobj:
+            hashing_reader = io.BufferedReader(HashingReader(fobj, sha256))
+            with VaultStreamReader(hashing_reader, self.key) as reader:
+                manifest = json.load(reader)
+        if expected_sha256sum is not None and sha256.hexdigest() != expected_sha256sum:
+            raise VaultObjectStoreError("Verification of vault manifest failed")
+        if manifest.get("version") != MANIFEST_VERSION:
+            raise VaultObjectStoreError(
+                f"Unsupported vault manifest version: {manifest.get('version')}"
+            )
+        return manifest["entries"]
+
+    def _encrypt_manifest(self, entries, manifest_path):
+        """
+        Encrypt and atomically write a manifest to a path.
+
+        Args:
+            entries (dict): Manifest entries by relative path.
+            manifest_path (Path): Target path.
+
+        Returns:
+            str: sha256 sum of the encrypted manifest.
+        """
+        sha256 = hashlib.sha256()
+        manifest = {"version": MANIFEST_VERSION, "entries": entries}
+        manifest_data = json.dumps(manifest, sort_keys=True).encode()
+        tmp_path = Path(str(manifest_path) + ".tmp")
+        with open(tmp_path, "wb") as fobj:
+            with HashingWriter(fobj, sha256) as hashing_writer:
+                with VaultStreamWriter(hashing_writer, self.key) as writer:
+                    writer.write(manifest_data)
+        tmp_path.replace(manifest_path)
+        return sha256.hexdigest()
+
+    def _write_manifest(self, entries):
+        """
+        Encrypt and write the manifest.
+
+        Args:
+            entries (dict): Manifest entries by relative path.
+
+        Returns:
+            str: sha256 sum of the encrypted manifest.
+        """
+        sha256sum = self._encrypt_manifest(entries, self.manifest_path)
+        self.manifest_sha256sum_path.write_text(sha256sum)
+        return sha256sum
+
+    def _remove_unreferenced_objects(self, entries):
+        """
+        Delete all objects not referenced by manifest entries.
+
+        Deleted objects are removed from the shadow repository by its next
+        commit in `DeploymentVault.update_shadow_repo`.
+
+        Args:
+            entries (dict): Manifest entries by relative path.
+        """
+        referenced = {entry["object"] for entry in entries.values() if "object" in entry}
+        for object_path in self.objects_path.glob("*/*"):
+            object_id = object_path.parent.name + object_path.name
+            if object_id not in referenced:
+                object_path.unlink()
+
+    def store(self, root_path, files, exclude=None):
+        """
+        Store files in the object store.
+
+        Only files that are new or changed since the last manifest are
+        encrypted. Files are considered unchanged if size and
+        modification time match their previous manifest entry.
+
+        Args:
+            root_path (Path): Root directory of relative paths.
+            files (sequence): Sequence of files and directories to store.
+            exclude (callable): Called with the relative path of every file.
+                                Files are skipped if it returns True.
+
+        Returns:
+            str: sha256 sum of the encrypted manifest.
+        """
+        previous_entries = self.load_manifest() if self.exists() else {}
+        entries = {}
+        changed_files = {}
+        self.objects_path.mkdir(parents=True, exist_ok=True)
+        for relative_path, file_path in self._walk(Path(root_path), files):
+            if exclude is not None and exclude(relative_path):
+                continue
+            stat = file_path.lstat()
+            entry = {"mode": stat.st_mode & 0o7777}
+            if file_path.is_symlink():
+                entry["type"] = "symlink"
+                entry["target"] = os.readlink(file_path)
+            elif file_path.is_dir():
+                entry["type"] = "dir"
+            else:
+                entry["type"] = "file"
+                entry["size"] = stat.st_size
+                entry["mtime_ns"] = stat.st_mtime_ns
+                previous_entry = previous_entries.get(relative_path, {})
+                unchanged = (
+                    previous_entry.get("size") == stat.st_size
+                    and previous_entry.get("mtime_ns") == stat.st_mtime_ns
+                    and self._object_path(previous_entry["object"]).exists()
+                )
+                if unchanged:
+                    entry["object"] = previous_entry["object"]
+                else:
+                    changed_files[relative_path] = file_path
+            entries[relative_path] = entry
+        with ThreadPoolExecutor(max_workers=self.threads) as executor:
+            object_ids = executor.map(self._store_file, changed_files.values())
+            for relative_path, object_id in zip(changed_files, object_ids):
+                entries[relative_path]["object"] = object_id
+        sha256sum = self._write_manifest(entries)
+        self._remove_unreferenced_objects(entries)
+        return sha256sum
+
+    def restore(self, root_path, entries):
+        """
+        Restore files from the object store.
+
+        Only files that are missing or differ from their manifest entry
+        are decrypted. Directories and symlinks are created first, files
+        are decrypted on `self.threads` threads.
+
+        Args:
+            root_path (Path): Root directory of relative paths.
+            entries (dict): Manifest entries by relative path.
+        """
+        root_path = Path(root_path)
+        files = []
+        for relative_path in sorted(entries):
+            entry = entries[relative_path]
+            file_path = root_path / relative_path
+            if entry["type"] == "dir":
+                file_path.mkdir(parents=True, exist_ok=True)
+                file_path.chmod(entry["mode"])
+            elif entry["type"] == "symlink":
+                if file_path.is_symlink() or file_path.exists():
+                    file_path.unlink()
+                file_path.symlink_to(entry["target"])
+            else:
+                file_path.parent.mkdir(parents=True, exist_ok=True)
+                files.append((file_path, entry))
+        with ThreadPoolExecutor(max_workers=self.threads) as executor:
+            # Consume the results to raise the first failed restore.
+            for _ in executor.map(lambda item: self._restore_file(*item), files):
+                pass
+
+    def _restore_file(self, file_path, entry):
+        """
+        Decrypt a file unless it matches its manifest entry.
+
+        Args:
+            file_path (Path): Destination path.
+            entry (dict): Manifest entry.
+        """
+        if self._is_current(file_path, entry):
+            return
+        self._restore_object(entry["object"], file_path)
+        file_path.chmod(entry["mode"])
+        os.utime(file_path, ns=(entry["mtime_ns"], entry["mtime_ns"]))
+
+    def _rotate_object(self, object_id, new_store):
+        """
+        Re-encrypt an object into another object store.
+
+        Args:
+            object_id (str): Object id.
+            new_store (VaultObjectStore): Object store using the new key.
+
+        Returns:
+            str: Object id in `new_store`.
+        """
+        object_path = self._object_path(object_id)
+        if not object_path.exists():
+            raise VaultObjectStoreError(f"Missing vault object: {object_id}")
+        object_hash = self._object_hash()
+        new_object_hash = new_store._object_hash()
+        tmp_fd, tmp_name = tempfile.mkstemp(suffix=".tmp", dir=object_path.parent)
+        try:
+            with open(object_path, "rb") as src, open(tmp_fd, "w+b") as dst:
+                reencrypt(src, dst, self.key, new_store.key, threads=1,
+                          plain_hash_objs=(object_hash, new_object_hash))
+            if not hmac.compare_digest(object_hash.hexdigest(), object_id):
+                raise VaultObjectStoreError(f"Verification of vault object {object_id} failed")
+        except (VaultFormatError, VaultObjectStoreError):
+            Path(tmp_name).unlink()
+            raise
+        new_object_id = new_object_hash.hexdigest()
+        new_store._object_path(new_object_id).parent.mkdir(parents=True, exist_ok=True)
+        Path(tmp_name).replace(new_store._object_path(new_object_id))
+        return new_object_id
+
+    def prepare_key_rotation(self, new_key):
+        """
+        Re-encrypt the object store with a new key without activating it.
+
+        The manifest is verified and every object is re-encrypted as a
+        stream into a new object named after its id under the new key.
+        The new manifest is written to `self.staged_manifest_path`. The
+        current manifest and objects stay untouched, so the store remains
+        readable with the old key until `commit_key_rotation` is called.
+        New objects are removed again if re-encryption fails.
+
+        Args:
+            new_key (bytes): New key.
+
+        Returns:
+            str: sha256 sum of the new encrypted manifest.
+        """
+        entries = self.load_manifest(self.manifest_sha256sum_path.read_text())
+        new_store = VaultObjectStore(self.path, new_key, self.threads)
+        object_ids = sorted({entry["object"] for entry in entries.values() if "object" in entry})
+        new_object_ids = {}
+        error = None
+        with ThreadPoolExecutor(max_workers=self.threads) as executor:
+            futures = {
+                object_id: executor.submit(self._rotate_object, object_id, new_store)
+                for object_id in object_ids
+            }
+            for object_id, future in futures.items():
+                try:
+                    new_object_ids[object_id] = future.result()
+                except (VaultFormatError, VaultObjectStoreError) as err:
+                    error = error or err
+        if error is not None:
+            for new_object_id in new_object_ids.values():
+                new_store._object_path(new_object_id).unlink(missing_ok=True)
+            raise error
+        for entry in entries.values():
+            if "object" in entry:
+                entry["object"] = new_object_ids[entry["object"]]
+        sha256sum = new_store._encrypt_manifest(entries, self.staged_manifest_path)
+        self._rotation = (new_key, entries, sha256sum)
+        return sha256sum
+
+    def commit_key_rotation(self):
+        """
+        Activate the object store prepared by `prepare_key_rotation`.
+
+        The staged manifest replaces the current one and the objects
+        encrypted with the old key are removed.
+
+        Returns:
+            str: sha256 sum of the new encrypted manifest.
+        """
+        new_key, entries, sha256sum = self._rotation
+        self.staged_manifest_path.replace(self.manifest_path)
+        self.manifest_sha256sum_path.write_text(sha256sum)
+        self.key = new_key
+        self._rotation = None
+        self._remove_unreferenced_objects(entries)
+        return sha256sum
+
+    def abort_key_rotation(self):
+        """
+        Remove the staged manifest and objects of `prepare_key_rotation`.
+        """
+        if self._rotation is not None:
+            new_key, entries, _ = self._rotation
+            new_store = VaultObjectStore(self.path, new_key, self.threads)
+            for entry in entries.values():
+                if "object" in entry:
+                    new_store._object_path(entry["object"]).unlink(missing_ok=True)
+            self._rotation = None
+        self.staged_manifest_path.unlink(missing_ok=True)
+
+    def _is_current(self, file_path, entry):
+        """
+        Check if a file matches its manifest entry.
+
+        Args:
+            file_path (Path): Path to file.
+            entry (dict): Manifest entry.
+
+        Returns:
+            bool: True if the file does not need to be restored.
+        """
+        if file_path.is_symlink() or not file_path.is_file():
+            return False
+        stat = file_path.stat()
+        if stat.st_size != entry["size"]:
+            return False
+        if stat.st_mtime_ns == entry["mtime_ns"]:
+            return True
+        return self._file_object_id(file_path) == entry["object"]
+
+    def delete(self):
+        """
+        Delete the object store.
+        """
+        shutil.rmtree(self.path, ignore_errors=True)
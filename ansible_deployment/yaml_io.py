@@ -0,0 +1,49 @@
+"""
+Module containing the YAML loading and dumping functions.
+
+The libyaml based loader and dumper are used if PyYAML was built with
+libyaml and the pure python implementations otherwise. The C dumper
+shares its representer and resolver with the python dumper, so both
+produce the same documents. Only documents consisting of a single
+scalar differ, since the python emitter ends them with ``...``. Those
+are always dumped by the python dumper.
+"""
+
+import yaml
+
+try:
+    from yaml import CSafeLoader as SafeLoader, CDumper as Dumper
+except ImportError:
+    from yaml import SafeLoader, Dumper
+
+LIBYAML = SafeLoader is not yaml.SafeLoader
+
+
+def safe_load(stream):
+    """
+    Parse a YAML document using only standard YAML tags.
+
+    Args:
+        stream (str|bytes|file): YAML document or file object.
+
+    Returns:
+        Parsed YAML data.
+    """
+    return yaml.load(stream, Loader=SafeLoader)
+
+
+def dump(data, stream=None, **kwargs):
+    """
+    Serialize data as YAML document like `yaml.dump`.
+
+    Args:
+        data: Data to serialize.
+        stream (file): File object to write to. If None, the document
+                       is returned.
+        **kwargs: Additional `yaml.dump` arguments.
+
+    Returns:
+        str: YAML document if `stream` is None.
+    """
+    dumper = Dumper if isinstance(data, (dict, list)) else yaml.Dumper
+    return yaml.dump(data, stream, Dumper=dumper, **kwargs)
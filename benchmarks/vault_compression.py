@@ -0,0 +1,131 @@
+"""
+Benchmark vault archive compression backends.
+
+Measures compression throughput and ratio of every compression backend
+on a synthetic deployment-like payload or on a given directory:
+
+    $ python benchmarks/vault_compression.py [--size-mb 64] [--path DIR]
+"""
+
+import argparse
+import io
+import os
+import random
+import tarfile
+import time
+from ansible_deployment.vault_compression import (
+    BlockCompressor,
+    VaultCompressionError,
+    open_decompressed,
+)
+
+BACKENDS = (
+    ("none", None, 1),
+    ("gzip", 6, 1),
+    ("gzip", 9, 1),
+    ("gzip", 6, os.cpu_count()),
+    ("gzip", 9, os.cpu_count()),
+    ("zstd", 3, 1),
+    ("zstd", 3, os.cpu_count()),
+    ("zstd", 10, os.cpu_count()),
+)
+
+
+def synthetic_payload(size):
+    """
+    Create a payload mixing yaml-like text and incompressible data.
+
+    Args:
+        size (int): Payload size in bytes.
+
+    Returns:
+        bytes: Payload.
+    """
+    rng = random.Random(0)
+    chunks = []
+    total = 0
+    while total < size:
+        if rng.random() < 0.7:
+            host = rng.randrange(10000)
+            chunk = (
+                f"host{host}:\n  ansible_host: 10.0.{host % 256}.{host // 256}\n"
+                f"  ansible_user: ansible\n  ansible_port: {rng.randrange(1, 65535)}\n"
+            ).encode() * 64
+        else:
+            chunk = rng.randbytes(16 * 1024)
+        chunks.append(chunk)
+        total += len(chunk)
+    return b"".join(chunks)[:size]
+
+
+def directory_payload(path):
+    """
+    Create an uncompressed tar stream of a directory.
+
+    Args:
+        path (str): Directory path.
+
+    Returns:
+        bytes: Tar stream.
+    """
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w|") as tar:
+        tar.add(path)
+    return buffer.getvalue()
+
+
+def run_backend(payload, algorithm, level, threads):
+    """
+    Compress and decompress payload with a single backend.
+
+    Returns:
+        tuple: Compressed size, compression and decompression seconds.
+    """
+    output = io.BytesIO()
+    start = time.perf_counter()
+    with BlockCompressor(output, algorithm, level, threads) as compressor:
+        for offset in range(0, len(payload), tarfile.RECORDSIZE):
+            compressor.write(payload[offset:offset + tarfile.RECORDSIZE])
+    compress_time = time.perf_counter() - start
+
+    output.seek(0)
+    start = time.perf_counter()
+    reader = open_decompressed(io.BufferedReader(output))
+    while reader.read(1024 * 1024):
+        pass
+    decompress_time = time.perf_counter() - start
+    return len(output.getvalue()), compress_time, decompress_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--size-mb", type=int, default=64,
+                        help="Size of the synthetic payload in MiB.")
+    parser.add_argument("--path", help="Benchmark a tar stream of this directory.")
+    args = parser.parse_args()
+
+    if args.path:
+        payload = directory_payload(args.path)
+    else:
+        payload = synthetic_payload(args.size_mb * 1024 * 1024)
+    size_mb = len(payload) / 1024 / 1024
+
+    print(f"payload: {size_mb:.1f} MiB")
+    print(f"{'backend':<10}{'level':>6}{'threads':>8}{'ratio':>8}"
+          f"{'compress MiB/s':>16}{'decompress MiB/s':>18}")
+    for algorithm, level, threads in BACKENDS:
+        try:
+            size, compress_time, decompress_time = run_backend(
+                payload, algorithm, level, threads
+            )
+        except VaultCompressionError as err:
+            print(f"{algorithm:<10}{'':>6}{threads:>8}  skipped: {err}")
+            continue
+        print(f"{algorithm:<10}{str(level):>6}{threads:>8}"
+              f"{size / len(payload):>8.3f}"
+              f"{size_mb / compress_time:>16.1f}"
+              f"{size_mb / decompress_time:>18.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+Benchmark YAML loading and dumping of a deployment inventory.
+
+Measures the pure python PyYAML loader and dumper against the ones used
+by ansible_deployment.yaml_io on a synthetic inventory and verifies both
+produce identical output:
+
+    $ python benchmarks/yaml_io.py [--hosts 5000]
+"""
+
+import argparse
+import io
+import random
+import time
+import yaml
+from ansible_deployment import yaml_io
+
+GROUPS = ("web", "db", "cache", "monitoring", "k3s_master", "k3s_node")
+
+
+def synthetic_inventory(host_count):
+    """
+    Create an inventory like the ones written by Inventory.write.
+
+    Args:
+        host_count (int): Number of hosts.
+
+    Returns:
+        tuple: hosts.yml data, host vars and group vars.
+    """
+    rng = random.Random(0)
+    hosts = {"all": {"hosts": {}, "children": {}}}
+    host_vars = {}
+    group_vars = {}
+    for group in GROUPS:
+        hosts["all"]["children"][group] = {"hosts": {}, "children": {"ansible_deployment": None}}
+        group_vars[group] = {
+            f"{group}_setting_{index}": rng.choice(
+                (rng.randrange(65535), f"value-{rng.randrange(10 ** 6)}", True, None,
+                 [f"item-{item}" for item in range(rng.randrange(5))])
+            )
+            for index in range(50)
+        }
+    for number in range(host_count):
+        hostname = f"host{number:05d}.example.org"
+        hosts["all"]["hosts"][hostname] = None
+        for group in rng.sample(GROUPS, rng.randrange(1, 3)):
+            hosts["all"]["children"][group]["hosts"][hostname] = None
+        host_vars[hostname] = {
+            "ansible_host": f"10.{number // 65536}.{number // 256 % 256}.{number % 256}",
+            "ansible_user": "ansible",
+            "ansible_port": 22,
+            "location": rng.choice(("fsn1", "nbg1", "hel1", "ash")),
+            "server_type": f"cx{rng.choice((11, 21, 31, 41))}",
+            "labels": {f"label{index}": f"value{rng.randrange(100)}" for index in range(5)},
+            "volumes": [{"name": f"vol{index}", "size": rng.randrange(10, 500)} for index in range(2)],
+            "description": "Generated host used for benchmarking the inventory yaml handling.",
+        }
+    return hosts, host_vars, group_vars
+
+
+def dump_documents(documents, dump):
+    """
+    Dump every document like Inventory.write does.
+
+    Returns:
+        tuple: Dumped documents and seconds.
+    """
+    start = time.perf_counter()
+    dumped = []
+    for document in documents:
+        stream = io.StringIO()
+        dump(document, stream)
+        dumped.append(stream.getvalue())
+    return dumped, time.perf_counter() - start
+
+
+def load_documents(dumped, load):
+    """
+    Load every dumped document.
+
+    Returns:
+        tuple: Loaded documents and seconds.
+    """
+    start = time.perf_counter()
+    loaded = [load(document) for document in dumped]
+    return loaded, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--hosts", type=int, default=5000,
+                        help="Number of inventory hosts.")
+    args = parser.parse_args()
+
+    hosts, host_vars, group_vars = synthetic_inventory(args.hosts)
+    documents = [hosts, *host_vars.values(), *group_vars.values()]
+
+    python_dumped, python_dump_time = dump_documents(documents, yaml.dump)
+    dumped, dump_time = dump_documents(documents, yaml_io.dump)
+    python_loaded, python_load_time = load_documents(python_dumped, yaml.safe_load)
+    loaded, load_time = load_documents(dumped, yaml_io.safe_load)
+
+    print(f"hosts: {args.hosts}, documents: {len(documents)}, "
+          f"size: {sum(map(len, dumped)) / 1024 / 1024:.1f} MiB, libyaml: {yaml_io.LIBYAML}")
+    print(f"{'operation':<10}{'python s':>10}{'yaml_io s':>11}{'speedup':>9}")
+    for operation, python_time, yaml_io_time in (("dump", python_dump_time, dump_time),
+                                                 ("load", python_load_time, load_time)):
+        print(f"{operation:<10}{python_time:>10.2f}{yaml_io_time:>11.2f}"
+              f"{python_time / yaml_io_time:>9.1f}")
+    print(f"identical output: {dumped == python_dumped}")
+    print(f"identical data: {loaded == python_loaded == documents}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+"""
+Shared fixtures creating deployments in temporary directories.
+"""
+
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+import pytest
+
+PACKAGE_PATH = Path(__file__).resolve().parent.parent
+ROLES = {
+    "base/defaults/main.yml": "base_var: 1\n",
+    "base/tasks/main.yml": "- debug: msg=hi\n",
+    "web/defaults/main.yml": "web_port: 80\n",
+}
+# Files excluded from the shadow repository by DeploymentVault.update_shadow_repo.
+SHADOW_EXCLUDED_FILES = ("deployment.key", ".terraform", "deployment.tar.gz.enc", ".ssh")
+
+
+def git(path, *args):
+    """
+    Run git in a directory.
+
+    Returns:
+        str: Output of git.
+    """
+    return subprocess.run(
+        ["git", "-C", str(path), *args], check=True, capture_output=True, text=True
+    ).stdout
+
+
+class CliDeployment:
+    """
+    Deployment directory operated through the command line interface.
+
+    Args:
+        path (Path): Deployment directory.
+
+    Attributes:
+        path (Path): Deployment directory.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def run(self, *args, check=True):
+        """
+        Run an ansible-deployment command confirming all prompts.
+
+        Returns:
+            subprocess.CompletedProcess: Finished command.
+        """
+        process = subprocess.run(
+            [sys.executable, "-c", "from ansible_deployment.cli import main; main()", *args],
+            cwd=self.path, input="y\n" * 10, capture_output=True, text=True,
+        )
+        if check and process.returncode != 0:
+            raise AssertionError(f"{args} failed:\n{process.stdout}\n{process.stderr}")
+        return process
+
+    def commit_file(self, file_name, content):
+        """
+        Write and commit a file to the unlocked deployment repo.
+        """
+        (self.path / file_name).parent.mkdir(parents=True, exist_ok=True)
+        (self.path / file_name).write_text(content)
+        git(self.path, "add", "-f", file_name)
+        git(self.path, "commit", "-q", "-m", f"Update {file_name}")
+
+    def remove_file(self, file_name):
+        """
+        Remove and commit a file of the unlocked deployment repo.
+        """
+        git(self.path, "rm", "-q", file_name)
+        git(self.path, "commit", "-q", "-m", f"Remove {file_name}")
+
+    @property
+    def locked(self):
+        return (self.path / ".LOCKED").exists()
+
+    def shadow_tree(self):
+        """
+        List the files of the shadow repository's HEAD commit.
+
+        Returns:
+            list: Sorted file paths.
+        """
+        return sorted(git(self.path, "ls-tree", "-r", "--name-only", "HEAD").splitlines())
+
+    def shadow_files_on_disk(self):
+        """
+        List the files the shadow repository should track.
+
+        Returns:
+            list: Sorted file paths.
+        """
+        files = []
+        for root, dir_names, file_names in os.walk(self.path):
+            relative_root = Path(root).relative_to(self.path)
+            if relative_root == Path("."):
+                dir_names[:] = [
+                    name for name in dir_names
+                    if name not in (".git", ".roles.git") and name not in SHADOW_EXCLUDED_FILES
+                ]
+                file_names = [name for name in file_names if name not in SHADOW_EXCLUDED_FILES]
+            files += [(relative_root / name).as_posix() for name in file_names]
+        return sorted(files)
+
+
+@pytest.fixture(autouse=True)
+def environment(tmp_path, monkeypatch):
+    """
+    Isolate git identity, caches and the vault agent socket directory.
+    """
+    for variable in ("GIT_AUTHOR", "GIT_COMMITTER"):
+        monkeypatch.setenv(f"{variable}_NAME", "test")
+        monkeypatch.setenv(f"{variable}_EMAIL", "test@example.org")
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    (tmp_path / "runtime").mkdir(mode=0o700)
+    monkeypatch.setenv("XDG_RUNTIME_DIR", str(tmp_path / "runtime"))
+    monkeypatch.setenv("PYTHONPATH", str(PACKAGE_PATH))
+
+
+@pytest.fixture
+def roles_repo(tmp_path):
+    """
+    Roles repository with the roles ``base`` and ``web``.
+    """
+    path = tmp_path / "roles"
+    for file_name, content in ROLES.items():
+        (path / file_name).parent.mkdir(parents=True, exist_ok=True)
+        (path / file_name).write_text(content)
+    git(tmp_path, "init", "-q", "-b", "master", str(path))
+    git(path, "add", ".")
+    git(path, "commit", "-q", "-m", "Add roles")
+    return path
+
+
+@pytest.fixture
+def make_deployment(tmp_path, roles_repo):
+    """
+    Factory initializing unlocked deployments.
+
+    Args:
+        vault_config (dict): Vault configuration of the deployment.
+        roles_repo_config (dict): Additional roles repo configuration.
+
+    Returns:
+        CliDeployment: Initialized deployment.
+    """
+    def make(vault_config=None, roles_repo_config=None, name="deployment"):
+        remote_path = tmp_path / f"{name}.git"
+        git(tmp_path, "init", "-q", "--bare", "-b", "master", str(remote_path))
+        path = tmp_path / name
+        path.mkdir()
+        config = {
+            "name": name,
+            "roles": ["base", "web"],
+            "deployment_repo": {"url": str(remote_path), "reference": "master"},
+            "roles_repo": dict(
+                {"url": str(roles_repo), "reference": "master"}, **(roles_repo_config or {})
+            ),
+            "inventory_sources": [],
+            "inventory_writers": [],
+        }
+        if vault_config is not None:
+            config["vault"] = vault_config
+        (path / "deployment.json").write_text(json.dumps(config))
+        deployment = CliDeployment(path)
+        deployment.run("init", "--non-interactive")
+        deployment.commit_file("hosts.yml", "all:\n  hosts:\n    h1:\n  children: {}\n")
+        deployment.commit_file("host_vars/h1", "ansible_host: 192.0.2.1\n")
+        return deployment
+
+    return make
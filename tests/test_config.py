@@ -0,0 +1,47 @@
+"""
+Tests for parsing the deployment configuration.
+"""
+
+import pytest
+from ansible_deployment.config import (
+    RepoConfig,
+    VaultConfig,
+    parse_repo_config,
+    parse_vault_config,
+)
+
+
+def test_parse_vault_config():
+    vault_config = parse_vault_config({"mode": "incremental", "git_bundles": True})
+    assert vault_config == VaultConfig()._replace(mode="incremental", git_bundles=True)
+
+
+def test_parse_vault_config_ignores_unknown_keys():
+    vault_config = parse_vault_config({"compression": "zstd", "future_option": 1})
+    assert vault_config == VaultConfig()._replace(compression="zstd")
+
+
+@pytest.mark.parametrize("raw_vault_config,message", [
+    ({"mode": "nope"}, "Invalid vault mode"),
+    ({"compression": "lz4"}, "Invalid vault compression"),
+])
+def test_parse_invalid_vault_config(raw_vault_config, message):
+    with pytest.raises(ValueError, match=message):
+        parse_vault_config(raw_vault_config)
+
+
+def test_parse_repo_config():
+    repo_config = parse_repo_config(
+        {"url": "roles.git", "reference": "main", "depth": 1, "future_option": 1}
+    )
+    assert repo_config == RepoConfig("roles.git", "main", depth=1)
+
+
+@pytest.mark.parametrize("raw_repo_config,message", [
+    ({"url": "roles.git"}, "Missing repo config option: reference"),
+    ({"url": "roles.git", "reference": "main", "depth": 0}, "Invalid repo depth"),
+    ({"url": "roles.git", "reference": "main", "copy_mode": "move"}, "Invalid repo copy mode"),
+])
+def test_parse_invalid_repo_config(raw_repo_config, message):
+    with pytest.raises(ValueError, match=message):
+        parse_repo_config(raw_repo_config)
@@ -0,0 +1,14 @@
+"""
+Tests for the Deployment class and its context managers.
+"""
+
+
+def test_ephemeral_show_prints_deployment_path(make_deployment):
+    deployment = make_deployment({"ephemeral_unlock": True})
+    deployment.run("lock")
+
+    output = deployment.run("show").stdout
+
+    assert str(deployment.path / "playbook.yml") in output
+    assert "ansible-deployment-" not in output
+    assert deployment.locked
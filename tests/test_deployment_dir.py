@@ -0,0 +1,43 @@
+"""
+Tests for the DeploymentDirectory class.
+"""
+
+from conftest import git
+
+
+def test_unlock_restores_roles_without_changing_roles_repo(make_deployment):
+    deployment = make_deployment({"exclude_roles": True})
+    deployment.run("lock")
+    roles_repo_path = deployment.path / ".roles.git"
+    recorded_commit = (deployment.path / ".roles.commit").read_text().strip()
+    (roles_repo_path / "web/defaults/main.yml").write_text("web_port: 8080\n")
+    git(roles_repo_path, "commit", "-q", "-am", "Local change")
+    (roles_repo_path / "base/defaults/main.yml").write_text("base_var: 2\n")
+    (roles_repo_path / "untracked.yml").write_text("local: 1\n")
+    head = git(roles_repo_path, "rev-parse", "HEAD")
+    status = git(roles_repo_path, "status", "--porcelain")
+    assert head.strip() != recorded_commit
+
+    deployment.run("unlock")
+
+    assert (deployment.path / "roles/web/defaults/main.yml").read_text() == "web_port: 80\n"
+    assert (deployment.path / "roles/base/defaults/main.yml").read_text() == "base_var: 1\n"
+    assert git(roles_repo_path, "rev-parse", "HEAD") == head
+    assert git(roles_repo_path, "status", "--porcelain") == status
+    assert (roles_repo_path / "base/defaults/main.yml").read_text() == "base_var: 2\n"
+
+
+def test_unlock_leaves_no_untracked_files(make_deployment):
+    deployment = make_deployment({"mode": "incremental", "git_bundles": True, "exclude_roles": True})
+    for revision in range(2):
+        deployment.run("lock")
+        deployment.run("unlock")
+        untracked = git(deployment.path, "status", "--porcelain", "--untracked-files=all")
+        assert not [
+            line for line in untracked.splitlines()
+            if line.split()[-1].startswith((".roles.commit", "deployment.objects", "deployment.bundles"))
+        ]
+        assert (deployment.path / "deployment.objects/manifest.enc").exists()
+        deployment.commit_file("group_vars/all", f"revision: {revision}\n")
+    deployment.run("lock")
+    assert deployment.locked
@@ -0,0 +1,32 @@
+"""
+Tests for the DeploymentRepo class.
+"""
+
+from ansible_deployment.deployment_repo import DeploymentRepo
+from conftest import git
+
+
+def test_stage(tmp_path):
+    repo_path = tmp_path / "repo"
+    for file_name in ("kept", "changed", "deleted", "directory/deleted"):
+        (repo_path / file_name).parent.mkdir(parents=True, exist_ok=True)
+        (repo_path / file_name).write_text("old\n")
+    git(tmp_path, "init", "-q", str(repo_path))
+    git(repo_path, "add", ".")
+    git(repo_path, "commit", "-q", "-m", "Add files")
+    (repo_path / "changed").write_text("new\n")
+    (repo_path / "added").write_text("new\n")
+    (repo_path / "deleted").unlink()
+    (repo_path / "directory/deleted").unlink()
+    (repo_path / "directory").rmdir()
+    deployment_repo = DeploymentRepo(repo_path)
+
+    deployment_repo.stage([
+        repo_path / "changed", repo_path / "added", repo_path / "added",
+        repo_path / "deleted", repo_path / "directory", repo_path / "never-existed",
+        tmp_path / "outside",
+    ])
+
+    assert git(repo_path, "status", "--porcelain").splitlines() == [
+        "A  added", "M  changed", "D  deleted", "D  directory/deleted",
+    ]
@@ -0,0 +1,116 @@
+"""
+Tests for the DeploymentVault class.
+"""
+
+import hashlib
+import io
+import tarfile
+import pytest
+from cryptography.fernet import Fernet
+from ansible_deployment import Deployment
+from ansible_deployment.deployment_vault import DeploymentVault
+from conftest import git
+
+FILES = {
+    "hosts.yml": b"all:\n  hosts:\n    h1:\n",
+    "group_vars/all": b"ansible_user: ansible\n",
+}
+FILES_IN_DEPLOYMENT = ("hosts.yml", "host_vars/h1", "group_vars/all")
+
+
+def write_legacy_archive(path, key):
+    """
+    Write a locked vault as written before the container format existed.
+    """
+    tar_stream = io.BytesIO()
+    with tarfile.open(fileobj=tar_stream, mode="w:gz") as tar:
+        for name, data in FILES.items():
+            tarinfo = tarfile.TarInfo(name)
+            tarinfo.size = len(data)
+            tar.addfile(tarinfo, io.BytesIO(data))
+    encrypted_tar = Fernet(key).encrypt(tar_stream.getvalue())
+    (path / "deployment.tar.gz.enc").write_bytes(encrypted_tar)
+    (path / "deployment.tar.gz.enc.SHA256").write_text(hashlib.sha256(encrypted_tar).hexdigest())
+    (path / ".LOCKED").touch()
+
+
+def test_read_legacy_archive(tmp_path):
+    key = Fernet.generate_key()
+    write_legacy_archive(tmp_path, key)
+    vault = DeploymentVault([], tmp_path, key)
+    assert vault.locked
+    assert vault.read_file("hosts.yml") == FILES["hosts.yml"]
+    assert dict(vault.read_files()) == FILES
+
+
+def test_unlock_legacy_archive(tmp_path):
+    key = Fernet.generate_key()
+    write_legacy_archive(tmp_path, key)
+    vault = DeploymentVault([], tmp_path, key)
+    vault.unlock()
+    assert not vault.locked
+    for name, data in FILES.items():
+        assert (tmp_path / name).read_bytes() == data
+
+
+VAULT_CONFIGS = {
+    "archive": {},
+    "archive-bundles": {"git_bundles": True},
+    "incremental-bundles": {"mode": "incremental", "git_bundles": True},
+}
+
+
+def load_vault(deployment):
+    return Deployment.load(deployment.path / "deployment.json").deployment_dir.vault
+
+
+@pytest.mark.parametrize("vault_config", VAULT_CONFIGS.values(), ids=VAULT_CONFIGS.keys())
+def test_rotate_key(make_deployment, vault_config):
+    deployment = make_deployment(vault_config)
+    for revision in range(3):
+        deployment.commit_file("group_vars/all", f"revision: {revision}\n")
+        deployment.run("lock")
+        deployment.run("unlock")
+    deployment.run("lock")
+    old_key = (deployment.path / "deployment.key").read_bytes()
+    expected = {name: load_vault(deployment).read_file(name) for name in FILES_IN_DEPLOYMENT}
+
+    deployment.run("rotate-key")
+
+    new_key = (deployment.path / "deployment.key").read_bytes()
+    assert new_key != old_key
+    assert not (deployment.path / "deployment.key.new").exists()
+    vault = load_vault(deployment)
+    assert {name: vault.read_file(name) for name in FILES_IN_DEPLOYMENT} == expected
+    assert deployment.shadow_tree() == deployment.shadow_files_on_disk()
+    deployment.run("unlock")
+    assert (deployment.path / "group_vars/all").read_text() == "revision: 2\n"
+    assert len(git(deployment.path, "log", "--oneline").splitlines()) >= 5
+
+
+@pytest.mark.parametrize("vault_config,corrupted_file", [
+    ({"git_bundles": True}, "deployment.bundles/chain.enc.SHA256"),
+    ({"git_bundles": True}, "deployment.tar.gz.enc.SHA256"),
+    ({"mode": "incremental", "git_bundles": True}, "deployment.objects/manifest.enc.SHA256"),
+], ids=["bundles", "archive", "objects"])
+def test_failed_rotate_key_keeps_vault(make_deployment, vault_config, corrupted_file):
+    deployment = make_deployment(vault_config)
+    deployment.run("lock")
+    before = {
+        path: path.read_bytes() for path in deployment.path.rglob("*")
+        if path.is_file() and path.relative_to(deployment.path).parts[0].startswith("deployment.")
+    }
+    corrupted_path = deployment.path / corrupted_file
+    corrupted_path.write_text("0" * 64)
+
+    assert deployment.run("rotate-key", check=False).returncode != 0
+
+    after = {
+        path: path.read_bytes() for path in deployment.path.rglob("*")
+        if path.is_file() and path.relative_to(deployment.path).parts[0].startswith("deployment.")
+    }
+    assert after.keys() == before.keys()
+    assert [path for path in before if before[path] != after[path]] == [corrupted_path]
+    corrupted_path.write_bytes(before[corrupted_path])
+    deployment.run("unlock")
+    assert (deployment.path / "hosts.yml").exists()
@@ -0,0 +1,20 @@
+"""
+Tests for the Inventory class.
+"""
+
+import pytest
+from ansible_deployment.inventory import Inventory
+
+
+def test_connection_details():
+    assert Inventory.connection_details(
+        "h1", {"ansible_host": "192.0.2.1", "ansible_port": 2222}, {"ansible_user": "admin"}
+    ) == {"ansible_host": "192.0.2.1", "ansible_user": "admin", "ansible_port": 2222}
+    assert Inventory.connection_details(
+        "h1", {"ansible_user": "root"}, {"ansible_user": "admin"}
+    ) == {"ansible_host": "h1", "ansible_user": "root", "ansible_port": "22"}
+
+
+def test_connection_details_without_user():
+    with pytest.raises(KeyError):
+        Inventory.connection_details("h1", {}, {})
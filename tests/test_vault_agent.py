@@ -0,0 +1,61 @@
+"""
+Tests for the vault agent.
+"""
+
+import tempfile
+import time
+import pytest
+from ansible_deployment import Deployment
+from ansible_deployment.vault_agent import agent_socket_path, start_agent
+
+
+def load_vault(deployment):
+    return Deployment.load(deployment.path / "deployment.json").deployment_dir.vault
+
+
+@pytest.fixture
+def agent_deployment(make_deployment, monkeypatch):
+    """
+    Locked deployment whose agent socket path fits the unix socket limit.
+    """
+    runtime_dir = tempfile.TemporaryDirectory(prefix="ad-")
+    monkeypatch.setenv("XDG_RUNTIME_DIR", runtime_dir.name)
+    deployment = make_deployment({"mode": "incremental"})
+    deployment.run("lock")
+    yield deployment
+    if agent_socket_path(deployment.path).is_socket():
+        deployment.run("agent", "stop")
+    runtime_dir.cleanup()
+
+
+def test_agent_serves_locked_vault(agent_deployment):
+    vault = load_vault(agent_deployment)
+    client = start_agent(agent_deployment.path)
+    state_sha256sum = vault.state_sha256sum
+
+    assert client.status()["state"] == state_sha256sum
+    assert client.read_file("host_vars/h1", state_sha256sum) == b"ansible_host: 192.0.2.1\n"
+    assert client.read_entries(state_sha256sum) == list(vault.read_entries(use_agent=False))
+    assert vault.read_file("host_vars/h1") == b"ansible_host: 192.0.2.1\n"
+    with pytest.raises(FileNotFoundError):
+        client.read_file("host_vars/h2", state_sha256sum)
+
+
+def test_agent_reloads_changed_vault(agent_deployment):
+    client = start_agent(agent_deployment.path)
+    agent_deployment.run("unlock")
+    agent_deployment.commit_file("host_vars/h1", "ansible_host: 192.0.2.2\n")
+    agent_deployment.run("lock")
+    state_sha256sum = load_vault(agent_deployment).state_sha256sum
+
+    assert client.read_file("host_vars/h1", state_sha256sum) == b"ansible_host: 192.0.2.2\n"
+    assert client.status()["state"] == state_sha256sum
+
+
+def test_agent_stop(agent_deployment):
+    client = start_agent(agent_deployment.path)
+    client.stop()
+    deadline = time.monotonic() + 10
+    while client.available() and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert not client.available()
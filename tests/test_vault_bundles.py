@@ -0,0 +1,47 @@
+"""
+Tests for the VaultBundleChain class.
+"""
+
+from ansible_deployment import Deployment
+from conftest import git
+
+
+def chain_files(deployment_path):
+    bundle_chain = Deployment.load(
+        deployment_path / "deployment.json"
+    ).deployment_dir.vault.bundle_chain
+    bundles = bundle_chain.load_manifest(bundle_chain.manifest_sha256sum_path.read_text())
+    return sorted(f"deployment.bundles/{bundle['file']}" for bundle in bundles)
+
+
+def bundle_files(file_names):
+    return sorted(name for name in file_names if name.endswith(".bundle.enc"))
+
+
+def test_compacted_bundles_leave_shadow_repo(make_deployment, tmp_path):
+    deployment = make_deployment({"git_bundles": True, "max_git_bundles": 2})
+    for revision in range(3):
+        deployment.commit_file("group_vars/all", f"revision: {revision}\n")
+        deployment.run("lock")
+        if revision < 2:
+            deployment.run("unlock")
+    referenced = chain_files(deployment.path)
+    assert len(referenced) == 1
+    assert bundle_files(deployment.shadow_tree()) == referenced
+    assert deployment.shadow_tree() == deployment.shadow_files_on_disk()
+
+    deployment.run("push")
+    deployment.run("pull")
+    assert bundle_files(
+        path.relative_to(deployment.path).as_posix()
+        for path in (deployment.path / "deployment.bundles").iterdir()
+    ) == referenced
+
+    clone_path = tmp_path / "clone"
+    git(tmp_path, "clone", "-q", str(tmp_path / "deployment.git"), str(clone_path))
+    assert bundle_files(
+        path.relative_to(clone_path).as_posix()
+        for path in (clone_path / "deployment.bundles").iterdir()
+    ) == referenced
+    deployment.run("unlock")
+    assert len(git(deployment.path, "log", "--oneline").splitlines()) >= 5
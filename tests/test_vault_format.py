@@ -0,0 +1,180 @@
+"""
+Tests for the vault container format.
+"""
+
+import io
+import os
+import pytest
+from cryptography.fernet import Fernet
+from ansible_deployment.vault_format import (
+    FRAME_HEADER,
+    MAGIC,
+    VaultFormatError,
+    VaultStreamReader,
+    VaultStreamWriter,
+    read_frame,
+    reencrypt,
+)
+
+FRAME_SIZE = 1024
+DATA = os.urandom(5 * FRAME_SIZE + 123)
+
+
+def encrypt_v2(data, key, threads=1):
+    """
+    Encrypt data as version 2 container.
+
+    Returns:
+        tuple: Container and frame offsets.
+    """
+    fobj = io.BytesIO()
+    with VaultStreamWriter(fobj, key, FRAME_SIZE, threads) as writer:
+        writer.write(data)
+    return fobj.getvalue(), writer.frame_offsets
+
+
+def encrypt_v1(data, key, frames=None):
+    """
+    Encrypt data as version 1 container.
+
+    Args:
+        frames (list): Frame indices and final flags to write instead of
+                       the regular sequence.
+    """
+    chunks = [data[offset:offset + FRAME_SIZE] for offset in range(0, len(data), FRAME_SIZE)]
+    if frames is None:
+        frames = [(index, index == len(chunks) - 1) for index in range(len(chunks))]
+    cipher_suite = Fernet(key)
+    lines = [b"%s1 %d\n" % (MAGIC, FRAME_SIZE)]
+    for frame_index, final in frames:
+        lines.append(
+            cipher_suite.encrypt(FRAME_HEADER.pack(frame_index, final) + chunks[frame_index])
+            + b"\n"
+        )
+    return b"".join(lines)
+
+
+def decrypt(container, key, threads=1):
+    with VaultStreamReader(io.BytesIO(container), key, threads) as reader:
+        return reader.read()
+
+
+def split_frames(container, frame_offsets):
+    header = container[:frame_offsets[0]]
+    ends = frame_offsets[1:] + [len(container)]
+    return header, [container[start:end] for start, end in zip(frame_offsets, ends)]
+
+
+@pytest.fixture
+def key():
+    return Fernet.generate_key()
+
+
+@pytest.mark.parametrize("threads", [1, 4])
+@pytest.mark.parametrize("size", [0, 1, FRAME_SIZE, len(DATA)])
+def test_v2_round_trip(key, threads, size):
+    container, _ = encrypt_v2(DATA[:size], key, threads)
+    assert container.startswith(MAGIC + b"2 ")
+    assert decrypt(container, key, threads) == DATA[:size]
+
+
+def test_v2_read_frame(key):
+    container, frame_offsets = encrypt_v2(DATA, key)
+    for frame_index, offset in enumerate(frame_offsets):
+        start = frame_index * FRAME_SIZE
+        assert read_frame(io.BytesIO(container), key, offset, frame_index) == \
+            DATA[start:start + FRAME_SIZE]
+
+
+def test_v2_wrong_key(key):
+    container, _ = encrypt_v2(DATA, key)
+    with pytest.raises(VaultFormatError, match="Authentication"):
+        decrypt(container, Fernet.generate_key())
+
+
+def test_v2_modified_ciphertext(key):
+    container, frame_offsets = encrypt_v2(DATA, key)
+    modified = bytearray(container)
+    modified[frame_offsets[2] + 10] ^= 1
+    with pytest.raises(VaultFormatError, match="Authentication of frame 2"):
+        decrypt(bytes(modified), key)
+
+
+def test_v2_modified_header(key):
+    container, _ = encrypt_v2(DATA, key)
+    header_end = container.index(b"\n")
+    modified = bytearray(container)
+    modified[header_end - 1] = ord("0") if modified[header_end - 1] != ord("0") else ord("1")
+    with pytest.raises(VaultFormatError):
+        decrypt(bytes(modified), key)
+
+
+@pytest.mark.parametrize("order", [[1, 0, 2, 3, 4, 5], [0, 1, 2, 4, 3, 5], [0, 0, 1, 2, 3, 4, 5]])
+def test_v2_reordered_frames(key, order):
+    container, frame_offsets = encrypt_v2(DATA, key)
+    header, frames = split_frames(container, frame_offsets)
+    with pytest.raises(VaultFormatError, match="Authentication"):
+        decrypt(header + b"".join(frames[index] for index in order), key)
+
+
+def test_v2_dropped_final_frame(key):
+    container, frame_offsets = encrypt_v2(DATA, key)
+    with pytest.raises(VaultFormatError, match="truncated"):
+        decrypt(container[:frame_offsets[-1]], key)
+
+
+def test_v2_truncated_frame(key):
+    container, _ = encrypt_v2(DATA, key)
+    with pytest.raises(VaultFormatError, match="truncated"):
+        decrypt(container[:-5], key)
+
+
+def test_v2_trailing_data(key):
+    container, frame_offsets = encrypt_v2(DATA, key)
+    header, frames = split_frames(container, frame_offsets)
+    with pytest.raises(VaultFormatError):
+        decrypt(container + frames[-1], key)
+
+
+def test_v1_round_trip(key):
+    assert decrypt(encrypt_v1(DATA, key), key) == DATA
+
+
+@pytest.mark.parametrize("frames,error", [
+    ([(1, False), (0, False), (2, False), (3, False), (4, False), (5, True)], "Unexpected frame"),
+    ([(0, False), (1, False), (2, False), (3, False), (4, False)], "truncated"),
+    ([(0, False), (1, False), (2, False), (3, False), (4, False), (5, True), (5, True)],
+     "Trailing data"),
+])
+def test_v1_tampered_frames(key, frames, error):
+    with pytest.raises(VaultFormatError, match=error):
+        decrypt(encrypt_v1(DATA, key, frames), key)
+
+
+def test_v1_modified_token(key):
+    container = bytearray(encrypt_v1(DATA, key))
+    second_line = container.index(b"\n") + 1
+    container[second_line + 20] = ord("A") if container[second_line + 20] != ord("A") else ord("B")
+    with pytest.raises(VaultFormatError, match="Authentication of frame 0"):
+        decrypt(bytes(container), key)
+
+
+@pytest.mark.parametrize("source", ["v1", "v2", "legacy"])
+def test_reencrypt(key, source):
+    new_key = Fernet.generate_key()
+    container = {
+        "v1": lambda: encrypt_v1(DATA, key),
+        "v2": lambda: encrypt_v2(DATA, key)[0],
+        "legacy": lambda: Fernet(key).encrypt(DATA),
+    }[source]()
+    dst = io.BytesIO()
+    reencrypt(io.BytesIO(container), dst, key, new_key)
+    assert decrypt(dst.getvalue(), new_key) == DATA
+    with pytest.raises(VaultFormatError):
+        decrypt(dst.getvalue(), key)
+
+
+def test_reencrypt_wrong_key(key):
+    container, _ = encrypt_v2(DATA, key)
+    with pytest.raises(VaultFormatError):
+        reencrypt(io.BytesIO(container), io.BytesIO(), Fernet.generate_key(), key)
@@ -0,0 +1,45 @@
+"""
+Tests for the VaultObjectStore class.
+"""
+
+import json
+from ansible_deployment import Deployment
+
+
+def test_pruned_objects_leave_shadow_repo(make_deployment):
+    deployment = make_deployment({"mode": "incremental"})
+    for revision in range(3):
+        deployment.commit_file("group_vars/all", f"revision: {revision}\n")
+        deployment.run("lock")
+        object_store = Deployment.load(
+            deployment.path / "deployment.json"
+        ).deployment_dir.vault.object_store
+        manifest = object_store.load_manifest(object_store.manifest_sha256sum_path.read_text())
+        referenced = {entry["object"] for entry in manifest.values() if "object" in entry}
+        tracked = {
+            "".join(name.split("/")[-2:]) for name in deployment.shadow_tree()
+            if name.startswith("deployment.objects/objects/")
+        }
+        assert tracked == referenced
+        assert deployment.shadow_tree() == deployment.shadow_files_on_disk()
+        deployment.run("unlock")
+
+
+def test_switch_to_incremental_mode(make_deployment):
+    deployment = make_deployment()
+    deployment.run("lock")
+    assert "deployment.tar.gz.enc.SHA256" in deployment.shadow_tree()
+    deployment.run("unlock")
+    config = json.loads((deployment.path / "deployment.json").read_text())
+    config["vault"] = {"mode": "incremental"}
+    deployment.commit_file("deployment.json", json.dumps(config))
+
+    deployment.run("lock")
+
+    assert deployment.shadow_tree() == deployment.shadow_files_on_disk()
+    assert "deployment.tar.gz.enc.SHA256" not in deployment.shadow_tree()
+    assert "deployment.index.enc" not in deployment.shadow_tree()
+    vault = Deployment.load(deployment.path / "deployment.json").deployment_dir.vault
+    assert vault.state_sha256sum == vault.object_store.manifest_sha256sum_path.read_text()
+    deployment.run("unlock")
+    assert (deployment.path / "host_vars/h1").read_text() == "ansible_host: 192.0.2.1\n"